@@ -0,0 +1,207 @@
+""" Per-stage benchmarks of the document pipeline over the bundled templates
+
+Run from the repository root:
+    python -m benchmarks.run --rows 1 10 100 1000 10000
+    python -m benchmarks.run --save-baseline
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from importlib.metadata import version
+from pathlib import Path
+from time import perf_counter, process_time
+from typing import Any
+
+from core.templates import bundle_registry, get_template_path, get_tmpl_bundles
+from core.autofill import generate_rows
+from core.batch import validate_row, dump_row
+from core.features.n2w import n2w_batch, generate_n2w_fields_many
+from core.template_cache import template_cache
+
+TEMPLATES = ["_TestComputed", "_TestNested", "_TestNum2Words", "_TestRepeatable", "Доверенность"]
+STAGES = ["load", "validate", "n2w", "model_dump", "render", "save"]
+
+BENCH_PATH = Path(__file__).parent
+RESULTS_PATH = BENCH_PATH / "results.json"
+BASELINE_PATH = BENCH_PATH / "baseline.json"
+
+
+class Stages:
+    """ Accumulated wall time, CPU time and memory peak of every stage
+
+    Attributes:
+        trace_memory: whether to measure memory peaks with tracemalloc
+    """
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stats: dict[str, dict[str, float]] = defaultdict(lambda: dict(wall=0, cpu=0, ops=0, peak=0))
+
+    @contextmanager
+    def measure(self, stage: str, ops: int = 1) -> Iterator[None]:
+        if self.trace_memory:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        wall, cpu = perf_counter(), process_time()
+        yield
+        stats = self.stats[stage]
+        stats["wall"] += perf_counter() - wall
+        stats["cpu"] += process_time() - cpu
+        stats["ops"] += ops
+
+        if self.trace_memory:
+            # noinspection PyUnboundLocalVariable
+            stats["peak"] = max(stats["peak"], tracemalloc.get_traced_memory()[1] - current)
+
+
+def run_pipeline(tmpl_name: str, rows: list[dict[str, Any]], stages: Stages, out_dir: Path):
+    tmpl_path = get_template_path(tmpl_name)
+
+    with stages.measure("load"):
+        bundle_registry.invalidate(tmpl_path.parent)
+        bundles = get_tmpl_bundles(tmpl_path.parent)
+
+    with stages.measure("validate", len(rows)):
+        with n2w_batch() as deferred:
+            instances = [validate_row(bundles, row) for row in rows]
+            n2w_instances = list(deferred)
+            deferred.clear()  # n2w generation is measured as a separate stage
+
+    with stages.measure("n2w", len(rows)):
+        generate_n2w_fields_many(n2w_instances)
+
+    with stages.measure("model_dump", len(rows)):
+        contexts = [dump_row(row_instances) for row_instances in instances]
+
+    # rendered documents are saved right away, so they are not all kept in memory
+    for context in contexts:
+        with stages.measure("render"):
+            doc = template_cache.get(tmpl_path)
+            doc.render(context)
+
+        with stages.measure("save"):
+            doc.save(out_dir / "result.docx")
+
+
+def benchmark(templates: list[str], row_counts: list[int], trace_memory: bool, seed: int) -> list[dict[str, Any]]:
+    results = []
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        for tmpl_name in templates:
+            tmpl_path = get_template_path(tmpl_name)
+            for count in row_counts:
+                rows = list(generate_rows(tmpl_path.parent, count, seed))
+                # warm up, template preparation and first-call costs are not a part of any stage
+                run_pipeline(tmpl_name, rows[:1], Stages(), Path(out_dir))
+
+                timings = Stages()
+                run_pipeline(tmpl_name, rows, timings, Path(out_dir))
+
+                memory = Stages(trace_memory=True)
+                if trace_memory:
+                    tracemalloc.start()
+                    run_pipeline(tmpl_name, rows, memory, Path(out_dir))
+                    tracemalloc.stop()
+
+                for stage in STAGES:
+                    stats = timings.stats[stage]
+                    results.append(dict(
+                        template=tmpl_name,
+                        rows=count,
+                        stage=stage,
+                        ops=stats["ops"],
+                        wall_s=round(stats["wall"], 6),
+                        cpu_s=round(stats["cpu"], 6),
+                        per_op_ms=round(stats["wall"] / stats["ops"] * 1000, 4) if stats["ops"] else 0,
+                        peak_kib=round(memory.stats[stage]["peak"] / 1024, 1) if trace_memory else None,
+                    ))
+                    print(
+                        f"{tmpl_name:>16} {count:>6} rows {stage:>10}: "
+                        f"{results[-1]['wall_s']:>10.4f}s wall, {results[-1]['per_op_ms']:>9.3f}ms/op"
+                        + (f", {results[-1]['peak_kib']:>10.1f}KiB peak" if trace_memory else "")
+                    )
+
+    return results
+
+
+def compare(results: list[dict[str, Any]], baseline: list[dict[str, Any]], threshold: float) -> list[str]:
+    """ Find stages that got slower than the baseline by more than the threshold
+
+    Differences under 0.05ms per operation are ignored as noise.
+    """
+    base = {(res["template"], res["rows"], res["stage"]): res for res in baseline}
+    regressions = []
+
+    for res in results:
+        old = base.get((res["template"], res["rows"], res["stage"]))
+        if not old:
+            continue
+
+        if res["per_op_ms"] > old["per_op_ms"] * (1 + threshold) and res["per_op_ms"] - old["per_op_ms"] > 0.05:
+            regressions.append(
+                f"{res['template']} {res['rows']} rows {res['stage']}: "
+                f"{old['per_op_ms']:.3f}ms -> {res['per_op_ms']:.3f}ms per op"
+            )
+
+    return regressions
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="benchmarks.run")
+    parser.add_argument("--templates", nargs="+", default=TEMPLATES, help="Names of the template directories")
+    parser.add_argument("--rows", nargs="+", type=int, default=[1, 10, 100], help="Row counts, from 1 to 10000")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated data")
+    parser.add_argument("--output", type=Path, default=RESULTS_PATH, help="Where to write the results")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown, 0.2 is 20%%")
+
+    args = parser.parse_args(argv)
+    if any(count < 1 or count > 10_000 for count in args.rows):
+        parser.error("row counts must be from 1 to 10000")
+
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+
+    results = benchmark(args.templates, args.rows, not args.no_memory, args.seed)
+    report = dict(
+        meta=dict(
+            date=datetime.now().isoformat(timespec="seconds"),
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            packages={name: version(name) for name in ("docxtpl", "python-docx", "jinja2", "pydantic", "num2words")},
+        ),
+        results=results,
+    )
+
+    output = args.baseline if args.save_baseline else args.output
+    with open(output, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, ensure_ascii=False, indent=2)
+    print(f"Results are written to {output}")
+
+    if args.save_baseline or not args.baseline.exists():
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as fp:
+        regressions = compare(results, json.load(fp)["results"], args.threshold)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions against {args.baseline}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+""" Thin client of the DocumentFormatter daemon (main.py daemon)
+
+Usage: client.py [--socket PATH] [main.py arguments]
+
+Takes the same arguments as main.py. The session runs in the daemon with warm templates,
+only the input and the output go through the socket. Without a running daemon the session runs here.
+The socket is the daemon's default one, or the one given with --socket like to the daemon.
+"""
+import json
+import os
+import runpy
+import socket
+import sys
+from pathlib import Path
+
+from core.config import DAEMON_SOCKET
+
+
+def _run_locally(argv: list[str]) -> int:
+    sys.argv = ["main.py", *argv]
+    try:
+        runpy.run_module("main", run_name="__main__")
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+
+    return 0
+
+
+def split_socket(argv: list[str]) -> tuple[Path, list[str]]:
+    """ Socket given before the arguments of main.py, and the arguments """
+    if argv[:1] == ["--socket"] and len(argv) > 1:
+        return Path(argv[1]), argv[2:]
+    if argv and argv[0].startswith("--socket="):
+        return Path(argv[0].removeprefix("--socket=")), argv[1:]
+
+    return DAEMON_SOCKET, argv
+
+
+def run_client(argv: list[str], socket_path: Path = DAEMON_SOCKET) -> int:
+    if not hasattr(socket, "AF_UNIX"):
+        return _run_locally(argv)
+
+    conn = socket.socket(socket.AF_UNIX)
+    try:
+        conn.connect(str(socket_path))
+    except OSError:
+        conn.close()
+        return _run_locally(argv)
+
+    with conn, conn.makefile("rb") as rfile, conn.makefile("wb") as wfile:
+        def send(**message):
+            wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode())
+            wfile.flush()
+
+        send(argv=argv, cwd=os.getcwd())
+        for line in rfile:
+            message = json.loads(line)
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "err" in message:
+                sys.stderr.write(message["err"])
+                sys.stderr.flush()
+            elif "read" in message:
+                if text := sys.stdin.readline():
+                    send(line=text.removesuffix("\n"))
+                else:
+                    send(eof=True)
+            elif "exit" in message:
+                return message["exit"]
+
+    print("Daemon closed the connection", file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    socket_path, main_argv = split_socket(sys.argv[1:])
+    try:
+        sys.exit(run_client(main_argv, socket_path))
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from pydantic import ValidationError
+
+from core.batch import build_context
+from core.config import TEMPLATES_PATH, OUTPUT_PATH, SAMPLES_PATH, WATCH_INTERVAL
+from core.manifest import template_manifest
+from core.render import render_document
+from core.templates import get_template_path, get_tmpl_bundles, list_templates
+from core.watcher import FileWatcher
+
+
+class SampleRender:
+    """ Renders a template with a saved sample row, again after every change of the template
+
+    The sample is taken from a JSON file, or generated by the AUTO_FILL factory and saved to
+    SAMPLES_PATH, so the next sessions render the same document. A generated sample that does
+    not fit changed bundles is generated again.
+
+    Attributes:
+        name: name of the template directory
+        sample_path: JSON file with the sample row
+        generated: whether the sample is generated
+        output_path: path of the rendered document, the same for every render
+    """
+    def __init__(self, name: str, sample_path: Path | None = None):
+        self.name = name
+        self.generated = sample_path is None
+        self.sample_path = sample_path or SAMPLES_PATH / f"{name}.json"
+        self.output_path = OUTPUT_PATH / f"{name}_sample.docx"
+
+    def _generate(self) -> dict[str, Any]:
+        from core.autofill import generate_row
+
+        row = generate_row(get_tmpl_bundles(TEMPLATES_PATH / self.name))
+        self.sample_path.parent.mkdir(exist_ok=True, parents=True)
+        self.sample_path.write_text(json.dumps(row, ensure_ascii=False, indent=2), encoding="utf-8")
+        logger.info(f"{self.name}: generated a sample in {self.sample_path}")
+
+        return row
+
+    def load_sample(self, regenerate: bool = False) -> dict[str, Any]:
+        if self.generated and (regenerate or not self.sample_path.is_file()):
+            return self._generate()
+
+        with open(self.sample_path, encoding="utf-8") as fp:
+            return json.load(fp)
+
+    def render(self):
+        started = time.perf_counter()
+        tmpl_path = get_template_path(self.name)
+        bundles = get_tmpl_bundles(tmpl_path.parent)
+        variables = template_manifest.get_variables(tmpl_path)
+
+        row = self.load_sample()
+        try:
+            context = build_context(bundles, row, variables)
+        except ValidationError as e:
+            if not self.generated:
+                raise ValueError(f"Sample {self.sample_path} does not fit the bundles: {e}") from e
+
+            logger.warning(f"{self.name}: the sample does not fit the changed bundles, generating a new one")
+            context = build_context(bundles, self.load_sample(regenerate=True), variables)
+        loaded = time.perf_counter()
+
+        OUTPUT_PATH.mkdir(exist_ok=True, parents=True)
+        render_document(tmpl_path, context, self.output_path)
+        finished = time.perf_counter()
+
+        logger.info(
+            f"{self.name}: rendered {self.output_path} in {(finished - started) * 1000:.0f} ms "
+            f"(bundles and context {(loaded - started) * 1000:.0f} ms, render {(finished - loaded) * 1000:.0f} ms)"
+        )
+
+
+def _changed_templates(changed: set[Path]) -> set[str]:
+    """ Names of the template directories the changed files are in """
+    names = set()
+    for path in changed:
+        try:
+            names.add(path.relative_to(TEMPLATES_PATH).parts[0])
+        except (ValueError, IndexError):
+            continue
+
+    return names
+
+
+def watch_templates(
+    names: list[str] | None = None,
+    sample_path: Path | None = None,
+    interval: float = WATCH_INTERVAL
+):
+    """ Render the templates with their samples and render each one again when its directory changes
+
+    Runs until interrupted with Ctrl+C.
+
+    Args:
+        names: names of the template directories, all the templates if empty
+        sample_path: JSON file with the sample row, for a single template only
+        interval: seconds between the checks of the files
+    """
+    names = names or list_templates()
+    if sample_path is not None and len(names) != 1:
+        raise ValueError("A sample file can be given for a single template only")
+
+    renders = {name: SampleRender(name, sample_path) for name in names}
+    watched = {sample_path.resolve()} if sample_path else set()
+
+    def render(names_to_render: set[str]):
+        for name in sorted(names_to_render):
+            try:
+                renders[name].render()
+            except Exception as e:
+                logger.error(f"{name}: {e}")
+
+    def on_change(changed: set[Path]):
+        names_to_render = _changed_templates(changed) & renders.keys()
+        if watched & {path.resolve() for path in changed}:
+            names_to_render |= renders.keys()
+        render(names_to_render)
+
+    render(set(renders))
+    watcher = FileWatcher(TEMPLATES_PATH, (".docx", ".py"), interval, files=tuple(watched))
+    logger.info(f"Watching {', '.join(names)} for changes, press Ctrl+C to stop")
+
+    try:
+        watcher.watch(on_change, threading.Event())
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
@@ -0,0 +1,194 @@
+import json
+import random
+from collections.abc import Callable, Iterator
+from datetime import date, datetime, timedelta
+from enum import Enum
+from pathlib import Path
+from types import new_class
+from typing import Any, get_args
+from weakref import WeakKeyDictionary
+
+from loguru import logger
+from polyfactory import Use
+from polyfactory.factories.pydantic_factory import ModelFactory
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+
+from core.templates import get_tmpl_bundles
+from core.batch import render_batch
+from core.common_bundles.base import BaseBundle
+from core.common_bundles.object import OBJECT_ID_PATTERN
+from core.common_fields import DATE_PATTERN
+from core.features.n2w import Num2WordsBundle
+from core.features.repeatable import RepeatableBundle
+
+_factories: WeakKeyDictionary[type[BaseModel], type[ModelFactory]] = WeakKeyDictionary()
+
+
+def _random_date() -> str:
+    return (date(1950, 1, 1) + timedelta(days=random.randint(0, 365 * 80))).strftime("%d.%m.%Y")
+
+
+def _random_object_id() -> str:
+    # an id has two digits at least, the first segment alone is a whole id
+    first = str(random.randint(10, 99999))
+    return ".".join([first, *(str(random.randint(1, 99999)) for _ in range(random.randint(0, 4)))])
+
+
+def _get_n2w_provider(annotation) -> Callable[[], int | float | str]:
+    """ Provider of num2wordable values for the annotation, random strings are not num2wordable """
+    types = set(get_args(annotation)) or {annotation}
+    providers = []
+    if int in types:
+        providers.append(lambda: random.randint(0, 10000))
+    if float in types:
+        providers.append(lambda: round(random.uniform(0, 1000), 2))
+    if str in types:
+        providers.append(_random_object_id)
+
+    return lambda: random.choice(providers)()
+
+
+# realistic values for fields with these patterns, polyfactory only guarantees the match
+PATTERN_PROVIDERS: dict[str, Callable[[], Any]] = {
+    DATE_PATTERN: _random_date,
+    OBJECT_ID_PATTERN: _random_object_id,
+}
+
+
+def _get_pattern(info: FieldInfo) -> str | None:
+    for meta in info.metadata:
+        if pattern := getattr(meta, "pattern", None):
+            return pattern
+
+    return None
+
+
+def _get_overrides(bundle: type[BaseModel]) -> dict[str, Use]:
+    n2w_fields = dict(bundle.n2w_fields) if issubclass(bundle, Num2WordsBundle) else {}
+    overrides = {}
+
+    for name, info in bundle.model_fields.items():
+        annotation = info.annotation
+
+        if isinstance(annotation, type) and issubclass(annotation, BaseBundle):
+            overrides[name] = Use(lambda nested=annotation: get_factory(nested).build())
+        elif provider := PATTERN_PROVIDERS.get(_get_pattern(info)):
+            overrides[name] = Use(provider)
+        elif name in n2w_fields:
+            overrides[name] = Use(_get_n2w_provider(annotation))
+
+    return overrides
+
+
+def get_factory[T: BaseModel](bundle: type[T]) -> type[ModelFactory[T]]:
+    """ Get the cached polyfactory factory of the bundle """
+    if (factory := _factories.get(bundle)) is None:
+        factory = new_class(
+            bundle.__name__ + "Factory",
+            (ModelFactory[bundle],),
+            {},
+            lambda ns: ns.update(_get_overrides(bundle))
+        )
+        _factories[bundle] = factory
+
+    return factory
+
+
+def bundle_data(instance: BaseModel) -> dict[str, Any]:
+    """ Get the input data of a bundle instance, the way it would be entered by user """
+    data = {}
+    for name in type(instance).model_fields:
+        value = getattr(instance, name)
+        if isinstance(value, BaseModel):
+            value = bundle_data(value)
+        elif isinstance(value, Enum):
+            value = value.value
+        data[name] = value
+
+    return data
+
+
+def generate_row(bundles: list[type[BaseModel]], max_repeat: int = 3) -> dict[str, Any]:
+    """ Generate a complete and valid data row for the template's bundles
+
+    Args:
+        bundles: bundles of the template
+        max_repeat: maximal count of instances of a repeatable bundle
+    """
+    row = {}
+    for bundle in bundles:
+        factory = get_factory(bundle)
+
+        if issubclass(bundle, RepeatableBundle):
+            row[bundle.result_var_name] = [
+                bundle_data(factory.build())
+                for _ in range(random.randint(1, max_repeat))
+            ]
+            continue
+
+        row.update(bundle_data(factory.build()))
+
+    return row
+
+
+def generate_rows(tmpl_path: Path, count: int, seed: int | None = None) -> Iterator[dict[str, Any]]:
+    """ Generate data rows for the template in the tmpl_path directory
+
+    Args:
+        tmpl_path: path to the template directory
+        count: number of rows
+        seed: seed for reproducible data
+    """
+    bundles = get_tmpl_bundles(tmpl_path)
+    if seed is not None:
+        random.seed(seed)
+        ModelFactory.seed_random(seed)
+
+    for _ in range(count):
+        yield generate_row(bundles)
+
+
+def write_rows(rows: Iterator[dict[str, Any]], data_path: Path) -> int:
+    """ Write rows to a .jsonl file which can be used for batch rendering
+
+    Returns:
+        int: number of the written rows
+    """
+    count = 0
+    with open(data_path, "w", encoding="utf-8") as fp:
+        for row in rows:
+            fp.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+
+    return count
+
+
+def run_load_test(tmpl_path: Path, count: int, workers: int | None = None, seed: int | None = None) -> int:
+    """ Render count documents from generated data and log the throughput
+
+    Args:
+        tmpl_path: path to the template .docx
+        count: number of documents
+        workers: number of worker processes, defaults to the number of CPUs
+        seed: seed for reproducible data
+
+    Returns:
+        int: number of failed documents
+    """
+    failed = 0
+    started = datetime.now()
+
+    for res in render_batch(tmpl_path, generate_rows(tmpl_path.parent, count, seed), workers):
+        if not res.ok:
+            failed += 1
+            logger.error(f"Row {res.index}: {res.error}")
+
+        if res.index % 1000 == 0:
+            elapsed = (datetime.now() - started).total_seconds()
+            logger.info(f"{res.index}/{count} documents, {res.index / elapsed:.1f} docs/s")
+
+    elapsed = (datetime.now() - started).total_seconds()
+    logger.info(f"Load test: {count} documents in {elapsed:.2f}s, {count / elapsed:.1f} docs/s, {failed} failed")
+
+    return failed
@@ -1,6 +1,4 @@
-from pydantic import BaseModel, field_validator
-
-from core.tools import Numeric
+from pydantic import BaseModel
 
 
 class BaseMarker(BaseModel):
@@ -26,23 +24,3 @@ class Repeatable(BaseMarker):
     result_field_desc: str
     min_count: int = 1
 
-
-class Num2Wordable(BaseMarker):
-    """ Mark bundle for num2words processing
-
-    Attributes:
-        num2words_fields: a set of tuples, each containing the name of a field and
-            the result name after being converted by num2words
-    """
-    num2words_fields: set[tuple[str, str]]
-
-    @classmethod
-    @field_validator("num2words_fields")
-    def fields_numeric_or_str(cls, v: set[tuple[str, str]]):
-        for f_name, res_f_name in v:
-            f_info = cls.model_fields.get(f_name)
-
-            if not isinstance(f_info.annotation, (Numeric, str)):
-                raise ValueError("Must be int, float or str")
-
-        return v
@@ -0,0 +1,567 @@
+import csv
+import io
+import json
+import os
+import pickle
+import uuid
+from collections import deque
+from collections.abc import Callable, Collection, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import batched, chain
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from pydantic import BaseModel
+
+from core.client_store import client_store
+from core.config import OUTPUT_PATH, LAZY_CONTEXT, CLIENT_STORE, DOCX_COMPRESSION_LEVEL, PREVALIDATE
+from core.render import render_document
+from core.templates import get_tmpl_bundles
+from core.features.external import prefetch_rows
+from core.features.n2w import n2w_batch
+from core.features.repeatable import RepeatableBundle
+from core.lazy_context import LazyBundle, lazy_context
+from core.manifest import template_manifest
+from core.packaging import DocumentBundle
+from core.prevalidation import prevalidate, format_report, group_errors
+from core.tracing import span
+from core.validation import validate_bundle
+
+# state of the current worker process, filled by _init_worker
+_worker: dict[str, Any] = {}
+
+
+@dataclass
+class RowResult:
+    """ Outcome of rendering a single data row
+
+    Attributes:
+        index: number of the row in the data file, starting from 1
+        ok: whether the document was rendered
+        path: path to the rendered document
+        error: description of the failure
+        cached: whether the document was taken from the output cache
+        data: the rendered document, when it is rendered to memory, path is its name then
+    """
+    index: int
+    ok: bool
+    path: Path | None = None
+    error: str | None = None
+    cached: bool = False
+    data: bytes | None = None
+
+
+def _unflatten(row: dict[str, Any]) -> dict[str, Any]:
+    """ Turn dotted keys into nested data
+
+    ``rus.f_passport_no`` becomes ``{"rus": {"f_passport_no": ...}}`` and
+    ``citizen_datas.0.f_name`` becomes ``{"citizen_datas": [{"f_name": ...}]}``.
+    """
+    result: dict[str, Any] = {}
+    for key, value in row.items():
+        *path, last = key.split(".")
+        node = result
+        for part in path:
+            node = node.setdefault(part, {})
+        node[last] = value
+
+    def to_lists(node: Any) -> Any:
+        if not isinstance(node, dict):
+            return node
+        if node and all(key.isdigit() for key in node):
+            return [to_lists(node[key]) for key in sorted(node, key=int)]
+        return {key: to_lists(value) for key, value in node.items()}
+
+    return to_lists(result)
+
+
+def output_stamp() -> str:
+    """ Part of the names of the documents of a session, unique across the processes and the hosts """
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def read_rows(data_path: Path) -> Iterator[dict[str, Any]]:
+    """ Read bundle data rows from a .jsonl or .csv file
+
+    Empty CSV cells are treated as missing, so bundle defaults apply to them
+    and fields that accept None are None, like empty answers in the interactive session.
+    """
+    data_path = Path(data_path)
+
+    with open(data_path, "r", encoding="utf-8", newline="") as fp:
+        if data_path.suffix == ".jsonl":
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+        elif data_path.suffix == ".csv":
+            for row in csv.DictReader(fp):
+                yield _unflatten({key: value for key, value in row.items() if value != ""})
+        else:
+            raise ValueError(f"Unsupported data file format '{data_path.suffix}', expected .csv or .jsonl")
+
+
+class RepeatableStream:
+    """ Instances of a repeatable bundle, validated one by one as the template iterates over them
+
+    Only the current instance is kept in memory, so repeatable bundles can be fed
+    with any number of rows. A stream made from a file can be iterated many times,
+    one made from an iterator only once.
+
+    Attributes:
+        bundle: the repeatable bundle
+        data_path: the data file, None for streams of an iterator
+    """
+    def __init__(
+        self,
+        bundle: type[BaseModel],
+        rows: Iterable[dict[str, Any]] | Callable[[], Iterable[dict[str, Any]]],
+        data_path: Path | None = None
+    ):
+        self.bundle = bundle
+        self.data_path = data_path
+        self._rows = rows
+
+    @classmethod
+    def from_file(cls, bundle: type[BaseModel], data_path: Path) -> "RepeatableStream":
+        """ Stream the instances from a .jsonl or .csv file, see read_rows """
+        if not Path(data_path).is_file():
+            raise ValueError(f"Data file {data_path} of {bundle.result_var_name} does not exist")
+
+        return cls(bundle, lambda: read_rows(data_path), data_path)
+
+    def digest(self) -> str | None:
+        """ Content hash of the data file, None for streams of an iterator """
+        from core.output_cache import output_cache
+
+        return output_cache.file_digest(self.data_path) if self.data_path else None
+
+    def __iter__(self) -> Iterator[Any]:
+        if callable(self._rows):
+            rows = self._rows()
+        elif self._rows is not None:
+            rows, self._rows = self._rows, None
+        else:
+            raise ValueError(f"Rows of {self.bundle.result_var_name} can be iterated only once")
+
+        for index, row in enumerate(rows, start=1):
+            try:
+                with n2w_batch(generate=not LAZY_CONTEXT):
+                    instance = validate_bundle(self.bundle, row)
+            except ValueError as e:
+                raise ValueError(f"Row {index} of {self.bundle.result_var_name} is invalid: {e}") from e
+
+            yield LazyBundle(instance) if LAZY_CONTEXT else instance.model_dump()
+
+
+def validate_row(
+    bundles: list[type[BaseModel]],
+    row: dict[str, Any],
+    streams: bool = True
+) -> list[tuple[type[BaseModel], BaseModel | list[BaseModel] | RepeatableStream]]:
+    """ Validate a data row against the template's bundles
+
+    A repeatable bundle takes either a list of items or a path to a .jsonl/.csv file,
+    the file is not read here but streamed with RepeatableStream during rendering.
+
+    Args:
+        bundles: bundles of the template
+        row: bundle data
+        streams: whether repeatable bundles can be read from data files, off for untrusted rows
+
+    Returns:
+        list: each bundle with its instance, or the list of instances or the stream for repeatable bundles
+
+    Raises:
+        ValidationError: if the row does not fit one of the bundles
+        ValueError: if the row, a repeatable bundle or its item is not of the expected type
+    """
+    if not isinstance(row, dict):
+        raise ValueError(f"A row must be an object, got {type(row).__name__}")
+
+    instances = []
+    for bundle in bundles:
+        if issubclass(bundle, RepeatableBundle):
+            name = bundle.result_var_name
+            items = row.get(name) or []
+            # a path to a data file is streamed during rendering
+            if isinstance(items, str) and streams:
+                instances.append((bundle, RepeatableStream.from_file(bundle, Path(items))))
+                continue
+            if not isinstance(items, list):
+                raise ValueError(f"{name} must be a list{' or a path to a data file' if streams else ''}")
+            if (number := next((i for i, item in enumerate(items) if not isinstance(item, dict)), None)) is not None:
+                raise ValueError(f"Item {number} of {name} must be an object, got {type(items[number]).__name__}")
+
+            instances.append((bundle, [validate_bundle(bundle, item) for item in items]))
+            continue
+
+        instances.append((bundle, validate_bundle(bundle, row)))
+
+    return instances
+
+
+def dump_row(instances: list[tuple[type[BaseModel], BaseModel | list[BaseModel]]]) -> dict[str, Any]:
+    """ Build the render context from the validated bundles of a row """
+    context = {}
+    for bundle, instance in instances:
+        if isinstance(instance, BaseModel):
+            context.update(instance.model_dump())
+        elif isinstance(instance, list):
+            context[bundle.result_var_name] = [item.model_dump() for item in instance]
+        else:
+            # streams yield ready to render items
+            context[bundle.result_var_name] = instance
+
+    return context
+
+
+def make_context(
+    instances: list[tuple[type[BaseModel], BaseModel | list[BaseModel]]],
+    variables: Collection[str] | None = None
+) -> dict[str, Any]:
+    """ Build the render context, lazy one if LAZY_CONTEXT is on
+
+    Args:
+        instances: each bundle with its instance, or the list of instances for repeatable bundles
+        variables: top-level names the template references, used by the lazy context only
+    """
+    with span("model_dump", lazy=LAZY_CONTEXT):
+        if LAZY_CONTEXT:
+            return lazy_context(instances, variables)
+
+        return dump_row(instances)
+
+
+def build_context(
+    bundles: list[type[BaseModel]],
+    row: dict[str, Any],
+    variables: Collection[str] | None = None,
+    streams: bool = True
+) -> dict[str, Any]:
+    """ Validate a data row against the template's bundles and build the render context
+
+    Args:
+        bundles: bundles of the template
+        row: bundle data
+        variables: top-level names the template references, None if they are unknown
+        streams: whether repeatable bundles can be read from data files
+
+    Raises:
+        ValidationError: if the row does not fit one of the bundles
+        ValueError: if the row is not of the expected shape, see validate_row
+    """
+    # num2words fields of the whole row are generated in one pass, or on access by the lazy context
+    with n2w_batch(generate=not LAZY_CONTEXT):
+        instances = validate_row(bundles, row, streams)
+
+    return make_context(instances, variables)
+
+
+def _init_worker(
+    tmpl_path: Path,
+    stamp: str,
+    variables: set[str] | None,
+    in_memory: bool = False,
+    compresslevel: int | None = DOCX_COMPRESSION_LEVEL
+):
+    tmpl_dir = tmpl_path.parent
+
+    _worker.update(
+        tmpl_path=tmpl_path,
+        tmpl_name=tmpl_dir.name.removeprefix("_"),
+        bundles=get_tmpl_bundles(tmpl_dir),
+        stamp=stamp,
+        variables=variables,
+        in_memory=in_memory,
+        compresslevel=compresslevel,
+    )
+    if not in_memory:
+        OUTPUT_PATH.mkdir(exist_ok=True, parents=True)
+
+
+def _render_row(task: tuple[int, dict[str, Any]]) -> RowResult:
+    index, row = task
+
+    try:
+        with span("row", template=_worker["tmpl_name"], index=index):
+            context = build_context(_worker["bundles"], row, _worker["variables"])
+
+            if _worker["in_memory"]:
+                buffer = io.BytesIO()
+                cached = render_document(_worker["tmpl_path"], context, buffer, _worker["compresslevel"])
+                return RowResult(
+                    index, True, path=Path(f"{_worker['tmpl_name']}_{index}.docx"), cached=cached, data=buffer.getvalue()
+                )
+
+            result_path = OUTPUT_PATH / f"{_worker['tmpl_name']}_{_worker['stamp']}_{index}.docx"
+            cached = render_document(_worker["tmpl_path"], context, result_path, _worker["compresslevel"])
+    except Exception as e:
+        return RowResult(index, False, error=f"{type(e).__name__}: {e}")
+
+    return RowResult(index, True, path=result_path, cached=cached)
+
+
+def _render_rows(tasks: tuple[tuple[int, dict[str, Any]], ...]) -> list[RowResult]:
+    return [_render_row(task) for task in tasks]
+
+
+def _render_job(job: tuple[int, Path, dict[str, Any], Path]) -> RowResult:
+    index, tmpl_path, context, result_path = job
+
+    try:
+        with span("document", template=tmpl_path.parent.name):
+            cached = render_document(tmpl_path, context, result_path)
+    except Exception as e:
+        return RowResult(index, False, error=f"{type(e).__name__}: {e}")
+
+    return RowResult(index, True, path=result_path, cached=cached)
+
+
+def _is_picklable(context: dict[str, Any]) -> bool:
+    try:
+        pickle.dumps(context)
+    except Exception:
+        return False
+
+    return True
+
+
+def render_many(jobs: list[tuple[Path, dict[str, Any], Path]], workers: int | None = None) -> list[RowResult]:
+    """ Render documents from ready contexts concurrently, like the ones of several templates filled at once
+
+    Contexts are sent to a pool of worker processes. The ones that can not be sent,
+    like contexts with repeatable streams, are rendered in this process while the workers run.
+
+    Args:
+        jobs: template .docx, render context and result path of each document
+        workers: number of worker processes, defaults to the number of CPUs
+
+    Returns:
+        list: one RowResult per job, in the order of the jobs
+    """
+    tasks = [(index, *job) for index, job in enumerate(jobs, start=1)]
+    picklable = [_is_picklable(task[2]) for task in tasks]
+    remote = [task for task, ok in zip(tasks, picklable) if ok]
+    local = [task for task, ok in zip(tasks, picklable) if not ok]
+    workers = min(workers or os.cpu_count() or 1, len(remote))
+    OUTPUT_PATH.mkdir(exist_ok=True, parents=True)
+
+    if workers <= 1:
+        return list(map(_render_job, tasks))
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_render_job, task) for task in remote]
+        results = [_render_job(task) for task in local] + [future.result() for future in futures]
+
+    return sorted(results, key=lambda res: res.index)
+
+
+def fill_rows(bundles: list[type[BaseModel]], rows: Iterable[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+    """ Fill the rows from the stored clients and the external sources, looked up in batches """
+    if CLIENT_STORE:
+        rows = client_store.fill_rows(bundles, rows)
+
+    return prefetch_rows(bundles, rows)
+
+
+def render_batch(
+    tmpl_path: Path,
+    rows: Iterable[dict[str, Any]],
+    workers: int | None = None,
+    chunksize: int = 8,
+    in_memory: bool = False,
+    compresslevel: int | None = DOCX_COMPRESSION_LEVEL
+) -> Iterator[RowResult]:
+    """ Render a document for every data row using a pool of worker processes
+
+    Args:
+        tmpl_path: path to the template .docx
+        rows: bundle data, one dict per document
+        workers: number of worker processes, defaults to the number of CPUs
+        chunksize: number of rows sent to a worker at once
+        in_memory: whether to return the documents in RowResult.data instead of saving them to OUTPUT_PATH
+        compresslevel: zlib level of the documents, see save_docx
+
+    Yields:
+        RowResult: one per row, in the order of the rows
+    """
+    workers = workers or os.cpu_count() or 1
+    stamp = output_stamp()
+    variables = template_manifest.get_variables(tmpl_path)
+    # stored clients and external data of all the rows are looked up in batches here, not per row in the workers
+    tasks = enumerate(fill_rows(get_tmpl_bundles(tmpl_path.parent), rows), start=1)
+
+    initargs = (tmpl_path, stamp, variables, in_memory, compresslevel)
+    if workers == 1:
+        _init_worker(*initargs)
+        yield from map(_render_row, tasks)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+        # a bounded number of chunks is in flight, so rows are read lazily and memory stays flat
+        pending = deque()
+        for chunk in batched(tasks, chunksize):
+            pending.append(executor.submit(_render_rows, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def check_rows(tmpl_path: Path, data_path: Path) -> list[RowResult]:
+    """ Check every row of a data file against the template's bundles, column by column
+
+    Returns:
+        list: failed result of each invalid row, with all the errors of the row
+    """
+    started = datetime.now()
+    bundles = get_tmpl_bundles(tmpl_path.parent)
+    errors = prevalidate(bundles, fill_rows(bundles, read_rows(data_path)))
+
+    results = [RowResult(index, False, error=line) for index, line in group_errors(errors).items()]
+    elapsed = (datetime.now() - started).total_seconds()
+    if results:
+        logger.error(f"{len(results)} rows of {data_path} are invalid, checked in {elapsed:.2f}s:\n{format_report(errors)}")
+    else:
+        logger.info(f"All rows of {data_path} are valid, checked in {elapsed:.2f}s")
+
+    return results
+
+
+def _write_report(report_path: Path, results: list[RowResult]):
+    with open(report_path, "w", encoding="utf-8") as fp:
+        for res in results:
+            fp.write(json.dumps(dict(
+                index=res.index,
+                ok=res.ok,
+                path=str(res.path) if res.path else None,
+                error=res.error,
+                cached=res.cached
+            ), ensure_ascii=False) + "\n")
+
+
+def run_merge(
+    tmpl_path: Path,
+    data_path: Path,
+    merge_path: Path,
+    report_path: Path | None = None,
+    compresslevel: int | None = DOCX_COMPRESSION_LEVEL
+) -> list[RowResult]:
+    """ Render every row of a data file into one document, a section per row
+
+    Rows that do not fit the bundles are skipped, with PREVALIDATE on nothing is rendered if a row is invalid.
+
+    Args:
+        tmpl_path: path to the template .docx
+        data_path: .csv or .jsonl file with the rows
+        merge_path: .docx file to save the merged document to
+        report_path: .jsonl file to write the outcome of each row to
+        compresslevel: zlib level of the document, see save_docx
+    """
+    from core.merge import merge_documents
+
+    if PREVALIDATE and (results := check_rows(tmpl_path, data_path)):
+        if report_path:
+            _write_report(report_path, results)
+        return results
+
+    results = []
+    started = datetime.now()
+    bundles = get_tmpl_bundles(tmpl_path.parent)
+    variables = template_manifest.get_variables(tmpl_path)
+
+    def contexts() -> Iterator[dict[str, Any]]:
+        for index, row in enumerate(fill_rows(bundles, read_rows(data_path)), start=1):
+            try:
+                context = build_context(bundles, row, variables)
+            except ValueError as e:
+                logger.error(f"Row {index}: {e}")
+                results.append(RowResult(index, False, error=f"{type(e).__name__}: {e}"))
+                continue
+
+            results.append(RowResult(index, True, path=merge_path))
+            yield context
+
+    rendered = contexts()
+    if (first := next(rendered, None)) is None:
+        logger.error(f"None of the {len(results)} rows of {data_path} is valid, nothing is merged")
+        if report_path:
+            _write_report(report_path, results)
+        return results
+
+    merge_path.parent.mkdir(exist_ok=True, parents=True)
+    sections = merge_documents(tmpl_path, chain([first], rendered), merge_path, compresslevel)
+
+    if report_path:
+        _write_report(report_path, results)
+
+    elapsed = (datetime.now() - started).total_seconds()
+    logger.info(f"Merged {sections}/{len(results)} rows into {merge_path} in {elapsed:.2f}s")
+
+    return results
+
+
+def run_batch(
+    tmpl_path: Path,
+    data_path: Path,
+    workers: int | None = None,
+    report_path: Path | None = None,
+    bundle_path: Path | None = None,
+    compresslevel: int | None = DOCX_COMPRESSION_LEVEL,
+    check_only: bool = False
+) -> list[RowResult]:
+    """ Render every row of a data file and report the outcome of each one
+
+    With PREVALIDATE on, the whole file is checked first and nothing is rendered if a row is invalid.
+
+    Args:
+        tmpl_path: path to the template .docx
+        data_path: .csv or .jsonl file with the rows
+        workers: number of worker processes, defaults to the number of CPUs
+        report_path: .jsonl file to write the outcome of each row to
+        bundle_path: .zip file to stream the documents into instead of saving them one by one, "-" for stdout
+        compresslevel: zlib level of the documents, see save_docx
+        check_only: only check the rows, without rendering them
+    """
+    if PREVALIDATE or check_only:
+        if (results := check_rows(tmpl_path, data_path)) or check_only:
+            if report_path:
+                _write_report(report_path, results)
+            return results
+
+    results = []
+    started = datetime.now()
+    bundle = DocumentBundle.open(bundle_path) if bundle_path else None
+
+    try:
+        for res in render_batch(
+            tmpl_path, read_rows(data_path), workers, in_memory=bundle is not None, compresslevel=compresslevel
+        ):
+            if res.ok:
+                if bundle is not None:
+                    bundle.add(res.path.name, res.data)
+                    res.data = None
+                logger.info(f"Row {res.index}: {res.path}")
+            else:
+                logger.error(f"Row {res.index}: {res.error}")
+            results.append(res)
+    finally:
+        if bundle is not None:
+            bundle.close()
+
+    if report_path:
+        _write_report(report_path, results)
+
+    failed = sum(not res.ok for res in results)
+    cached = sum(res.cached for res in results)
+    elapsed = (datetime.now() - started).total_seconds()
+    logger.info(
+        f"Rendered {len(results) - failed}/{len(results)} documents in {elapsed:.2f}s, "
+        f"{cached} from the output cache, {failed} failed"
+    )
+
+    return results
@@ -0,0 +1,229 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from itertools import batched
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
+
+from core.config import CLIENT_STORE_PATH
+from core.features.repeatable import row_targets
+from core.tracing import span
+
+NAME_FIELDS = ("s_name", "f_name", "patronymic")
+# fields a stored client is identified by, in the order of preference
+KEY_FIELDS = ("passport_no", "egn")
+SEARCH_LIMIT = 10
+# SQLite allows up to 32766 parameters in a query
+LOOKUP_BATCH_SIZE = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    passport_no TEXT,
+    egn TEXT,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clients_name ON clients (name);
+CREATE INDEX IF NOT EXISTS clients_passport_no ON clients (passport_no);
+CREATE INDEX IF NOT EXISTS clients_egn ON clients (egn);
+"""
+
+SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_name(name: str) -> str:
+    """ Full name as it is indexed: casefolded, with single spaces """
+    return SPACES_RE.sub(" ", name).strip().casefold()
+
+
+def normalize_key(value: Any) -> str:
+    """ Passport number or EGN as it is indexed: without spaces """
+    return SPACES_RE.sub("", str(value))
+
+
+def is_storable(bundle: type[BaseModel]) -> bool:
+    """ Whether instances of the bundle describe a person that can be saved to the client store """
+    fields = bundle.model_fields
+    return any(name in fields for name in KEY_FIELDS) or all(name in fields for name in NAME_FIELDS)
+
+
+def _get_name(data: dict[str, Any]) -> str | None:
+    if all(data.get(name) for name in NAME_FIELDS):
+        return normalize_name(" ".join(str(data[name]) for name in NAME_FIELDS))
+
+    return None
+
+
+class ClientStore:
+    """ Validated bundle data of clients, saved to reuse it in the following documents
+
+    Every client is one row of a SQLite table with the merged fields of all the bundles
+    saved for them, indexed by the full name, the passport number and the EGN.
+
+    Attributes:
+        path: path to the database file
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    def _connect(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, "connection", None)) is None:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+
+        return connection
+
+    def close(self):
+        if (connection := getattr(self._local, "connection", None)) is not None:
+            connection.close()
+            self._local.connection = None
+
+    def save(self, instance: BaseModel) -> int | None:
+        """ Save the fields of the instance, merging them into the client with the same passport number,
+        EGN or, if it has none of them, name
+
+        Returns:
+            int: id of the client, None if the instance has no field to identify the client by
+        """
+        data = to_jsonable_python({name: getattr(instance, name) for name in type(instance).model_fields})
+        name = _get_name(data)
+        keys = {field: normalize_key(data[field]) for field in KEY_FIELDS if data.get(field)}
+        if name is None and not keys:
+            return None
+
+        connection = self._connect()
+        with connection:
+            row = None
+            for field, value in keys.items():
+                row = connection.execute(f"SELECT id, data FROM clients WHERE {field} = ?", (value,)).fetchone()
+                if row:
+                    break
+            if row is None and not keys:
+                row = connection.execute(
+                    "SELECT id, data FROM clients WHERE name = ? AND passport_no IS NULL AND egn IS NULL", (name,)
+                ).fetchone()
+
+            if row is None:
+                cursor = connection.execute(
+                    "INSERT INTO clients (name, passport_no, egn, data, updated) VALUES (?, ?, ?, ?, ?)",
+                    (name, keys.get("passport_no"), keys.get("egn"), json.dumps(data, ensure_ascii=False), time.time())
+                )
+                client_id = cursor.lastrowid
+            else:
+                client_id, stored = row
+                data = {**json.loads(stored), **data}
+                connection.execute(
+                    "UPDATE clients SET name = coalesce(?, name), passport_no = coalesce(?, passport_no), "
+                    "egn = coalesce(?, egn), data = ?, updated = ? WHERE id = ?",
+                    (name, keys.get("passport_no"), keys.get("egn"),
+                     json.dumps(data, ensure_ascii=False), time.time(), client_id)
+                )
+
+        logger.debug(f"Saved {type(instance).__name__} of client {client_id} to {self.path}")
+        return client_id
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> list[dict[str, Any]]:
+        """ Find clients by the passport number, the EGN or the beginning of the full name
+        ("Фамилия Имя Отчество")
+
+        Returns:
+            list: data of the found clients, the most recently updated first
+        """
+        connection = self._connect()
+        key = normalize_key(query)
+        name = normalize_name(query)
+        if not key:
+            return []
+
+        with span("client_store", query="search"):
+            # separate queries, so each of them uses its own index
+            rows = connection.execute(
+                "SELECT id, data, updated FROM clients WHERE passport_no = ? "
+                "UNION SELECT id, data, updated FROM clients WHERE egn = ? "
+                # name prefix as a range, so it is looked up by the index as well
+                "UNION SELECT id, data, updated FROM clients WHERE name >= ? AND name < ? "
+                "ORDER BY updated DESC LIMIT ?",
+                (key, key, name, name + "\U0010ffff", limit)
+            ).fetchall()
+
+        return [json.loads(data) for _, data, _ in rows]
+
+    def find_many(self, field: str, values: Iterable[Any]) -> dict[str, dict[str, Any]]:
+        """ Get clients by many passport numbers or EGNs at once
+
+        Returns:
+            dict: data of the found clients by the normalized value
+        """
+        if field not in KEY_FIELDS:
+            raise ValueError(f"Clients can not be looked up by '{field}', expected one of {', '.join(KEY_FIELDS)}")
+
+        connection = self._connect()
+        result = {}
+        for batch in batched(dict.fromkeys(normalize_key(value) for value in values), LOOKUP_BATCH_SIZE):
+            with span("client_store", query=field, keys=len(batch)):
+                rows = connection.execute(
+                    f"SELECT {field}, data FROM clients WHERE {field} IN ({', '.join('?' * len(batch))})", batch
+                ).fetchall()
+            result.update((value, json.loads(data)) for value, data in rows)
+
+        return result
+
+    def fill(self, bundles: list[type[BaseModel]], rows: list[dict[str, Any]]):
+        """ Add the data of stored clients to the rows that give only their passport number or EGN
+
+        Values given in the rows take precedence. Each key field is looked up once for all the rows.
+        """
+        targets = [
+            (bundle, data) for bundle, data in row_targets([b for b in bundles if is_storable(b)], rows)
+            if not all(name in data for name in bundle.model_fields)
+        ]
+
+        for field in KEY_FIELDS:
+            pending = [(bundle, data) for bundle, data in targets if field in bundle.model_fields and data.get(field)]
+            if not pending:
+                continue
+
+            found = self.find_many(field, (data[field] for _, data in pending))
+            for bundle, data in pending:
+                if client := found.get(normalize_key(data[field])):
+                    for name in bundle.model_fields:
+                        if name in client:
+                            data.setdefault(name, client[name])
+
+    def fill_rows(
+        self,
+        bundles: list[type[BaseModel]],
+        rows: Iterable[dict[str, Any]],
+        chunk_size: int = 256
+    ) -> Iterator[dict[str, Any]]:
+        """ Fill the rows chunk by chunk, see fill """
+        if not self.exists() or not any(is_storable(bundle) for bundle in bundles):
+            yield from rows
+            return
+
+        for chunk in batched(rows, chunk_size):
+            chunk = list(chunk)
+            self.fill(bundles, chunk)
+            yield from chunk
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT count(*) FROM clients").fetchone()[0]
+
+
+client_store = ClientStore(CLIENT_STORE_PATH)
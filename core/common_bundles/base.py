@@ -2,6 +2,11 @@ from pydantic import BaseModel
 
 
 class BaseBundle(BaseModel):
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs):
+        super().__pydantic_init_subclass__(**kwargs)
+        cls.validate_model_schema()
+
     @classmethod
     def validate_model_schema(cls):
         pass
@@ -1,3 +1,4 @@
+import os
 import sys
 from pathlib import Path
 
@@ -8,3 +9,57 @@ BUNDLES_FILENAME = "bundles.py"
 INTERNAL = Path("_internal")
 OUTPUT_PATH = Path("output")
 TEMPLATES_PATH = INTERNAL / "templates" if FROZEN else Path("templates")
+CACHE_PATH = INTERNAL / "cache" if FROZEN else Path(".cache")
+
+TEMPLATES_DISK_CACHE = True
+N2W_CACHE_SIZE = 4096
+LAZY_CONTEXT = True
+
+OUTPUT_CACHE = False
+OUTPUT_CACHE_PATH = CACHE_PATH / "output"
+OUTPUT_CACHE_MAX_SIZE = 1024 ** 3
+OUTPUT_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+OUTPUT_CACHE_LINK = True
+
+# seconds records of external bundle sources are cached for
+EXTERNAL_CACHE_TTL = 5 * 60
+
+# zlib level of saved documents from 0 (stored) to 9 (smallest), None for the zlib default
+DOCX_COMPRESSION_LEVEL: int | None = None
+
+# fix-ups of rendered documents, in the order they are applied: tab_stops, empty_paragraphs, normalize_styles
+POSTPROCESS_PASSES: tuple[str, ...] = ()
+
+# check whole data files of batch jobs against the template's bundles before rendering any of the rows
+PREVALIDATE = True
+
+# save the clients filled in interactively and offer them in the next documents, off by default:
+# the file is not encrypted and holds passport numbers and EGNs
+CLIENT_STORE = False
+CLIENT_STORE_PATH = INTERNAL / "clients.db" if FROZEN else Path("clients.db")
+
+# "log" to log the timing of the pipeline stages, or path of a JSON lines trace file
+TRACE_ENV = "DOCUMENT_FORMATTER_TRACE"
+TRACE_MEMORY_ENV = "DOCUMENT_FORMATTER_TRACE_MEMORY"
+TRACE = os.environ.get(TRACE_ENV) or None
+TRACE_MEMORY = bool(os.environ.get(TRACE_MEMORY_ENV))
+
+# directory of the application, the daemon and the thin client find the socket there from any working directory
+APP_PATH = Path(sys.executable).parent if FROZEN else Path(__file__).resolve().parent.parent
+# Unix domain socket of the daemon (main.py daemon) that the thin client (client.py) talks to
+DAEMON_SOCKET = APP_PATH / CACHE_PATH / "daemon.sock"
+# seconds between the checks of the template files for changes
+DAEMON_WATCH_INTERVAL = 1.0
+
+# sample rows that watch mode renders the templates with
+SAMPLES_PATH = CACHE_PATH / "samples"
+# seconds between the checks of the template files in watch mode
+WATCH_INTERVAL = 0.25
+
+# spool directory of the render queue (main.py queue), several hosts can work it off when it is shared
+SPOOL_PATH = Path("spool")
+# seconds a worker keeps a claimed job before it is queued again, and claims of a job before it is failed
+QUEUE_LEASE_TIMEOUT = 5 * 60
+QUEUE_MAX_ATTEMPTS = 3
+# seconds between the checks of an empty queue
+QUEUE_POLL_INTERVAL = 1.0
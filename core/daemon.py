@@ -0,0 +1,200 @@
+import io
+import json
+import multiprocessing
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, TextIO
+
+from loguru import logger
+
+from core.config import TEMPLATES_PATH, DAEMON_WATCH_INTERVAL
+from core.watcher import FileWatcher
+
+# the session served by the current thread
+_local = threading.local()
+
+
+class Session:
+    """ Connection to a client, messages are JSON lines
+
+    Client sends ``{"argv": [...], "cwd": ...}`` first and then ``{"line": ...}`` or ``{"eof": true}``
+    for each ``{"read": true}``. The daemon sends ``{"out": ...}`` and ``{"err": ...}`` text
+    and ``{"exit": code}`` at the end of the session.
+    """
+    def __init__(self, rfile: io.BufferedIOBase, wfile: io.BufferedIOBase):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._lock = threading.Lock()
+
+    def send(self, **message: Any):
+        data = (json.dumps(message, ensure_ascii=False) + "\n").encode()
+        with self._lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def receive(self) -> dict[str, Any]:
+        if not (line := self.rfile.readline()):
+            raise ConnectionResetError("Client disconnected")
+
+        return json.loads(line)
+
+    def readline(self) -> str:
+        self.send(read=True)
+        message = self.receive()
+
+        return "" if message.get("eof") else message["line"] + "\n"
+
+
+def current_session() -> Session | None:
+    return getattr(_local, "session", None)
+
+
+class SessionStream(io.TextIOBase):
+    """ Standard stream that goes to the client of the current thread's session, or to the daemon's own stream """
+    def __init__(self, kind: str, default: TextIO):
+        self.kind = kind
+        self.default = default
+
+    def write(self, text: str) -> int:
+        if (session := current_session()) is None:
+            return self.default.write(text)
+
+        session.send(**{self.kind: text})
+        return len(text)
+
+    def readline(self, size: int = -1) -> str:
+        if (session := current_session()) is None:
+            return self.default.readline(size)
+
+        return session.readline()
+
+    def flush(self):
+        if current_session() is None:
+            self.default.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+
+def _log_sink(message: str):
+    sys.stderr.write(message)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "DaemonServer"
+
+    def handle(self):
+        session = Session(self.rfile, self.wfile)
+        try:
+            request = session.receive()
+        except (ConnectionError, json.JSONDecodeError):
+            return
+
+        _local.session = session
+        try:
+            code = self.server.run(list(request.get("argv", [])), Path(request.get("cwd", ".")))
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except ConnectionError:
+            _local.session = None
+            logger.info("Client disconnected in the middle of a session")
+            return
+        except Exception as e:
+            logger.exception(f"Session failed: {e}")
+            code = 1
+        finally:
+            _local.session = None
+
+        try:
+            session.send(exit=code)
+        except OSError:
+            pass
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, run: Callable[[list[str], Path], int]):
+        self.run = run
+        super().__init__(str(path), _Handler)
+
+
+def warm_up(tmpl_dirs: set[Path] | None = None):
+    """ Load the templates and bundles and build the validators, all of them or of the given template directories """
+    from core.manifest import template_manifest
+    from core.template_cache import template_cache
+    from core.templates import get_tmpl_bundles
+    from core.validation import precompile_validators
+
+    for name, entry in template_manifest.refresh().items():
+        if entry.error or (tmpl_dirs is not None and entry.path.parent.resolve() not in tmpl_dirs):
+            continue
+
+        for bundle in get_tmpl_bundles(entry.path.parent):
+            precompile_validators(bundle)
+        template_cache.get_prepared(entry.path)
+        logger.debug(f"Warmed up template {name}")
+
+
+def _reload(changed: set[Path]):
+    tmpl_dirs = {path.parent.resolve() for path in changed}
+    logger.info(f"Templates changed: {', '.join(sorted(path.name for path in tmpl_dirs))}, reloading")
+    warm_up(tmpl_dirs)
+
+
+def _is_running(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(str(path))
+        except OSError:
+            return False
+
+    return True
+
+
+def serve_daemon(path: Path, run: Callable[[list[str], Path], int]):
+    """ Serve sessions of thin clients on a Unix domain socket with the templates kept warm
+
+    Args:
+        path: path to the socket
+        run: runs a session with the command line arguments and the working directory of the client,
+            returns the exit code
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("Daemon mode needs Unix domain sockets, which this platform does not have")
+
+    if path.exists():
+        if _is_running(path):
+            raise ValueError(f"Daemon is already running on {path}")
+        path.unlink()
+
+    # worker processes are not forked from the threaded daemon, the fork server keeps them warm instead
+    multiprocessing.set_start_method("forkserver", force=True)
+    multiprocessing.set_forkserver_preload(["core.batch"])
+
+    sys.stdin = SessionStream("line", sys.stdin)
+    sys.stdout = SessionStream("out", sys.stdout)
+    sys.stderr = SessionStream("err", sys.stderr)
+    logger.remove()
+    logger.add(_log_sink, level="DEBUG")
+
+    warm_up()
+    stop_watching = FileWatcher(TEMPLATES_PATH, interval=DAEMON_WATCH_INTERVAL).start(_reload)
+
+    # stopping the daemon with kill removes the socket like Ctrl+C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with DaemonServer(path, run) as server:
+        logger.info(f"Daemon is listening on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Daemon stopped")
+        finally:
+            stop_watching.set()
+            path.unlink(missing_ok=True)
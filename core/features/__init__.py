@@ -1 +1,4 @@
-from . import n2w, repeatable
\ No newline at end of file
+# common bundles import the features back, so they are loaded first whichever package is imported first
+import core.common_bundles  # noqa: F401
+
+from . import n2w, repeatable, external
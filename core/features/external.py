@@ -1,7 +1,439 @@
-from typing import ClassVar
+import asyncio
+import csv
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections.abc import Coroutine, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import batched
+from pathlib import Path
+from typing import Any, ClassVar
+
+from loguru import logger
+from pydantic import BaseModel, model_validator
+from pydantic_core import PydanticCustomError
 
 from core.common_bundles.base import BaseBundle
+from core.config import EXTERNAL_CACHE_TTL
+from core.features.repeatable import row_targets
+from core.tracing import span
+
+IDENTIFIER_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+type Record = dict[str, Any]
+
+# every created source, so connections can be closed at the end of a job
+_sources: weakref.WeakSet["ExternalSource"] = weakref.WeakSet()
+
+
+def _run[T](coro: Coroutine[Any, Any, T]) -> T:
+    """ Run a coroutine from sync code, in a separate thread if an event loop is already running """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+class ExternalSource(ABC):
+    """ Source of bundle data with a TTL cache and batched fetching
+
+    Subclasses implement ``_fetch`` that gets the records of one batch of keys.
+
+    Attributes:
+        batch_size: maximal number of keys fetched at once
+        concurrency: maximal number of batches fetched at the same time
+        ttl: seconds a fetched record, or the absence of one, is cached for
+        cache_size: maximal number of cached keys
+    """
+    def __init__(
+        self,
+        batch_size: int = 500,
+        concurrency: int = 4,
+        ttl: float = EXTERNAL_CACHE_TTL,
+        cache_size: int = 100_000
+    ):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache: dict[str, tuple[float, Record | None]] = {}
+        _sources.add(self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+    @abstractmethod
+    async def _fetch(self, keys: list[str]) -> dict[str, Record]:
+        """ Get the records of the keys the source has, by the key """
+
+    async def close(self):
+        """ Close pooled connections, they are opened again on the next fetch """
+
+    async def _close_loop(self):
+        """ Close the connections bound to the running event loop, before the loop ends """
+
+    def get_cached(self, key: Any) -> tuple[bool, Record | None]:
+        """ Get the cached record of the key
+
+        Returns:
+            tuple: whether the key is cached and its record, None if the source has no record for it
+        """
+        cached = self._cache.get(str(key))
+        if cached is None or cached[0] < time.monotonic():
+            return False, None
+
+        return True, cached[1]
+
+    def _store(self, keys: list[str], records: dict[str, Record]):
+        expires = time.monotonic() + self.ttl
+        for key in keys:
+            self._cache.pop(key, None)
+            self._cache[key] = (expires, records.get(key))
+
+        # the oldest entries are dropped first, dicts keep the insertion order
+        while len(self._cache) > self.cache_size:
+            del self._cache[next(iter(self._cache))]
+
+    async def get_many(self, keys: Iterable[Any]) -> dict[str, Record]:
+        """ Get records of the keys, fetching the ones that are not cached in batches
+
+        Returns:
+            dict: record of every key the source has, by the key as string
+        """
+        result = {}
+        missing = []
+        for key in dict.fromkeys(str(key) for key in keys):
+            cached, record = self.get_cached(key)
+            if not cached:
+                missing.append(key)
+            elif record is not None:
+                result[key] = record
+
+        if not missing:
+            return result
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_batch(batch: list[str]):
+            async with semaphore:
+                with span("external_fetch", source=repr(self), keys=len(batch)):
+                    records = await self._fetch(batch)
+            self._store(batch, records)
+            result.update(records)
+
+        await asyncio.gather(*(fetch_batch(list(batch)) for batch in batched(missing, self.batch_size)))
+        logger.debug(f"Fetched {len(missing)} keys from {self!r}")
+
+        return result
+
+    def get(self, key: Any) -> Record | None:
+        """ Get the record of one key from sync code """
+        cached, record = self.get_cached(key)
+        if cached:
+            return record
+
+        async def fetch() -> dict[str, Record]:
+            try:
+                return await self.get_many([key])
+            finally:
+                # the event loop of the call ends with it
+                await self._close_loop()
+
+        return _run(fetch()).get(str(key))
+
+
+class SQLiteSource(ExternalSource):
+    """ Rows of a table in a local SQLite database
+
+    Attributes:
+        path: path to the database file
+        table: name of the table
+        key_column: column the rows are looked up by
+    """
+    def __init__(self, path: Path | str, table: str, key_column: str, **kwargs):
+        super().__init__(**kwargs)
+        for name in (table, key_column):
+            if not IDENTIFIER_RE.match(name):
+                raise ValueError(f"Invalid SQLite identifier '{name}'")
+
+        self.path = Path(path)
+        self.table = table
+        self.key_column = key_column
+        self._pool: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self.path)!r}, {self.table!r})"
+
+    def _connect(self) -> sqlite3.Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        if not self.path.is_file():
+            raise ValueError(f"SQLite database {self.path} does not exist")
+
+        # read only, the source never writes and the file may be shared
+        connection = sqlite3.connect(f"file:{self.path.resolve()}?mode=ro", uri=True, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _query(self, keys: list[str]) -> dict[str, Record]:
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                f'SELECT * FROM "{self.table}" WHERE CAST("{self.key_column}" AS TEXT) IN '
+                f'({", ".join("?" * len(keys))})',
+                keys
+            ).fetchall()
+        finally:
+            self._pool.put(connection)
+
+        return {str(row[self.key_column]): dict(row) for row in rows}
+
+    async def _fetch(self, keys: list[str]) -> dict[str, Record]:
+        return await asyncio.to_thread(self._query, keys)
+
+    async def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class FileSource(ExternalSource):
+    """ Records of a .csv, .json or .jsonl file
+
+    The file is indexed on the first fetch and again after it changes.
+    A .json file holds a list of records or an object of records by key.
+
+    Attributes:
+        path: path to the file
+        key_column: field the records are looked up by
+    """
+    def __init__(self, path: Path | str, key_column: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self.key_column = key_column
+        self._version: tuple[int, int] | None = None
+        self._index: dict[str, Record] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self.path)!r})"
+
+    def _read(self) -> Iterator[Record]:
+        with open(self.path, "r", encoding="utf-8", newline="") as fp:
+            if self.path.suffix == ".csv":
+                yield from csv.DictReader(fp)
+            elif self.path.suffix == ".jsonl":
+                yield from (json.loads(line) for line in fp if line.strip())
+            elif self.path.suffix == ".json":
+                data = json.load(fp)
+                if isinstance(data, dict):
+                    yield from ({self.key_column: key, **record} for key, record in data.items())
+                else:
+                    yield from data
+            else:
+                raise ValueError(f"Unsupported source file format '{self.path.suffix}', expected .csv, .json or .jsonl")
+
+    def _get_index(self) -> dict[str, Record]:
+        stat = os.stat(self.path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if self._version != version:
+                self._index = {str(record[self.key_column]): record for record in self._read()}
+                self._version = version
+                logger.debug(f"Indexed {len(self._index)} records of {self!r}")
+
+        return self._index
+
+    async def _fetch(self, keys: list[str]) -> dict[str, Record]:
+        index = await asyncio.to_thread(self._get_index)
+        return {key: index[key] for key in keys if key in index}
+
+
+class HTTPSource(ExternalSource):
+    """ Records of an HTTP endpoint
+
+    Each batch is sent as ``POST url`` with ``{"keys": [...]}`` JSON body, the response is
+    an object of records by key or a list of records with the key_column field.
+    Connections are pooled by one session per event loop.
+
+    Attributes:
+        url: address of the endpoint
+        key_column: field of the returned records the keys are in
+        timeout: timeout of one request in seconds
+        headers: extra request headers, like authorization
+    """
+    def __init__(
+        self,
+        url: str,
+        key_column: str,
+        timeout: float = 30,
+        headers: dict[str, str] | None = None,
+        **kwargs
+    ):
+        kwargs.setdefault("batch_size", 100)
+        super().__init__(**kwargs)
+        self.url = url
+        self.key_column = key_column
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._sessions: dict[asyncio.AbstractEventLoop, Any] = {}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.url!r})"
+
+    def _get_session(self):
+        from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = self._sessions[loop] = ClientSession(
+                connector=TCPConnector(limit=self.concurrency),
+                timeout=ClientTimeout(total=self.timeout),
+                headers=self.headers,
+            )
+
+        return session
+
+    async def _fetch(self, keys: list[str]) -> dict[str, Record]:
+        async with self._get_session().post(self.url, json=dict(keys=keys)) as response:
+            response.raise_for_status()
+            data = await response.json()
+
+        if isinstance(data, dict):
+            return {str(key): record for key, record in data.items() if record is not None}
+
+        return {str(record[self.key_column]): record for record in data}
+
+    async def close(self):
+        await self._close_loop()
+
+    async def _close_loop(self):
+        if session := self._sessions.pop(asyncio.get_running_loop(), None):
+            await session.close()
+
+
+async def close_sources():
+    """ Close pooled connections of all the sources """
+    await asyncio.gather(*(source.close() for source in list(_sources)))
 
 
 class ExternalBundle(BaseBundle):
-    external_src: ClassVar
+    """ Bundle whose fields can be taken from an external source by a key field
+
+    Values given in the data take precedence over the values of the source.
+
+    Attributes:
+        external_src: source of the records, None for a bundle filled by hand only
+        external_key: name of the field the records are looked up by
+    """
+    external_src: ClassVar[ExternalSource | None] = None
+    external_key: ClassVar[str | None] = None
+
+    @classmethod
+    def validate_model_schema(cls):
+        super().validate_model_schema()
+
+        if cls.external_src is not None and cls.external_key not in cls.model_fields:
+            err = PydanticCustomError(
+                "external_key_missing",
+                "external key '{key}' of bundle '{bundle}' is not its field",
+                dict(key=cls.external_key, bundle=cls.__name__)
+            )
+            logger.error(err)
+            raise err
+
+    @classmethod
+    def merge_record(cls, data: dict[str, Any], record: Record) -> dict[str, Any]:
+        """ Add the fields of the record that the data does not have """
+        return {**{name: record[name] for name in cls.model_fields if name in record}, **data}
+
+    @classmethod
+    def fetch_record(cls, key: Any) -> Record | None:
+        """ Get the record of the key from the bundle's source """
+        return cls.external_src.get(key) if cls.external_src is not None else None
+
+    @model_validator(mode="before")
+    @classmethod
+    def fill_from_source(cls, data: Any) -> Any:
+        if cls.external_src is None or not isinstance(data, dict) or data.get(cls.external_key) is None:
+            return data
+        # rows prefetched with prefetch() are complete already
+        if all(name in data for name in cls.model_fields):
+            return data
+
+        if record := cls.fetch_record(data[cls.external_key]):
+            return cls.merge_record(data, record)
+
+        return data
+
+
+async def prefetch(bundles: list[type[BaseModel]], rows: list[dict[str, Any]]):
+    """ Fetch the records of external bundles for all the rows at once and merge them into the rows
+
+    Each source gets one batched request for the keys of all the rows.
+    """
+    external = [bundle for bundle in bundles if issubclass(bundle, ExternalBundle) and bundle.external_src]
+    targets = [
+        (bundle, data) for bundle, data in row_targets(external, rows)
+        if data.get(bundle.external_key) is not None
+    ]
+    if not targets:
+        return
+
+    keys: dict[ExternalSource, list[Any]] = {}
+    for bundle, data in targets:
+        keys.setdefault(bundle.external_src, []).append(data[bundle.external_key])
+
+    sources = list(keys)
+    results = dict(zip(sources, await asyncio.gather(*(source.get_many(keys[source]) for source in sources))))
+
+    for bundle, data in targets:
+        if record := results[bundle.external_src].get(str(data[bundle.external_key])):
+            merged = bundle.merge_record(data, record)
+            data.clear()
+            data.update(merged)
+
+
+def prefetch_rows(
+    bundles: list[type[BaseModel]],
+    rows: Iterable[dict[str, Any]],
+    chunk_size: int = 256
+) -> Iterator[dict[str, Any]]:
+    """ Prefetch external data of the rows chunk by chunk, see prefetch
+
+    Rows are still read lazily, connections are pooled for the whole job.
+    """
+    sources = {bundle.external_src for bundle in bundles if issubclass(bundle, ExternalBundle) and bundle.external_src}
+    if not sources:
+        yield from rows
+        return
+
+    async def close_loop():
+        # only the connections of this loop, the sources may be used by other jobs at the same time
+        await asyncio.gather(*(source._close_loop() for source in sources))
+
+    loop = asyncio.new_event_loop()
+    try:
+        for chunk in batched(rows, chunk_size):
+            chunk = list(chunk)
+            loop.run_until_complete(prefetch(bundles, chunk))
+            yield from chunk
+    finally:
+        loop.run_until_complete(close_loop())
+        loop.close()
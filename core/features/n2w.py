@@ -1,16 +1,28 @@
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache, _CacheInfo
 from types import UnionType
-from typing import get_type_hints, Any, get_args, get_origin, Union
+from typing import get_args, get_origin, Union, ClassVar
 
 from loguru import logger
 from num2words import num2words
-from pydantic import BaseModel, ValidationError
-from pydantic._internal._model_construction import ModelMetaclass
 # noinspection PyProtectedMember
 from pydantic.fields import FieldInfo, Field
 from pydantic_core import PydanticCustomError
 
 from core.common_bundles.base import BaseBundle
+from core.config import N2W_CACHE_SIZE
 from core.tools import Numeric
+from core.tracing import span
+
+# instances collected by n2w_batch, None when generation is not deferred
+_deferred_instances: ContextVar[list["Num2WordsBundle"] | None] = ContextVar("_deferred_instances", default=None)
+
+
+@lru_cache(maxsize=N2W_CACHE_SIZE, typed=True)
+def _num2words(val: Numeric) -> str:
+    return num2words(val, lang="ru")
 
 
 def get_n2w_from_str(value: str) -> str:
@@ -19,19 +31,46 @@ def get_n2w_from_str(value: str) -> str:
         if not val.isdigit():
             raise ValueError(value + " contains symbols beside numbers and periods")
         vals.append(
-            num2words(int(val), lang="ru")
+            _num2words(int(val))
         )
 
     return " точка ".join(vals)
 
 
+@lru_cache(maxsize=N2W_CACHE_SIZE, typed=True)
 def get_n2w(val: str | Numeric) -> str:
     if isinstance(val, Numeric):
-        return num2words(val, lang="ru")
+        return _num2words(val)
     else:
         return get_n2w_from_str(val)
 
 
+def get_n2w_many(values: Iterable[str | Numeric]) -> list[str]:
+    """ Convert many values at once, each distinct value is converted only once
+
+    Returns:
+        list: words for every value, in the order of the values
+    """
+    # the type is a part of the key, so 1 and 1.0 are converted separately
+    keys = [(type(val), val) for val in values]
+    words = {}
+    for key in keys:
+        if key not in words:
+            words[key] = get_n2w(key[1])
+
+    return [words[key] for key in keys]
+
+
+def n2w_cache_info() -> dict[str, _CacheInfo]:
+    """ Hits and misses of the whole values and the single numbers caches """
+    return dict(values=get_n2w.cache_info(), numbers=_num2words.cache_info())
+
+
+def n2w_cache_clear():
+    get_n2w.cache_clear()
+    _num2words.cache_clear()
+
+
 def validate_n2w_field[T](value: T) -> T:
     """
     Validate n2w source field's type
@@ -57,51 +96,134 @@ def Num2WordsField(result_field_name: str, field_info: FieldInfo) -> FieldInfo:
     field_info.json_schema_extra.update(
         dict(__n2w_field_name__=result_field_name)
     )
+    # pydantic keeps only explicitly set attributes when it merges the FieldInfo with the annotation
+    # noinspection PyProtectedMember
+    field_info._attributes_set["json_schema_extra"] = field_info.json_schema_extra
 
     return field_info
 
 
+def _is_num2wordable(annotation) -> bool:
+    allowed_types = int | float | str
+
+    if get_origin(annotation) in [UnionType, Union]:
+        return all(_is_num2wordable(type_) for type_ in get_args(annotation))
+
+    return isinstance(annotation, type) and issubclass(annotation, allowed_types)
+
+
 class Num2WordsBundle(BaseBundle, extra="allow"):
+    """ Bundle that generates a num2words result field for each field made with Num2WordsField
+
+    Attributes:
+        n2w_fields: names of the marked fields and of their result fields, computed on class creation
+    """
+    n2w_fields: ClassVar[tuple[tuple[str, str], ...]] = ()
+
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs):
+        cls.n2w_fields = tuple(
+            (name, extra["__n2w_field_name__"])
+            for name, info in cls.model_fields.items()
+            if "__n2w_field_name__" in (extra := info.json_schema_extra or {})
+        )
+        super().__pydantic_init_subclass__(**kwargs)
+
     @classmethod
     def validate_n2w_fields(cls):
         allowed_types = int | float | str
-
-        for name, info in cls.model_fields.items():
-            err = PydanticCustomError(
-                "not_num2wordable",
-                "field '{name}' got unprocessable type '{type_}', expected '{allowed}'",
-                dict(name=name, type_=info.annotation, allowed=allowed_types)
-            )
-
-            if get_origin(info.annotation) in [UnionType, Union]:
-                for type_ in get_args(info.annotation):
-                    if not issubclass(type_, allowed_types):
-                        logger.error(err)
-                        raise err
-            else:
-                if not issubclass(info.annotation, allowed_types):
-                    logger.error(err)
-                    raise err
+        result_names = set()
+
+        for name, n2w_name in cls.n2w_fields:
+            annotation = cls.model_fields[name].annotation
+            if not _is_num2wordable(annotation):
+                err = PydanticCustomError(
+                    "not_num2wordable",
+                    "field '{name}' got unprocessable type '{type_}', expected '{allowed}'",
+                    dict(name=name, type_=annotation, allowed=allowed_types)
+                )
+                logger.error(err)
+                raise err
+
+            if n2w_name in cls.model_fields or n2w_name in result_names:
+                err = PydanticCustomError(
+                    "n2w_name_taken",
+                    "num2words result name '{n2w_name}' of field '{name}' is already taken",
+                    dict(name=name, n2w_name=n2w_name)
+                )
+                logger.error(err)
+                raise err
+
+            result_names.add(n2w_name)
+
+    def set_n2w_field(self, n2w_name: str, words: str):
+        field = {n2w_name: words}
+
+        self.__dict__.update(field)
+        if not self.__pydantic_root_model__:
+            self.__pydantic_extra__.update(field)
+
+    def get_n2w_field(self, n2w_name: str) -> str:
+        """ Get the words of a num2words result field, generating them if the generation was skipped """
+        if n2w_name not in self.__dict__:
+            name = next(name for name, result_name in self.n2w_fields if result_name == n2w_name)
+            with span("n2w", bundle=type(self).__name__, field=n2w_name):
+                self.set_n2w_field(n2w_name, get_n2w(validate_n2w_field(getattr(self, name))))
+
+        return self.__dict__[n2w_name]
 
     def generate_n2w_fields(self):
-        for name, info in self.model_fields.items():
-            extra = info.json_schema_extra or {}
-            if n2w_name := extra.get("__n2w_field_name__", ""):  # generating num2words if the field is marked
-                val = validate_n2w_field(getattr(self, name))
-                field = {n2w_name: get_n2w(val)}
-
-                self.__dict__.update(field)
-                if not self.__pydantic_root_model__:
-                    self.__pydantic_extra__.update(field)
+        with span("n2w", bundle=type(self).__name__):
+            for name, n2w_name in self.n2w_fields:
+                self.set_n2w_field(n2w_name, get_n2w(validate_n2w_field(getattr(self, name))))
 
     def model_post_init(self, _):
-        self.generate_n2w_fields()
+        if (deferred := _deferred_instances.get()) is not None:
+            deferred.append(self)
+        else:
+            self.generate_n2w_fields()
 
     @classmethod
     def validate_model_schema(cls):
         cls.validate_n2w_fields()
 
 
+def generate_n2w_fields_many(instances: Iterable[Num2WordsBundle]):
+    """ Generate num2words fields of many instances in one pass, converting each distinct value once """
+    with span("n2w"):
+        targets = []
+        values = []
+        for instance in instances:
+            for name, n2w_name in instance.n2w_fields:
+                targets.append((instance, n2w_name))
+                values.append(validate_n2w_field(getattr(instance, name)))
+
+        for (instance, n2w_name), words in zip(targets, get_n2w_many(values)):
+            instance.set_n2w_field(n2w_name, words)
+
+
+@contextmanager
+def n2w_batch(generate: bool = True) -> Iterator[list[Num2WordsBundle]]:
+    """ Defer num2words generation of the Num2WordsBundle instances created inside the block
+
+    The fields of all of them are generated at once with generate_n2w_fields_many on exit,
+    so they are not accessible inside the block.
+
+    Args:
+        generate: whether to generate the fields on exit, otherwise they are generated
+            on access with Num2WordsBundle.get_n2w_field
+    """
+    instances = []
+    token = _deferred_instances.set(instances)
+    try:
+        yield instances
+    finally:
+        _deferred_instances.reset(token)
+
+    if generate:
+        generate_n2w_fields_many(instances)
+
+
 if __name__ == '__main__':
     class Test(Num2WordsBundle):
         test: str = Num2WordsField(
@@ -1,4 +1,7 @@
-from typing import ClassVar
+from collections.abc import Iterable, Iterator
+from typing import Any, ClassVar
+
+from pydantic import BaseModel
 
 from core.common_bundles.base import BaseBundle
 
@@ -6,3 +9,23 @@ from core.common_bundles.base import BaseBundle
 class RepeatableBundle(BaseBundle):
     result_var_name: ClassVar
     bundle_desc: ClassVar
+
+
+def row_targets(
+    bundles: Iterable[type[BaseModel]],
+    rows: list[dict[str, Any]]
+) -> Iterator[tuple[type[BaseModel], dict[str, Any]]]:
+    """ Every bundle with the data it is validated from: the rows, or the items of repeatable bundles
+
+    Repeatable bundles given as a path to a data file are skipped, as are rows and items that are not objects,
+    validation reports them.
+    """
+    for bundle in bundles:
+        repeatable = issubclass(bundle, RepeatableBundle)
+        for row in rows:
+            if not isinstance(row, dict):
+                continue
+            if not repeatable:
+                yield bundle, row
+            elif isinstance(items := row.get(bundle.result_var_name), list):
+                yield from ((bundle, item) for item in items if isinstance(item, dict))
@@ -0,0 +1,115 @@
+from collections.abc import Collection
+from typing import Any
+from weakref import WeakKeyDictionary
+
+from pydantic import BaseModel
+
+from core.manifest import bundle_context_names
+
+_context_names: WeakKeyDictionary[type[BaseModel], frozenset[str]] = WeakKeyDictionary()
+
+
+def _get_names(bundle: type[BaseModel]) -> frozenset[str]:
+    if (names := _context_names.get(bundle)) is None:
+        names = _context_names[bundle] = frozenset(bundle_context_names(bundle))
+
+    return names
+
+
+def _wrap(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return LazyBundle(value)
+    if isinstance(value, list):
+        return [_wrap(item) for item in value]
+
+    return value
+
+
+class LazyBundle:
+    """ Read-only view of a bundle instance for jinja
+
+    Exposes the same names as the ``model_dump()`` of the instance plus its num2words fields,
+    but computed fields and num2words fields are evaluated on first access and memoized,
+    nested bundles are wrapped on access too.
+    """
+    __slots__ = ("_instance", "_values")
+
+    def __init__(self, instance: BaseModel):
+        self._instance = instance
+        self._values: dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+
+        instance = self._instance
+        bundle = type(instance)
+        if name not in _get_names(bundle):
+            raise KeyError(name)
+
+        if name in bundle.model_fields or name in bundle.model_computed_fields:
+            value = getattr(instance, name)
+        else:
+            # noinspection PyUnresolvedReferences
+            value = instance.get_n2w_field(name)
+
+        self._values[name] = value = _wrap(value)
+        return value
+
+    def __getattr__(self, name: str) -> Any:
+        # private names are never looked up in the bundle, it also keeps pickle and copy from recursing
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(f"'{type(self._instance).__name__}' has no value '{name}'") from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in _get_names(type(self._instance))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._instance!r})"
+
+
+def get_instance(view: LazyBundle) -> BaseModel:
+    """ Get the bundle instance behind the view """
+    return view._instance
+
+
+def lazy_context(
+    instances: list[tuple[type[BaseModel], BaseModel | list[BaseModel]]],
+    variables: Collection[str] | None = None
+) -> dict[str, Any]:
+    """ Build the render context from the validated bundles without evaluating unused values
+
+    Top-level values the template does not reference are skipped, the rest of derived values
+    are evaluated when the template accesses them. Num2words generation of the instances
+    should be skipped with ``n2w_batch(generate=False)``, so only the printed fields are generated.
+
+    Args:
+        instances: each bundle with its instance, or the list of instances or the stream for repeatable bundles
+        variables: top-level names the template references, None to put in all the values
+
+    Returns:
+        dict: render context
+    """
+    context = {}
+    for bundle, instance in instances:
+        if not isinstance(instance, BaseModel):
+            if variables is None or bundle.result_var_name in variables:
+                # streams yield ready to render items
+                context[bundle.result_var_name] = (
+                    [LazyBundle(item) for item in instance] if isinstance(instance, list) else instance
+                )
+            continue
+
+        view = LazyBundle(instance)
+        for name in _get_names(bundle):
+            if variables is None or name in variables:
+                context[name] = view[name]
+
+    return context
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+from loguru import logger
+
+from core.config import CACHE_PATH, TEMPLATES_PATH, BUNDLES_FILENAME, FROZEN
+
+MANIFEST_VERSION = 1
+
+
+def _stat(path: Path) -> list[int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+@dataclass
+class TemplateEntry:
+    """ Indexed information about a template
+
+    Attributes:
+        name: name of the template directory
+        docx: path to the template .docx
+        docx_hash: sha256 of the .docx content
+        variables: top-level jinja variables the template references
+        attributes: attributes the template uses on loop items and nested objects, by variable
+        bundles: names of the template's bundles
+        missing: referenced variables and attributes no bundle provides
+        unused: bundle values the template never references
+        error: why the template can not be used
+        stats: mtime and size of the directory, the .docx and the bundles file, to detect changes
+    """
+    name: str
+    docx: str | None = None
+    docx_hash: str | None = None
+    variables: list[str] = field(default_factory=list)
+    attributes: dict[str, list[str]] = field(default_factory=dict)
+    bundles: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+    unused: list[str] = field(default_factory=list)
+    error: str | None = None
+    stats: dict[str, list[int] | None] = field(default_factory=dict)
+
+    @property
+    def path(self) -> Path:
+        return Path(self.docx)
+
+
+def bundle_context_names(bundle) -> set[str]:
+    """ Names a bundle instance provides in the render context """
+    names = {name for name, info in bundle.model_fields.items() if not info.exclude}
+    names |= set(bundle.model_computed_fields)
+    names |= {n2w_name for _, n2w_name in getattr(bundle, "n2w_fields", ())}
+
+    return names
+
+
+def _find_references(sources: list[str]) -> tuple[set[str], dict[str, set[str]]]:
+    """ Get the undeclared variables of the jinja sources and the attributes used on them and on loop items """
+    from jinja2 import Environment, meta, nodes
+
+    env = Environment()
+    variables = set()
+    attributes: dict[str, set[str]] = {}
+
+    for source in sources:
+        ast = env.parse(source)
+        undeclared = meta.find_undeclared_variables(ast)
+        variables |= undeclared
+
+        # loop item name -> iterated variable
+        aliases = {
+            loop.target.name: loop.iter.name
+            for loop in ast.find_all(nodes.For)
+            if isinstance(loop.target, nodes.Name) and isinstance(loop.iter, nodes.Name)
+            and loop.iter.name in undeclared
+        }
+        for getattr_ in ast.find_all(nodes.Getattr):
+            if not isinstance(getattr_.node, nodes.Name):
+                continue
+
+            name = aliases.get(getattr_.node.name, getattr_.node.name)
+            if name in undeclared:
+                attributes.setdefault(name, set()).add(getattr_.attr)
+
+    return variables, attributes
+
+
+def _index_template(tmpl_dir: Path) -> TemplateEntry:
+    from core.templates import get_template_path, get_tmpl_bundles
+    from core.features.repeatable import RepeatableBundle
+    from core.template_cache import extract_parts
+
+    entry = TemplateEntry(
+        name=tmpl_dir.name,
+        stats=dict(dir=_stat(tmpl_dir), bundles=_stat(tmpl_dir / BUNDLES_FILENAME))
+    )
+
+    try:
+        docx_path = get_template_path(tmpl_dir.name)
+        source = docx_path.read_bytes()
+        entry.docx = str(docx_path)
+        entry.docx_hash = hashlib.sha256(source).hexdigest()
+        entry.stats["docx"] = _stat(docx_path)
+
+        variables, attributes = _find_references([xml for xml, _ in extract_parts(source).values()])
+        bundles = get_tmpl_bundles(tmpl_dir)
+    except Exception as e:
+        entry.error = f"{type(e).__name__}: {e}"
+        return entry
+
+    # every context name with the names available on its items or nested objects
+    provided: dict[str, set[str]] = {}
+    for bundle in bundles:
+        if issubclass(bundle, RepeatableBundle):
+            provided[bundle.result_var_name] = bundle_context_names(bundle)
+            continue
+
+        for name in bundle_context_names(bundle):
+            annotation = bundle.model_fields[name].annotation if name in bundle.model_fields else None
+            is_nested = isinstance(annotation, type) and hasattr(annotation, "model_fields")
+            provided[name] = bundle_context_names(annotation) if is_nested else set()
+
+    entry.variables = sorted(variables)
+    entry.attributes = {name: sorted(attrs) for name, attrs in sorted(attributes.items())}
+    entry.bundles = [bundle.__name__ for bundle in bundles]
+    entry.missing = sorted(
+        [name for name in variables if name not in provided]
+        + [
+            f"{name}.{attr}"
+            for name, attrs in attributes.items() if provided.get(name)
+            for attr in attrs if attr not in provided[name]
+        ]
+    )
+    entry.unused = sorted(
+        [name for name in provided if name not in variables]
+        + [
+            f"{name}.{attr}"
+            for name, attrs in provided.items() if name in attributes
+            for attr in attrs if attr not in attributes[name]
+        ]
+    )
+
+    return entry
+
+
+class TemplateManifest:
+    """ Index of the templates, stored as JSON and refreshed incrementally
+
+    An entry is rebuilt only when its directory, .docx or bundles file changes. The manifest
+    is shared by the sessions of the daemon and its template watcher, so it is used under a lock.
+
+    Attributes:
+        path: path to the manifest file
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: dict[str, TemplateEntry] | None = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    @property
+    def entries(self) -> dict[str, TemplateEntry]:
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+
+            return self._entries
+
+    def _load(self) -> dict[str, TemplateEntry]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Broken template manifest {self.path}: {e}")
+            return {}
+
+        if data.get("version") != MANIFEST_VERSION:
+            return {}
+
+        return {name: TemplateEntry(**entry) for name, entry in data["templates"].items()}
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            tmp_path = self.path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            try:
+                self.path.parent.mkdir(exist_ok=True, parents=True)
+                with open(tmp_path, "w", encoding="utf-8") as fp:
+                    json.dump(
+                        dict(version=MANIFEST_VERSION, templates={name: asdict(e) for name, e in self.entries.items()}),
+                        fp, ensure_ascii=False, indent=2
+                    )
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                logger.warning(f"Could not write template manifest {self.path}: {e}")
+
+    @staticmethod
+    def _is_fresh(entry: TemplateEntry) -> bool:
+        tmpl_dir = TEMPLATES_PATH / entry.name
+        if entry.stats.get("dir") != _stat(tmpl_dir):
+            return False
+        if entry.docx and entry.stats.get("docx") != _stat(Path(entry.docx)):
+            return False
+
+        return entry.stats.get("bundles") == _stat(tmpl_dir / BUNDLES_FILENAME)
+
+    def _reindex(self, name: str) -> TemplateEntry:
+        entry = _index_template(TEMPLATES_PATH / name)
+        self.entries[name] = entry
+        self._dirty = True
+
+        if entry.error:
+            logger.error(f"Template {name} is broken: {entry.error}")
+        elif entry.missing:
+            logger.warning(f"Template {name} references values no bundle provides: {', '.join(entry.missing)}")
+        logger.debug(f"Indexed template {name}")
+
+        return entry
+
+    def refresh(self) -> dict[str, TemplateEntry]:
+        """ Reindex new and changed templates and drop the removed ones
+
+        Returns:
+            dict: a copy of the entries, by the template name
+        """
+        names = [name for name in os.listdir(TEMPLATES_PATH) if (TEMPLATES_PATH / name).is_dir()]
+
+        with self._lock:
+            for name in set(self.entries) - set(names):
+                del self.entries[name]
+                self._dirty = True
+
+            for name in names:
+                entry = self.entries.get(name)
+                if not entry or not self._is_fresh(entry):
+                    self._reindex(name)
+
+            self.save()
+            return dict(self.entries)
+
+    def get(self, name: str) -> TemplateEntry:
+        """ Get the entry of a template, reindexing it if it has changed """
+        with self._lock:
+            entry = self.entries.get(name)
+            if not entry or not self._is_fresh(entry):
+                entry = self._reindex(name)
+                self.save()
+
+            return entry
+
+    def get_variables(self, tmpl_path: Path) -> set[str] | None:
+        """ Top-level variables the template .docx references, None if the template could not be analyzed """
+        entry = self.get(tmpl_path.parent.name)
+        if entry.error or entry.docx is None or Path(entry.docx).resolve() != Path(tmpl_path).resolve():
+            return None
+
+        return set(entry.variables)
+
+    def names(self) -> list[str]:
+        """ Names of the indexed templates, test templates are hidden in the frozen build """
+        with self._lock:
+            return [name for name in self.entries if not FROZEN or not name.startswith("_")]
+
+
+template_manifest = TemplateManifest(CACHE_PATH / "manifest.json")
@@ -0,0 +1,286 @@
+import hashlib
+import re
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any, IO
+
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.opc.part import Part
+from docx.oxml.ns import qn, nsmap
+from docx.oxml.parser import OxmlElement
+from docx.oxml.numbering import CT_Num
+from docxtpl import DocxTemplate
+from lxml import etree
+
+from core.config import DOCX_COMPRESSION_LEVEL
+from core.packaging import MEDIA_PREFIX, save_docx
+from core.postprocess import post_processor
+from core.template_cache import template_cache
+from core.tracing import span
+
+# relationship ids of an element and of its descendants
+R_ATTRIBUTES = etree.XPath("descendant-or-self::*/@*[namespace-uri()=$ns]")
+DOCPR_IDS = etree.XPath(".//wp:docPr/@id", namespaces=nsmap)
+BOOKMARK_IDS = etree.XPath(".//w:bookmarkStart/@w:id", namespaces=nsmap)
+W_P = qn("w:p")
+WP_DOCPR = qn("wp:docPr")
+W_BOOKMARKS = (qn("w:bookmarkStart"), qn("w:bookmarkEnd"))
+W_NUM_ID = qn("w:numId")
+W_ID = qn("w:id")
+W_VAL = qn("w:val")
+W_START = qn("w:start")
+W_ILVL = qn("w:ilvl")
+# headers and footers of identical sections are shared
+SHARED_RELTYPES = frozenset((RT.HEADER, RT.FOOTER))
+PARTNAME_RE = re.compile(r"^(?P<stem>.*?)(?P<number>\d*)(?P<ext>\.\w+)$")
+
+
+class DocumentMerger:
+    """ Appends rendered documents of a template to the first one, each one as a new section
+
+    Body elements of the appended documents are moved into the merged document as they are,
+    so it is serialized once, when saved, and merging takes linear time. Relationships of the
+    moved elements are remapped to the merged document, identical media parts and headers and
+    footers are stored once. All the documents come from the same template, so they share the
+    styles and the numbering definitions, each section only restarts the lists it uses.
+
+    Lists numbered by paragraph styles continue through the sections, footnotes and comments
+    are taken from the first document only.
+
+    Attributes:
+        doc: the merged document, rendered from the first context
+        count: number of the sections
+    """
+    def __init__(self, doc: DocxTemplate):
+        self.doc = doc
+        self.count = 1
+        self._part = doc.docx.part
+        self._body = doc.docx.element.body
+        # properties of the last section, body.sectPr looks through the whole body for them,
+        # a body without them gets default ones, so that the section can be ended
+        self._sect_pr = self._body.get_or_add_sectPr()
+
+        self._targets: dict[tuple[str, Any], str] = {}
+        for rel in self._part.rels.values():
+            self._targets.setdefault(self._rel_key(rel), rel.rId)
+        self._next_rid = 1 + max((int(rId[3:]) for rId in self._part.rels if rId[3:].isdigit()), default=0)
+
+        self._shared: dict[Any, Part] = {}
+        for part in self._part.package.iter_parts():
+            if part.partname.startswith(MEDIA_PREFIX):
+                self._shared.setdefault(self._media_key(part), part)
+        for rel in self._part.rels.values():
+            if rel.reltype in SHARED_RELTYPES:
+                self._adopt(rel.target_part, rel.reltype)
+
+        self._next_docpr_id = 1 + max(map(int, DOCPR_IDS(self._body)), default=0)
+        self._next_bookmark_id = 1 + max(map(int, BOOKMARK_IDS(self._body)), default=0)
+        self._numbering = None
+        self._num_anchor = None
+        # abstract numbering of each numbering instance, start of each level of each abstract numbering
+        self._abstract_ids: dict[str, int] = {}
+        self._starts: dict[int, list[tuple[int, int]]] = {}
+        self._next_num_id = 0
+
+    @staticmethod
+    def _target_key(reltype: str, target: Part | str) -> tuple[str, Any]:
+        return reltype, target if isinstance(target, str) else id(target)
+
+    @classmethod
+    def _rel_key(cls, rel) -> tuple[str, Any]:
+        return cls._target_key(rel.reltype, rel.target_ref if rel.is_external else rel.target_part)
+
+    @staticmethod
+    def _media_key(part: Part) -> tuple[str, bytes]:
+        return part.content_type, hashlib.sha1(part.blob).digest()
+
+    def _adopt(self, part: Part, reltype: str) -> Part:
+        """ Part of the merged document that stands for a part of an appended one """
+        if part.partname.startswith(MEDIA_PREFIX):
+            return self._shared.setdefault(self._media_key(part), part)
+        if reltype not in SHARED_RELTYPES:
+            return part
+
+        # parts of headers and footers are shared in their turn, then identical headers are the same
+        rel_keys = []
+        for rel in part.rels.values():
+            if not rel.is_external:
+                rel._target = self._adopt(rel.target_part, rel.reltype)
+            rel_keys.append((rel.rId, *self._rel_key(rel)))
+
+        return self._shared.setdefault((part.content_type, part.blob, tuple(rel_keys)), part)
+
+    def _relate(self, reltype: str, target: Part | str, is_external: bool) -> str:
+        # relationships are looked up by their target here, python-docx scans all of them on every lookup
+        key = self._target_key(reltype, target)
+        if (rId := self._targets.get(key)) is None:
+            rId = f"rId{self._next_rid}"
+            self._next_rid += 1
+            self._part.rels.add_relationship(reltype, target, rId, is_external)
+            self._targets[key] = rId
+
+        return rId
+
+    def _remap_relationships(self, part: Part, elements: list[etree.ElementBase]):
+        mapping = {}
+        for element in elements:
+            for value in R_ATTRIBUTES(element, ns=nsmap["r"]):
+                if (rId := mapping.get(value)) is None:
+                    rel = part.rels[value]
+                    if rel.is_external:
+                        rId = self._relate(rel.reltype, rel.target_ref, True)
+                    else:
+                        rId = self._relate(rel.reltype, self._adopt(rel.target_part, rel.reltype), False)
+                    mapping[value] = rId
+                value.getparent().set(value.attrname, rId)
+
+    def _renumber_ids(self, elements: list[etree.ElementBase]):
+        """ Give the drawings and the bookmarks ids unique in the merged document """
+        offset = self._next_bookmark_id
+        for element in elements:
+            for docpr in element.iter(WP_DOCPR):
+                docpr.set("id", str(self._next_docpr_id))
+                self._next_docpr_id += 1
+
+            for bookmark in element.iter(*W_BOOKMARKS):
+                bookmark_id = offset + int(bookmark.get(W_ID))
+                bookmark.set(W_ID, str(bookmark_id))
+                self._next_bookmark_id = max(self._next_bookmark_id, bookmark_id + 1)
+
+    def _restart_lists(self, elements: list[etree.ElementBase]):
+        """ Point the lists of a section to new numbering instances that start over """
+        num_ids = {}
+        for element in elements:
+            for num_id in element.iter(W_NUM_ID):
+                if (value := num_id.get(W_VAL)) == "0":
+                    continue
+
+                if value not in num_ids:
+                    num_ids[value] = self._restarted_num(value)
+                if num_ids[value] is not None:
+                    num_id.set(W_VAL, num_ids[value])
+
+    def _load_numbering(self):
+        """ Index the numbering definitions once, the numbering part grows with every section """
+        self._numbering = self._part.numbering_part.element
+        for num in self._numbering.num_lst:
+            self._abstract_ids[str(num.numId)] = num.abstractNumId.val
+        for abstract_num in self._numbering.findall(qn("w:abstractNum")):
+            self._starts[int(abstract_num.get(qn("w:abstractNumId")))] = [
+                (int(lvl.get(W_ILVL)), int(start.get(W_VAL)) if (start := lvl.find(W_START)) is not None else 0)
+                for lvl in abstract_num.findall(qn("w:lvl"))
+            ]
+        self._next_num_id = 1 + max(map(int, self._abstract_ids), default=0)
+        # numbering instances go after the abstract ones, before Word's cleanup mark if there is one
+        self._num_anchor = self._numbering.find(qn("w:numIdMacAtCleanup"))
+
+    def _restarted_num(self, num_id: str) -> str | None:
+        if self._numbering is None:
+            self._load_numbering()
+
+        if (abstract_id := self._abstract_ids.get(num_id)) is None:
+            return None
+
+        num = CT_Num.new(self._next_num_id, abstract_id)
+        for ilvl, start in self._starts.get(abstract_id, ()):
+            num.add_lvlOverride(ilvl=ilvl).add_startOverride(start)
+        if self._num_anchor is not None:
+            self._num_anchor.addprevious(num)
+        else:
+            self._numbering.append(num)
+        self._next_num_id += 1
+
+        return str(num.numId)
+
+    @staticmethod
+    def _end_section(sect_pr: etree.ElementBase):
+        """ Move the properties of the last section of the body into its last paragraph, which ends the section """
+        last = sect_pr.getprevious()
+        if last is None or last.tag != W_P or last.pPr is not None and last.pPr.sectPr is not None:
+            last = OxmlElement("w:p")
+            sect_pr.addprevious(last)
+        last.set_sectPr(sect_pr)
+
+    def append(self, doc: DocxTemplate):
+        """ Move the body of the rendered document to the end of the merged one as a new section """
+        with span("merge_append"):
+            body = doc.docx.element.body
+            sect_pr = body.get_or_add_sectPr()
+            elements = [child for child in body if child is not sect_pr]
+
+            self._remap_relationships(doc.docx.part, elements + [sect_pr])
+            self._renumber_ids(elements)
+            self._restart_lists(elements)
+
+            # the properties of the last section so far end it, the appended ones are of the last section now
+            self._end_section(self._sect_pr)
+            self._body.append(sect_pr)
+            self._sect_pr = sect_pr
+            for element in elements:
+                sect_pr.addprevious(element)
+
+        self.count += 1
+
+    def _rename_duplicate_parts(self):
+        """ Give parts moved from the appended documents names not taken in the merged one """
+        used, next_numbers = set(), {}
+        duplicates = []
+        for part in self._part.package.iter_parts():
+            if part.partname in used:
+                duplicates.append(part)
+            used.add(part.partname)
+
+        for part in duplicates:
+            match = PARTNAME_RE.match(part.partname)
+            stem, ext = match["stem"], match["ext"]
+            number = next_numbers.get((stem, ext), 1)
+            while (name := f"{stem}{number}{ext}") in used:
+                number += 1
+            next_numbers[(stem, ext)] = number + 1
+            used.add(name)
+            part.partname = PackURI(name)
+
+    def save(self, target: Path | IO[bytes], compresslevel: int | None = DOCX_COMPRESSION_LEVEL):
+        self._rename_duplicate_parts()
+        with span("save", sections=self.count):
+            save_docx(self.doc, target, compresslevel)
+
+
+def render_section(tmpl_path: Path, context: dict[str, Any]) -> DocxTemplate:
+    with span("render", template=tmpl_path.name):
+        doc = template_cache.get(tmpl_path)
+        doc.render(context)
+        post_processor.process(doc.docx)
+
+    return doc
+
+
+def merge_documents(
+    tmpl_path: Path,
+    contexts: Iterable[dict[str, Any]],
+    target: Path | IO[bytes],
+    compresslevel: int | None = DOCX_COMPRESSION_LEVEL
+) -> int:
+    """ Render the template once per context into one document, a section per context
+
+    The first context is rendered as a whole document, the others only render the body,
+    the headers and the footers into one loaded package, which is not read again for each.
+
+    Returns:
+        int: number of the sections
+    """
+    contexts = iter(contexts)
+    if (first := next(contexts, None)) is None:
+        raise ValueError("There is nothing to merge")
+
+    merger = DocumentMerger(render_section(tmpl_path, first))
+    section = template_cache.get(tmpl_path)
+    for context in contexts:
+        with span("render", template=tmpl_path.name):
+            section.render_content(context)
+            post_processor.process(section.docx)
+        merger.append(section)
+
+    merger.save(target, compresslevel)
+    return merger.count
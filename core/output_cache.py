@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from enum import Enum
+from pathlib import Path
+from typing import Any, IO
+
+from loguru import logger
+from pydantic import BaseModel
+
+from core.config import (
+    OUTPUT_CACHE_PATH, OUTPUT_CACHE_MAX_SIZE, OUTPUT_CACHE_MAX_AGE, OUTPUT_CACHE_LINK, BUNDLES_FILENAME, FROZEN
+)
+from core.lazy_context import LazyBundle, get_instance
+
+# sources of the common bundles, the features, the renderer and the post-processing, documents depend on them too
+APP_SOURCES = Path(__file__).resolve().parent
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+@dataclass
+class OutputCacheStats:
+    """ Counters of the output cache in the current process """
+    hits: int = 0
+    misses: int = 0
+    skipped: int = 0
+    stored: int = 0
+    evicted: int = 0
+
+
+def _canonical(value: Any) -> Any:
+    """ Turn the render context into plain JSON data that is the same for the same input """
+    if isinstance(value, LazyBundle):
+        value = get_instance(value)
+
+    if isinstance(value, BaseModel):
+        # derived values follow from the fields, so they are not evaluated here
+        bundle = type(value)
+        return [bundle.__name__, {name: _canonical(getattr(value, name)) for name in bundle.model_fields}]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, Enum):
+        return _canonical(value.value)
+    if isinstance(value, (date, datetime, dt_time, Decimal)):
+        return str(value)
+    if isinstance(value, dict):
+        return {str(key): _canonical(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    # repeatable streams are identified by the content of their data file
+    if callable(digest := getattr(value, "digest", None)) and (value_digest := digest()):
+        return ["stream", value_digest]
+
+    raise _Uncacheable(type(value).__name__)
+
+
+class OutputCache:
+    """ Rendered documents by the template, the bundles, the application code and the context they were rendered from
+
+    A hit is hard-linked or copied to the target instead of rendering the document again.
+    Entries that were not used for max_age seconds, and the least recently used ones
+    above max_size bytes are evicted.
+
+    Attributes:
+        path: directory of the cached documents
+        max_size: maximal total size of the documents in bytes
+        max_age: maximal time since the last use of a document in seconds
+        link: whether to hard-link hits to the target instead of copying them
+        stats: hit/miss counters of the current process
+    """
+    def __init__(self, path: Path, max_size: int, max_age: float, link: bool = True):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.link = link
+        self.stats = OutputCacheStats()
+        self._size: int | None = None
+        self._code_digest: str | None = None
+        self._digests: dict[Path, tuple[tuple[int, int], str]] = {}
+
+    def file_digest(self, path: Path) -> str:
+        """ sha256 of the file content, recalculated only when the file's mtime or size changes """
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._digests.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as fp:
+            while chunk := fp.read(1024 * 1024):
+                digest.update(chunk)
+
+        self._digests[path] = (version, digest.hexdigest())
+        return digest.hexdigest()
+
+    def code_digest(self) -> str:
+        """ Digest of the application code, documents rendered by another version of it are not reused
+
+        The frozen build has the code inside the executable.
+        """
+        if self._code_digest is None:
+            paths = [Path(sys.executable)] if FROZEN else sorted(APP_SOURCES.rglob("*.py"))
+            digest = hashlib.sha256()
+            for path in paths:
+                digest.update(self.file_digest(path).encode())
+            self._code_digest = digest.hexdigest()
+
+        return self._code_digest
+
+    def get_key(self, tmpl_path: Path, tmpl_digest: str, context: dict[str, Any]) -> str | None:
+        """ Key of the document, None if the context has values that can not be hashed """
+        try:
+            data = json.dumps(_canonical(context), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        except _Uncacheable as e:
+            logger.debug(f"Context of {tmpl_path} is not cacheable: {e}")
+            return None
+
+        key = hashlib.sha256()
+        key.update(self.code_digest().encode())
+        key.update(tmpl_digest.encode())
+        key.update(self.file_digest(Path(tmpl_path).parent / BUNDLES_FILENAME).encode())
+        key.update(data.encode())
+
+        return key.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.path / f"{key}.docx"
+
+    def fetch(self, key: str, target: Path | IO[bytes]) -> bool:
+        """ Put the cached document to the target
+
+        Returns:
+            bool: whether the document was in the cache
+        """
+        entry = self._entry(key)
+        try:
+            os.utime(entry)
+            if isinstance(target, (str, Path)):
+                self._put(entry, Path(target))
+            else:
+                with open(entry, "rb") as fp:
+                    shutil.copyfileobj(fp, target)
+        except FileNotFoundError:
+            self.stats.misses += 1
+            return False
+
+        self.stats.hits += 1
+        return True
+
+    def _put(self, entry: Path, target: Path):
+        target.unlink(missing_ok=True)
+        if self.link:
+            try:
+                os.link(entry, target)
+                return
+            except OSError:
+                # other file system or no hard link support
+                pass
+
+        shutil.copyfile(entry, target)
+
+    def store(self, key: str, data: bytes | Path):
+        """ Put a rendered document, given as bytes or as a saved file, into the cache """
+        entry = self._entry(key)
+        tmp_path = entry.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            self.path.mkdir(exist_ok=True, parents=True)
+            if isinstance(data, Path):
+                shutil.copyfile(data, tmp_path)
+            else:
+                tmp_path.write_bytes(data)
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, entry)
+        except OSError as e:
+            logger.warning(f"Could not write output cache file {entry}: {e}")
+            return
+
+        self.stats.stored += 1
+        if self._size is None:
+            self.evict()
+        else:
+            self._size += size
+            if self._size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """ Remove the expired documents and the least recently used ones above max_size """
+        entries = []
+        for entry in self.path.glob("*.docx"):
+            try:
+                entries.append((entry.stat(), entry))
+            except FileNotFoundError:
+                # evicted by another process
+                pass
+
+        entries.sort(key=lambda item: item[0].st_mtime)
+        total = sum(stat.st_size for stat, _ in entries)
+        deadline = time.time() - self.max_age
+        # above the limit the cache is shrunk to 90% of it, so eviction does not run after every store
+        target_size = self.max_size if total <= self.max_size else self.max_size * 0.9
+
+        for stat, entry in entries:
+            if stat.st_mtime >= deadline and total <= target_size:
+                break
+
+            entry.unlink(missing_ok=True)
+            total -= stat.st_size
+            self.stats.evicted += 1
+
+        self._size = total
+
+    def clear(self) -> int:
+        """ Remove all the cached documents
+
+        Returns:
+            int: number of the removed documents
+        """
+        count = 0
+        for entry in self.path.glob("*.docx"):
+            entry.unlink(missing_ok=True)
+            count += 1
+
+        self._size = 0
+        return count
+
+    def size(self) -> tuple[int, int]:
+        """ Number and total size of the cached documents """
+        sizes = [entry.stat().st_size for entry in self.path.glob("*.docx")]
+        return len(sizes), sum(sizes)
+
+
+output_cache = OutputCache(OUTPUT_CACHE_PATH, OUTPUT_CACHE_MAX_SIZE, OUTPUT_CACHE_MAX_AGE, OUTPUT_CACHE_LINK)
@@ -0,0 +1,137 @@
+import hashlib
+import sys
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import IO
+
+from docx.opc.package import OpcPackage
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.part import Part
+from docx.opc.pkgwriter import _ContentTypesItem
+from docxtpl import DocxTemplate
+from loguru import logger
+
+from core.config import DOCX_COMPRESSION_LEVEL
+
+MEDIA_PREFIX = "/word/media/"
+# members of the .docx get a fixed time, so the same document is always saved to the same bytes
+MEMBER_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def dedupe_media(package: OpcPackage) -> int:
+    """ Point all the relationships to identical media parts at one of them
+
+    The other copies are not reachable from the relationships anymore, so they are not saved.
+
+    Returns:
+        int: number of the dropped copies
+    """
+    canonical: dict[tuple[str, bytes], Part] = {}
+    duplicates: dict[Part, Part] = {}
+    for part in package.iter_parts():
+        if part.partname.startswith(MEDIA_PREFIX):
+            key = (part.content_type, hashlib.sha1(part.blob).digest())
+            if (first := canonical.setdefault(key, part)) is not part:
+                duplicates[part] = first
+
+    if not duplicates:
+        return 0
+
+    for source in (package, *package.iter_parts()):
+        for rel in source.rels.values():
+            if not rel.is_external and rel.target_part in duplicates:
+                rel._target = duplicates[rel.target_part]
+
+    logger.debug(f"Dropped {len(duplicates)} duplicate media parts")
+    return len(duplicates)
+
+
+def _compression(compresslevel: int | None) -> tuple[int, int | None]:
+    if compresslevel is not None and not 0 <= compresslevel <= 9:
+        raise ValueError(f"Compression level must be from 0 to 9, got {compresslevel}")
+
+    # level 0 is stored as is, which is faster to write and read than deflate without compression
+    if compresslevel == 0:
+        return zipfile.ZIP_STORED, None
+
+    return zipfile.ZIP_DEFLATED, compresslevel
+
+
+def save_docx(doc: DocxTemplate, target: Path | IO[bytes], compresslevel: int | None = DOCX_COMPRESSION_LEVEL):
+    """ Save a rendered document like ``DocxTemplate.save`` with deduplicated media and a chosen compression
+
+    Args:
+        doc: rendered document
+        target: path or binary file-like object, it does not have to be seekable
+        compresslevel: zlib level from 0 (stored) to 9 (smallest), None for the zlib default
+    """
+    compress_type, level = _compression(compresslevel)
+
+    doc.pre_processing()
+    package = doc.docx.part.package
+    dedupe_media(package)
+
+    parts = list(package.iter_parts())
+    for part in parts:
+        part.before_marshal()
+
+    def write(name: str, data: bytes):
+        info = zipfile.ZipInfo(name, MEMBER_DATE_TIME)
+        archive.writestr(info, data, compress_type=compress_type, compresslevel=level)
+
+    # the same members in the same order as python-docx writes them
+    with zipfile.ZipFile(target, "w") as archive:
+        write(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+        write(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+        for part in parts:
+            write(part.partname.membername, part.blob)
+            if len(part.rels):
+                write(part.partname.rels_uri.membername, part.rels.xml)
+
+    doc.post_processing(target)
+    doc.is_saved = True
+
+
+class DocumentBundle:
+    """ ZIP archive that rendered documents are streamed into one by one
+
+    Documents are added as bytes, without temporary files, and the target can be
+    a pipe like stdout. They are already compressed, so they are stored as is.
+
+    Usage:
+        with DocumentBundle(Path("output/documents.zip")) as bundle:
+            bundle.add("Доверенность_1.docx", data)
+    """
+    def __init__(self, target: Path | IO[bytes]):
+        self.target = target
+        self.count = 0
+        self._names: set[str] = set()
+        self._archive = zipfile.ZipFile(target, "w", zipfile.ZIP_STORED)
+
+    @classmethod
+    def open(cls, path: str | Path) -> "DocumentBundle":
+        """ Bundle written to the path, or to stdout for "-" """
+        if str(path) == "-":
+            return cls(sys.stdout.buffer)
+
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        return cls(Path(path))
+
+    def add(self, name: str, data: bytes):
+        if name in self._names:
+            raise ValueError(f"Document {name} is already in the bundle")
+
+        self._names.add(name)
+        self._archive.writestr(zipfile.ZipInfo(name, datetime.now().timetuple()[:6]), data)
+        self.count += 1
+
+    def close(self):
+        self._archive.close()
+
+    def __enter__(self) -> "DocumentBundle":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, tb: TracebackType | None):
+        self.close()
@@ -0,0 +1,228 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterable, Iterator
+from typing import ClassVar
+
+from docx.document import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
+from lxml import etree
+
+from core.config import POSTPROCESS_PASSES
+from core.tracing import span
+
+W_P = qn("w:p")
+W_R = qn("w:r")
+W_T = qn("w:t")
+W_RPR = qn("w:rPr")
+W_TAB = qn("w:tab")
+W_TABS = qn("w:tabs")
+W_TR = qn("w:tr")
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+# elements that make a paragraph without text still visible or meaningful
+CONTENT_TAGS = tuple(qn(tag) for tag in (
+    "w:drawing", "w:pict", "w:object", "w:br", "w:cr", "w:tab", "w:ptab", "w:sym",
+    "w:fldSimple", "w:fldChar", "w:instrText", "w:sectPr", "w:bookmarkStart",
+    "w:footnoteReference", "w:endnoteReference", "w:commentReference", "m:oMath", "m:oMathPara",
+))
+# containers that must keep at least one paragraph
+PARAGRAPH_CONTAINERS = frozenset(qn(tag) for tag in ("w:tc", "w:body", "w:hdr", "w:ftr", "w:txbxContent"))
+RSID_ATTRIBUTES = tuple(qn(f"w:{name}") for name in ("rsidR", "rsidRPr", "rsidRDefault", "rsidP", "rsidDel", "rsidTr"))
+
+
+class PostPass(ABC):
+    """ Fix-up of a rendered document
+
+    PostProcessor calls ``visit`` for every element with one of the ``tags``. Elements are
+    removed after the traversal, so passes see the whole tree, ``finish`` runs after that.
+
+    Attributes:
+        name: name of the pass in POSTPROCESS_PASSES
+        tags: qualified tags of the elements the pass visits
+    """
+    name: ClassVar[str]
+    tags: ClassVar[tuple[str, ...]]
+
+    @abstractmethod
+    def visit(self, element: etree.ElementBase) -> bool:
+        """ Process the element
+
+        Returns:
+            bool: whether to remove the element
+        """
+
+    def finish(self):
+        pass
+
+
+post_passes: dict[str, type[PostPass]] = {}
+
+
+def register_pass[T: type[PostPass]](cls: T) -> T:
+    """ Make the pass available by its name in POSTPROCESS_PASSES """
+    post_passes[cls.name] = cls
+    return cls
+
+
+@register_pass
+class TabStopsPass(PostPass):
+    """ Removes the tab stops set on paragraphs, the ones of the styles stay """
+    name = "tab_stops"
+    tags = (W_TABS,)
+
+    def visit(self, element: etree.ElementBase) -> bool:
+        return True
+
+
+@register_pass
+class EmptyParagraphsPass(PostPass):
+    """ Removes paragraphs without text or other content, like the ones left by jinja blocks
+
+    The only paragraph of a cell, a header or a footer is kept, as Word requires one.
+    """
+    name = "empty_paragraphs"
+    tags = (W_P,)
+
+    def visit(self, element: etree.ElementBase) -> bool:
+        for child in element.iter(*CONTENT_TAGS):
+            # tab stops of the paragraph are not content, unlike tabs in the text
+            if child.tag != W_TAB or child.getparent().tag != W_TABS:
+                return False
+
+        return not any(t.text for t in element.iter(W_T))
+
+
+@register_pass
+class NormalizeStylesPass(PostPass):
+    """ Drops editing session ids and proofing marks and merges adjacent runs with the same formatting
+
+    Rendering splits text into many runs, merged they make the document smaller and easier to edit.
+    """
+    name = "normalize_styles"
+    tags = (W_P, W_R, W_TR, qn("w:proofErr"), qn("w:lastRenderedPageBreak"))
+
+    def __init__(self):
+        self.paragraphs: list[etree.ElementBase] = []
+
+    def visit(self, element: etree.ElementBase) -> bool:
+        tag = element.tag
+        if tag == W_P or tag == W_R or tag == W_TR:
+            if element.keys():
+                attrib = element.attrib
+                for name in RSID_ATTRIBUTES:
+                    attrib.pop(name, None)
+            if tag == W_P:
+                self.paragraphs.append(element)
+            return False
+
+        return True
+
+    @staticmethod
+    def _text_run_format(run: etree.ElementBase) -> list | None:
+        """ Formatting of a run with text only as comparable data, None for other runs """
+        rpr = None
+        for child in run:
+            if child.tag == W_RPR and rpr is None:
+                rpr = child
+            elif child.tag != W_T:
+                return None
+
+        if run.attrib:
+            return None
+
+        if rpr is None:
+            return []
+
+        # serializing a subelement of a large tree is slow, its structure is compared instead
+        return [(el.tag, el.items(), el.text) for el in rpr.iter()]
+
+    def finish(self):
+        for paragraph in self.paragraphs:
+            if paragraph.getparent() is None:
+                continue
+
+            previous, previous_format = None, None
+            for run in paragraph.findall(W_R):
+                run_format = self._text_run_format(run)
+                if run_format is None or run_format != previous_format or run.getprevious() is not previous:
+                    previous, previous_format = run, run_format
+                    continue
+
+                texts = previous.findall(W_T)
+                target = texts[-1] if texts else etree.SubElement(previous, W_T)
+                target.text = (target.text or "") + "".join(t.text or "" for t in run.iter(W_T))
+                target.set(XML_SPACE, "preserve")
+                paragraph.remove(run)
+
+
+def _keeps_paragraph(element: etree.ElementBase) -> bool:
+    """ Whether the element is the only paragraph of a container that needs one """
+    parent = element.getparent()
+    return (
+        element.tag == W_P and parent.tag in PARAGRAPH_CONTAINERS
+        and next(element.itersiblings(W_P), None) is None
+        and next(element.itersiblings(W_P, preceding=True), None) is None
+    )
+
+
+def document_roots(docx: Document) -> Iterator[etree.ElementBase]:
+    """ Root elements of the document body, the headers and the footers """
+    yield docx.element
+
+    seen = set()
+    for rel in docx.part.rels.values():
+        if rel.is_external or rel.reltype not in (RT.HEADER, RT.FOOTER) or rel.target_part in seen:
+            continue
+
+        seen.add(rel.target_part)
+        if (element := getattr(rel.target_part, "element", None)) is not None:
+            yield element
+
+
+class PostProcessor:
+    """ Applies fix-up passes to rendered documents in one traversal of each part
+
+    Attributes:
+        passes: pass classes, applied in this order to each element
+    """
+    def __init__(self, passes: Iterable[type[PostPass]]):
+        self.passes = tuple(passes)
+
+    @classmethod
+    def from_names(cls, names: Iterable[str]) -> "PostProcessor":
+        try:
+            return cls(post_passes[name] for name in names)
+        except KeyError as e:
+            raise ValueError(f"Unknown post-processing pass {e}, expected one of {', '.join(post_passes)}") from None
+
+    @property
+    def names(self) -> tuple[str, ...]:
+        return tuple(cls.name for cls in self.passes)
+
+    def process(self, docx: Document):
+        if not self.passes:
+            return
+
+        passes = [cls() for cls in self.passes]
+        handlers: dict[str, list[PostPass]] = {}
+        for post_pass in passes:
+            for tag in post_pass.tags:
+                handlers.setdefault(tag, []).append(post_pass)
+
+        with span("postprocess", passes=",".join(self.names)):
+            removed = []
+            for root in document_roots(docx):
+                for element in root.iter(*handlers):
+                    # all the passes visit the element, even if one of them removes it
+                    if any([post_pass.visit(element) for post_pass in handlers[element.tag]]):
+                        removed.append(element)
+
+            for element in removed:
+                if (parent := element.getparent()) is not None and not _keeps_paragraph(element):
+                    parent.remove(element)
+
+            for post_pass in passes:
+                post_pass.finish()
+
+
+post_processor = PostProcessor.from_names(POSTPROCESS_PASSES)
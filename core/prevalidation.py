@@ -0,0 +1,164 @@
+import reprlib
+from collections.abc import Iterable
+from dataclasses import dataclass
+from itertools import batched
+from typing import Any
+
+from pydantic import BaseModel, ValidationError
+
+from core.features.repeatable import RepeatableBundle
+from core.tracing import span
+from core.validation import fill_nullable, get_nullable_fields, precompile_column_validators
+
+# rows checked at once, columns of a chunk are validated in one call each
+CHUNK_SIZE = 4096
+
+# instance data of a bundle: number of the row, path of the instance in the row, the data
+type Record = tuple[int, str, dict[str, Any]]
+
+
+@dataclass
+class FieldError:
+    """ Value of a row that does not fit its field
+
+    Attributes:
+        index: number of the row in the data file, starting from 1
+        field: path of the value in the row, like ``passport_no`` or ``citizen_datas.0.birth_date``
+        message: what is wrong with the value
+        value: the value, None for missing ones
+    """
+    index: int
+    field: str
+    message: str
+    value: Any = None
+
+
+def _check_records(bundle: type[BaseModel], records: list[Record]) -> list[FieldError]:
+    """ Check the fields of the bundle column by column """
+    errors = []
+    validators = precompile_column_validators(bundle)
+    # missing fields that accept None are None, like in validate_bundle
+    nullable, nested = get_nullable_fields(bundle)
+    datas = [data for _, _, data in records]
+    for name, info in bundle.model_fields.items():
+        column = [data[name] for data in datas if name in data]
+        if name in nested:
+            column = [fill_nullable(nested[name], value) if isinstance(value, dict) else value for value in column]
+        positions = range(len(records))
+        # usually every row has the field, the rows without it are looked for only otherwise
+        if len(column) < len(records):
+            positions = [position for position, data in enumerate(datas) if name in data]
+            if info.is_required() and name not in nullable:
+                errors += [
+                    FieldError(index, prefix + name, "Field required")
+                    for index, prefix, data in records if name not in data
+                ]
+
+        if not column:
+            continue
+
+        try:
+            validators[name].validate_python(column)
+        except ValidationError as e:
+            for error in e.errors(include_url=False):
+                position, *loc = error["loc"]
+                index, prefix, _ = records[positions[position]]
+                path = prefix + ".".join(map(str, (name, *loc)))
+                errors.append(FieldError(index, path, error["msg"], error.get("input")))
+
+    return errors
+
+
+def _bundle_records(
+    bundle: type[BaseModel],
+    chunk: Iterable[tuple[int, dict[str, Any]]]
+) -> tuple[list[Record], list[FieldError]]:
+    """ Instances of the bundle in the rows, items of repeatable bundles are instances too """
+    if not issubclass(bundle, RepeatableBundle):
+        return [(index, "", row) for index, row in chunk], []
+
+    records, errors = [], []
+    name = bundle.result_var_name
+    for index, row in chunk:
+        items = row.get(name) or []
+        # data files of repeatable bundles are checked while they are streamed
+        if isinstance(items, str):
+            continue
+        if not isinstance(items, list):
+            errors.append(FieldError(index, name, "Input should be a valid list", items))
+            continue
+
+        for number, item in enumerate(items):
+            if isinstance(item, dict):
+                records.append((index, f"{name}.{number}.", item))
+            else:
+                errors.append(FieldError(index, f"{name}.{number}", "Input should be a valid dictionary", item))
+
+    return records, errors
+
+
+def prevalidate(
+    bundles: list[type[BaseModel]],
+    rows: Iterable[dict[str, Any]],
+    chunk_size: int = CHUNK_SIZE
+) -> list[FieldError]:
+    """ Check every row of a dataset against the template's bundles before rendering
+
+    Fields are checked one at a time over a chunk of rows, so the checks run in a few
+    calls instead of building a model per row. Validators of the models themselves
+    are not run, rows that pass may still fail when they are rendered.
+
+    Returns:
+        list: errors of all the rows, ordered by row
+    """
+    errors = []
+    with span("prevalidate"):
+        for chunk in batched(enumerate(rows, start=1), chunk_size):
+            errors += [
+                FieldError(index, "row", "Input should be a valid dictionary", row)
+                for index, row in chunk if not isinstance(row, dict)
+            ]
+            chunk = [(index, row) for index, row in chunk if isinstance(row, dict)]
+            for bundle in bundles:
+                records, bundle_errors = _bundle_records(bundle, chunk)
+                errors += bundle_errors
+                errors += _check_records(bundle, records)
+
+    # bundles can share fields, their errors are reported once
+    unique = {}
+    for error in errors:
+        unique.setdefault((error.index, error.field, error.message), error)
+
+    return sorted(unique.values(), key=lambda error: error.index)
+
+
+def prevalidate_items(
+    bundle: type[BaseModel],
+    items: Iterable[dict[str, Any]],
+    chunk_size: int = CHUNK_SIZE
+) -> list[FieldError]:
+    """ Check every row of a data file of a repeatable bundle, see prevalidate """
+    errors = []
+    with span("prevalidate", bundle=bundle.__name__):
+        for chunk in batched(enumerate(items, start=1), chunk_size):
+            errors += [
+                FieldError(index, "row", "Input should be a valid dictionary", item)
+                for index, item in chunk if not isinstance(item, dict)
+            ]
+            errors += _check_records(bundle, [(index, "", item) for index, item in chunk if isinstance(item, dict)])
+
+    return sorted(errors, key=lambda error: error.index)
+
+
+def group_errors(errors: list[FieldError]) -> dict[int, str]:
+    """ One line describing all the errors of each failing row, by row number """
+    lines: dict[int, list[str]] = {}
+    for error in errors:
+        value = "" if error.message == "Field required" else f" (got {reprlib.repr(error.value)})"
+        lines.setdefault(error.index, []).append(f"{error.field}: {error.message}{value}")
+
+    return {index: "; ".join(parts) for index, parts in lines.items()}
+
+
+def format_report(errors: list[FieldError]) -> str:
+    return "\n".join(f"Row {index}: {line}" for index, line in group_errors(errors).items())
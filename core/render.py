@@ -0,0 +1,65 @@
+import io
+from pathlib import Path
+from typing import Any, IO
+
+from core.config import OUTPUT_CACHE, DOCX_COMPRESSION_LEVEL
+from core.output_cache import output_cache
+from core.packaging import save_docx
+from core.postprocess import post_processor
+from core.template_cache import template_cache
+from core.tracing import span
+
+
+def render_document(
+    tmpl_path: Path,
+    context: dict[str, Any],
+    target: Path | IO[bytes],
+    compresslevel: int | None = DOCX_COMPRESSION_LEVEL
+) -> bool:
+    """ Render the template .docx with the context and save it
+
+    With OUTPUT_CACHE on, a document rendered before from the same template, bundles
+    and context is taken from the output cache instead.
+
+    Args:
+        tmpl_path: path to the template .docx
+        context: render context
+        target: path or binary file-like object to save the document to
+        compresslevel: zlib level of the saved document, see save_docx
+
+    Returns:
+        bool: whether the document was taken from the output cache
+    """
+    key = None
+    if OUTPUT_CACHE:
+        with span("output_cache", template=tmpl_path.name):
+            # documents rendered with other post-processing passes or saved at another level are different documents
+            tmpl_digest = (
+                f"{template_cache.get_prepared(tmpl_path).digest}:{','.join(post_processor.names)}:{compresslevel}"
+            )
+            key = output_cache.get_key(tmpl_path, tmpl_digest, context)
+            if key is None:
+                output_cache.stats.skipped += 1
+            elif output_cache.fetch(key, target):
+                return True
+
+    with span("load_template", template=tmpl_path.name):
+        doc = template_cache.get(tmpl_path)
+
+    with span("render", template=tmpl_path.name):
+        doc.render(context)
+        post_processor.process(doc.docx)
+
+    with span("save", template=tmpl_path.name):
+        if key is None:
+            save_docx(doc, target, compresslevel)
+        elif isinstance(target, (str, Path)):
+            save_docx(doc, target, compresslevel)
+            output_cache.store(key, Path(target))
+        else:
+            buffer = io.BytesIO()
+            save_docx(doc, buffer, compresslevel)
+            target.write(buffer.getvalue())
+            output_cache.store(key, buffer.getvalue())
+
+    return False
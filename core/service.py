@@ -0,0 +1,174 @@
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote
+
+from aiohttp import web
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+from core.templates import get_template_path, get_tmpl_bundles, list_templates
+from core.batch import dump_row, validate_row
+from core.features.external import close_sources, prefetch
+from core.features.n2w import n2w_batch
+from core.features.repeatable import RepeatableBundle
+from core.manifest import template_manifest
+from core.render import render_document
+
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+CHUNK_SIZE = 64 * 1024
+
+
+def _render_to_bytes(tmpl_path: Path, context: dict[str, Any]) -> bytes:
+    buffer = io.BytesIO()
+    render_document(tmpl_path, context, buffer)
+
+    return buffer.getvalue()
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _json_error(status: int, message: str, **extra) -> web.Response:
+    return web.json_response(dict(error=message, **extra), status=status, dumps=_dumps)
+
+
+class RenderService:
+    """ Local HTTP API for rendering templates
+
+    Rendering runs in a process pool, at most ``workers`` documents are rendered at once
+    and at most ``max_queue`` requests wait for a worker, the rest are rejected with 503.
+
+    Endpoints:
+        GET /templates: templates with JSON schemas of their bundles
+        POST /templates/{name}/render: render the template with the JSON context from the body
+    """
+    def __init__(self, workers: int | None = None, max_queue: int = 32):
+        workers = workers or os.cpu_count() or 1
+        # validation runs in threads, worker processes are not forked from the threaded process where it can be helped
+        methods = multiprocessing.get_all_start_methods()
+        self.executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("forkserver") if "forkserver" in methods else None
+        )
+        self.semaphore = asyncio.Semaphore(workers)
+        self.max_queue = max_queue
+        self.waiting = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/templates", self.list_templates),
+            web.post("/templates/{name}/render", self.render),
+        ])
+        app.on_cleanup.append(self._shutdown)
+
+        return app
+
+    async def _shutdown(self, _):
+        self.executor.shutdown(cancel_futures=True)
+        await close_sources()
+
+    @staticmethod
+    def _get_template(name: str) -> Path:
+        if name not in list_templates():
+            raise web.HTTPNotFound(text=f"Template '{name}' not found")
+
+        return get_template_path(name)
+
+    @staticmethod
+    def _make_context(tmpl_path: Path, bundles: list[type[BaseModel]], row: dict[str, Any]) -> dict[str, Any]:
+        """ Validate the row and dump it to the plain context of the template, it blocks and runs in a thread """
+        # the context is sent to a worker process as plain data, so num2words fields are all generated
+        with n2w_batch():
+            instances = validate_row(bundles, row, streams=False)
+
+        context = dump_row(instances)
+        # values the template does not reference are not sent to the worker
+        if (variables := template_manifest.get_variables(tmpl_path)) is not None:
+            context = {name: value for name, value in context.items() if name in variables}
+
+        return context
+
+    async def list_templates(self, _: web.Request) -> web.Response:
+        templates = []
+        for name in list_templates():
+            bundles = get_tmpl_bundles(get_template_path(name).parent)
+            templates.append(dict(
+                name=name,
+                bundles=[
+                    dict(
+                        name=bundle.__name__,
+                        repeatable_as=bundle.result_var_name if issubclass(bundle, RepeatableBundle) else None,
+                        schema=bundle.model_json_schema(),
+                    )
+                    for bundle in bundles
+                ]
+            ))
+
+        return web.json_response(templates, dumps=_dumps)
+
+    async def render(self, request: web.Request) -> web.StreamResponse:
+        name = request.match_info["name"]
+        tmpl_path = self._get_template(name)
+
+        try:
+            row = await request.json()
+        except json.JSONDecodeError as e:
+            return _json_error(400, f"Invalid JSON: {e}")
+        if not isinstance(row, dict):
+            return _json_error(400, "Context must be a JSON object")
+
+        if self.waiting >= self.max_queue:
+            return _json_error(503, "Too many requests, try again later")
+
+        bundles = await asyncio.to_thread(get_tmpl_bundles, tmpl_path.parent)
+        # requests count as waiting from here, their validation runs in threads and takes time as well
+        self.waiting += 1
+        try:
+            # validation then finds the external data in the sources' cache
+            await prefetch(bundles, [row])
+            context = await asyncio.to_thread(self._make_context, tmpl_path, bundles, row)
+            await self.semaphore.acquire()
+        except ValidationError as e:
+            return _json_error(422, "Validation failed", details=json.loads(e.json(include_url=False)))
+        except ValueError as e:
+            return _json_error(422, str(e))
+        finally:
+            self.waiting -= 1
+
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _render_to_bytes, tmpl_path, context
+            )
+        except Exception as e:
+            logger.exception(f"Rendering of {name} failed")
+            return _json_error(500, f"Rendering failed: {type(e).__name__}: {e}")
+        finally:
+            self.semaphore.release()
+
+        filename = quote(f"{tmpl_path.stem}.docx")
+        response = web.StreamResponse(headers={
+            "Content-Type": DOCX_CONTENT_TYPE,
+            "Content-Disposition": f"attachment; filename*=UTF-8''{filename}",
+        })
+        response.content_length = len(data)
+        await response.prepare(request)
+        for start in range(0, len(data), CHUNK_SIZE):
+            await response.write(data[start:start + CHUNK_SIZE])
+        await response.write_eof()
+
+        return response
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, workers: int | None = None, max_queue: int = 32):
+    async def make_app() -> web.Application:
+        return RenderService(workers, max_queue).make_app()
+
+    logger.info(f"Serving templates on http://{host}:{port}")
+    web.run_app(make_app(), host=host, port=port, print=None)
@@ -0,0 +1,275 @@
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from core.batch import build_context, fill_rows
+from core.config import OUTPUT_PATH, SPOOL_PATH, QUEUE_LEASE_TIMEOUT, QUEUE_MAX_ATTEMPTS, QUEUE_POLL_INTERVAL
+from core.manifest import template_manifest
+from core.render import render_document
+from core.templates import get_template_path, get_tmpl_bundles, list_templates
+from core.tracing import span
+
+# subdirectories of the spool a job moves through, tmp holds the files being written
+SPOOL_DIRS = ("tmp", "incoming", "claimed", "done", "failed")
+
+
+class SpoolQueue:
+    """ Render jobs kept as JSON files in a spool directory, worked off by any number of workers
+
+    A job is a file with the name of the template and the data row. It moves from incoming to
+    claimed and then to done or failed by renames, which are atomic on one filesystem, so the
+    workers need nothing but the directory and may run on several hosts sharing it. A worker
+    claims a job by renaming it into claimed under its own name, only one of the workers racing
+    for a job gets it. The claim is a lease: a job claimed longer than the lease timeout ago is
+    queued again, and failed after it was claimed max_attempts times. Leases are checked against
+    the modification times of the claims, so the clocks of the hosts should be in sync.
+
+    The document of a job is saved to OUTPUT_PATH under the name of the job, so a job rendered
+    twice after an expired lease overwrites the same document.
+
+    Attributes:
+        path: spool directory
+        worker: name of this worker, unique across the hosts
+        lease_timeout: seconds a claimed job stays with its worker, longer than any render
+        max_attempts: number of claims of a job before it is failed
+    """
+    def __init__(
+        self,
+        path: Path = SPOOL_PATH,
+        lease_timeout: float = QUEUE_LEASE_TIMEOUT,
+        max_attempts: int = QUEUE_MAX_ATTEMPTS
+    ):
+        self.path = path
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._templates: dict[str, Path] = {}
+
+        for name in SPOOL_DIRS:
+            (path / name).mkdir(exist_ok=True, parents=True)
+
+    def _publish(self, data: dict[str, Any], target: Path):
+        """ Write the job file whole under a temporary name first, so workers never read a partial one """
+        partial = self.path / "tmp" / f"{target.name}.{self.worker}"
+        partial.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(partial, target)
+
+    def submit(self, template: str, rows: Iterable[dict[str, Any]]) -> list[str]:
+        """ Queue a render of the template for every row
+
+        Returns:
+            list: ids of the jobs, their documents are saved as <template>_<id>.docx
+        """
+        # ids of a submission share a random prefix, so submissions from several hosts do not collide
+        prefix = uuid.uuid4().hex[:8]
+        job_ids = []
+        for index, row in enumerate(rows, start=1):
+            job_id = f"{prefix}-{index:06d}"
+            self._publish(dict(template=template, row=row, attempts=0), self.path / "incoming" / f"{job_id}.json")
+            job_ids.append(job_id)
+
+        return job_ids
+
+    def counts(self) -> dict[str, int]:
+        return {name: sum(1 for _ in (self.path / name).glob("*.json")) for name in SPOOL_DIRS[1:]}
+
+    def recover(self) -> int:
+        """ Queue the jobs of expired leases again, their workers crashed or hang
+
+        Returns:
+            int: number of the jobs queued again
+        """
+        expired = time.time() - self.lease_timeout
+        recovered = 0
+        for path in (self.path / "claimed").glob("*.json"):
+            job_id, _, worker = path.stem.rpartition("@")
+            try:
+                if path.stat().st_mtime > expired:
+                    continue
+                # another worker may recover it at the same time, only one of the renames succeeds
+                os.rename(path, self.path / "incoming" / f"{job_id}.json")
+            except FileNotFoundError:
+                continue
+
+            logger.warning(f"Job {job_id}: the lease of {worker} expired, the job is queued again")
+            recovered += 1
+
+        # files left by the workers that crashed while writing them
+        for path in (self.path / "tmp").iterdir():
+            try:
+                if path.stat().st_mtime <= expired:
+                    path.unlink()
+            except FileNotFoundError:
+                continue
+
+        return recovered
+
+    def _claim(self, path: Path) -> tuple[Path, dict[str, Any]] | None:
+        claim = self.path / "claimed" / f"{path.stem}@{self.worker}.json"
+        try:
+            # a rename keeps the time the job was written, the lease starts before the job is in claimed
+            os.utime(path)
+            os.rename(path, claim)
+            text = claim.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            # another worker claimed the job first
+            return None
+
+        try:
+            job = json.loads(text)
+        except ValueError as e:
+            job = dict(error=f"Unreadable job file: {e}")
+        job["attempts"] = job.get("attempts", 0) + 1
+        self._publish(job, claim)
+
+        return claim, job
+
+    def _finish(self, claim: Path, job: dict[str, Any], state: str):
+        job_id = claim.stem.rpartition("@")[0]
+        job["worker"] = self.worker
+        partial = self.path / "tmp" / f"{job_id}.json.{self.worker}"
+        partial.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+        released = self.path / "tmp" / claim.name
+        try:
+            # the claim is taken away before the job is published, a claim recovered meanwhile is not created again
+            os.rename(claim, released)
+        except FileNotFoundError:
+            partial.unlink(missing_ok=True)
+            logger.warning(f"Job {job_id}: the lease expired while it was processed, another worker has it")
+            return
+
+        os.replace(partial, self.path / state / f"{job_id}.json")
+        released.unlink(missing_ok=True)
+
+    def _render(self, job_id: str, job: dict[str, Any]) -> Path:
+        name = job["template"]
+        # the name comes from a file anyone with access to the spool can write, only templates are rendered
+        if not isinstance(name, str) or name not in self._templates and name not in list_templates():
+            raise ValueError(f"Template {name!r} not found")
+        if (tmpl_path := self._templates.get(name)) is None:
+            tmpl_path = self._templates[name] = get_template_path(name)
+
+        bundles = get_tmpl_bundles(tmpl_path.parent)
+        row = next(fill_rows(bundles, [job["row"]]))
+        # paths to data files mean nothing to the workers on other hosts, and may point anywhere
+        context = build_context(bundles, row, template_manifest.get_variables(tmpl_path), streams=False)
+
+        OUTPUT_PATH.mkdir(exist_ok=True, parents=True)
+        result_path = OUTPUT_PATH / f"{name.removeprefix('_')}_{job_id}.docx"
+        # the document appears whole, another worker with the same job may save it at the same time
+        partial = result_path.with_name(f".{result_path.stem}.{self.worker}.docx")
+        render_document(tmpl_path, context, partial)
+        os.replace(partial, result_path)
+
+        return result_path
+
+    def process(self, path: Path) -> bool:
+        """ Claim the job and render it, if no other worker has claimed it yet
+
+        Returns:
+            bool: whether the job was claimed
+        """
+        if (claimed := self._claim(path)) is None:
+            return False
+
+        claim, job = claimed
+        job_id = path.stem
+        error = None
+        if "template" not in job or "row" not in job:
+            error = job.get("error", "The job has no template or row")
+        elif job["attempts"] > self.max_attempts:
+            error = f"Gave up after {self.max_attempts} attempts: {job.get('error')}"
+
+        if error is not None:
+            job["error"] = error
+            logger.error(f"Job {job_id}: {error}")
+            self._finish(claim, job, "failed")
+            return True
+
+        try:
+            with span("job", job=job_id):
+                job["output"] = str(self._render(job_id, job))
+        except KeyboardInterrupt:
+            # an interrupted job is queued again at once and does not count as an attempt
+            job["attempts"] -= 1
+            self._finish(claim, job, "incoming")
+            raise
+        except Exception as e:
+            job["error"] = f"{type(e).__name__}: {e}"
+            # invalid jobs and data fail the same way every time
+            retry = job["attempts"] < self.max_attempts and not isinstance(e, (ValueError, LookupError, FileNotFoundError))
+            logger.error(f"Job {job_id}: {job['error']}{', retrying' if retry else ''}")
+            self._finish(claim, job, "incoming" if retry else "failed")
+            return True
+
+        job.pop("error", None)
+        logger.info(f"Job {job_id}: {job['output']}")
+        self._finish(claim, job, "done")
+        return True
+
+    def work(
+        self,
+        stop: threading.Event | None = None,
+        drain: bool = False,
+        poll_interval: float = QUEUE_POLL_INTERVAL
+    ) -> int:
+        """ Work off the jobs until stopped, or until the queue is empty with drain
+
+        Returns:
+            int: number of the jobs processed by this worker
+        """
+        stop = stop or threading.Event()
+        processed = 0
+        logger.info(f"Worker {self.worker} is working off {self.path}")
+        while not stop.is_set():
+            self.recover()
+
+            claimed = False
+            for path in sorted((self.path / "incoming").glob("*.json")):
+                if stop.is_set():
+                    break
+                if self.process(path):
+                    claimed = True
+                    processed += 1
+
+            if not claimed:
+                if drain:
+                    break
+                stop.wait(poll_interval)
+
+        return processed
+
+
+def _run_worker(path: Path, drain: bool) -> int:
+    try:
+        return SpoolQueue(path).work(drain=drain)
+    except KeyboardInterrupt:
+        return 0
+
+
+def run_workers(path: Path = SPOOL_PATH, workers: int = 1, drain: bool = False):
+    """ Work off the spool with several worker processes, each one claims jobs on its own """
+    if workers == 1:
+        _run_worker(path, drain)
+        return
+
+    processes = [multiprocessing.Process(target=_run_worker, args=(path, drain)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # the workers got the interrupt too, a claimed job is queued again once its lease expires
+        for process in processes:
+            process.join()
@@ -0,0 +1,359 @@
+import hashlib
+import io
+import marshal
+import os
+import re
+import sys
+import threading
+import uuid
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from types import CodeType
+from typing import Any
+
+import jinja2
+from docx.oxml.ns import qn, nsmap
+from docx.oxml.parser import element_class_lookup
+from docxtpl import DocxTemplate
+from jinja2 import Environment, Template
+from loguru import logger
+from lxml import etree
+
+from core.config import CACHE_PATH, TEMPLATES_DISK_CACHE
+
+BODY_PART = "body"
+# version of the on-disk cache format, bumped when the stored data changes
+CACHE_FORMAT = 2
+
+ROW_LOOP_RE = re.compile(r"\{%(-?)\s*for\s+(\w+)\s+in\s+(\w+)\s*(-?)%\}")
+ENDFOR_RE = re.compile(r"\{%(-?)\s*endfor\s*(-?)%\}")
+ROW_VALUE_RE = re.compile(r"\{\{\s*(\w+)\.(\w+)\s*\}\}")
+# text with the characters resolve_listing turns into tabs, breaks and new paragraphs
+NS_DECLARATION_RE = re.compile(r' xmlns:\w+="[^"]*"')
+LISTING_RE = re.compile(r"<w:t(?: [^>]*)?>[^<]*[\t\a\n\f]")
+
+# text before each printed attribute of the loop item, the last one has no attribute
+type RowSegments = list[tuple[str, str | None]]
+
+
+@dataclass
+class PreparedTemplate:
+    """ A template .docx with its jinja code already extracted, patched and compiled
+
+    Attributes:
+        digest: sha256 of the .docx content
+        source: the .docx content
+        parts: compiled jinja template and encoding of the body and of every header/footer part
+        document: document xml before and after the body, filled on first render
+    """
+    digest: str
+    source: bytes
+    parts: dict[str, tuple[Template, str]]
+    document: tuple[str, str] | None = None
+
+
+def _parse_row_body(body: str, item_name: str) -> RowSegments | None:
+    """ Split a loop body that only prints attributes of the loop item, None for any other body """
+    segments = []
+    pos = 0
+    for match in ROW_VALUE_RE.finditer(body):
+        if match.group(1) != item_name:
+            return None
+        segments.append((body[pos:match.start()], match.group(2)))
+        pos = match.end()
+    segments.append((body[pos:], None))
+
+    if any(tag in text for text, _ in segments for tag in ("{{", "}}", "{%", "%}", "{#")):
+        return None
+
+    return segments
+
+
+def extract_row_loops(xml: str) -> tuple[str, list[RowSegments]]:
+    """ Replace simple for loops of the jinja source with calls of the row renderer
+
+    A loop is replaced if its body only prints attributes of the loop item, like rows of
+    ``{%tr for %}`` or ``{%p for %}`` loops usually do. Such bodies are cloned per item by
+    ``render_rows`` instead of being run by jinja.
+
+    Returns:
+        tuple: the new source and segments of every replaced loop body, by call number
+    """
+    bodies = []
+    result = []
+    pos = 0
+    while match := ROW_LOOP_RE.search(xml, pos):
+        end = ENDFOR_RE.search(xml, match.end())
+        if not end:
+            break
+
+        strip_before, item_name, iter_name, strip_body_start = match.groups()
+        strip_body_end, strip_after = end.groups()
+        segments = _parse_row_body(xml[match.end():end.start()], item_name)
+        if segments is None or strip_body_start or strip_body_end:
+            result.append(xml[pos:end.end()])
+            pos = end.end()
+            continue
+
+        result.append(xml[pos:match.start()])
+        result.append(f"{{{{{strip_before} _docx_rows({len(bodies)}, {iter_name}) {strip_after}}}}}")
+        bodies.append(segments)
+        pos = end.end()
+
+    result.append(xml[pos:])
+    return "".join(result), bodies
+
+
+def _tables_need_fixing(tree: etree.ElementBase) -> bool:
+    """ Whether DocxTemplate.fix_tables would change the grid of any table """
+    for tbl in tree.iter(qn("w:tbl")):
+        columns = len(tbl.findall(f"{qn('w:tblGrid')}/{qn('w:gridCol')}"))
+        max_span = 0
+        for tr in tbl.iter(qn("w:tr")):
+            cells = tr.findall(qn("w:tc"))
+            if len(cells) > columns:
+                return True
+
+            span = 0
+            for tc in cells:
+                grid_span = tc.find(f"{qn('w:tcPr')}/{qn('w:gridSpan')}")
+                span += 1 if grid_span is None else int(grid_span.get(qn("w:val")))
+            max_span = max(max_span, span)
+
+        if max_span < columns:
+            return True
+
+    return False
+
+
+def render_rows(env: Environment, bodies: list[RowSegments], index: int, items: Any) -> str:
+    """ Render the replaced loop body for every item, producing the same text as the jinja loop """
+    getattr_ = env.getattr
+    parts = []
+    append = parts.append
+
+    for item in items:
+        for text, attr in bodies[index]:
+            append(text)
+            if attr is not None:
+                append(str(getattr_(item, attr)))
+
+    return "".join(parts)
+
+
+class CachedDocxTemplate(DocxTemplate):
+    """ DocxTemplate that renders the precompiled parts of a PreparedTemplate
+
+    Only the .docx package is loaded per instance, the xml patching and jinja
+    compilation of the body, headers and footers are taken from the cache.
+    Custom ``jinja_env`` is not supported since the code is compiled beforehand.
+    """
+    def __init__(self, prepared: PreparedTemplate):
+        super().__init__(io.BytesIO(prepared.source))
+        self.prepared = prepared
+
+    def _render_prepared(self, key: str, part, context) -> str:
+        template, _ = self.prepared.parts[key]
+        self.current_rendering_part = part
+
+        dst_xml = template.render(context)
+        dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+        dst_xml = (
+            dst_xml.replace("{_{", "{{")
+            .replace("}_}", "}}")
+            .replace("{_%", "{%")
+            .replace("%_}", "%}")
+        )
+        # resolve_listing runs several regexes per run, it is skipped when it would not change anything
+        return self.resolve_listing(dst_xml) if LISTING_RE.search(dst_xml) else dst_xml
+
+    def build_xml(self, context, jinja_env=None):
+        return self._render_prepared(BODY_PART, self.docx._part, context)
+
+    def fix_tables(self, xml):
+        # the body is parsed as a part of the whole document, since moving a large parsed body
+        # into the loaded document in map_tree costs more than the parsing itself
+        if self.prepared.document is None:
+            document = etree.tostring(self.docx._element, encoding="unicode")
+            self.prepared.document = (
+                document[:document.index("<w:body")],
+                document[document.rindex("</w:body>") + len("</w:body>"):]
+            )
+
+        head, tail = self.prepared.document
+        # the namespaces of the serialized body are declared by the document already
+        body_start = xml.index(">") + 1
+        if not all(decl in head for decl in NS_DECLARATION_RE.findall(xml, 0, body_start)):
+            return super().fix_tables(xml)
+
+        parser = etree.XMLParser(recover=True)
+        parser.set_element_class_lookup(element_class_lookup)
+        tree = etree.fromstring(head + NS_DECLARATION_RE.sub("", xml[:body_start]) + xml[body_start:] + tail, parser)
+
+        if _tables_need_fixing(tree):
+            return super().fix_tables(xml)
+
+        return tree
+
+    def fix_docpr_ids(self, tree):
+        # xpath of the oxml elements takes no namespaces
+        for elt in etree.ElementBase.xpath(tree, "//wp:docPr", namespaces=nsmap):
+            self.docx_ids_index += 1
+            elt.attrib["id"] = str(self.docx_ids_index)
+
+    def map_tree(self, tree):
+        if tree.tag != qn("w:document"):
+            return super().map_tree(tree)
+
+        self.docx._element = self.docx._part._element = tree
+        self.docx._Document__body = None
+
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        for relKey, part in self.get_headers_footers(uri):
+            key = str(part.partname)
+            yield relKey, self._render_prepared(key, part, context).encode(self.prepared.parts[key][1])
+
+    def render_content(self, context: dict[str, Any]):
+        """ Render the body, the headers and the footers into the loaded package
+
+        Unlike ``render``, the package is not loaded again, so the document can be rendered
+        with one context after another. Document properties and footnotes are not rendered.
+        """
+        self.init_docx(reload=False)
+        self.pic_map = {}
+        self.current_rendering_part = None
+        self.docx_ids_index = 1000
+
+        tree = self.fix_tables(self.build_xml(context))
+        self.fix_docpr_ids(tree)
+        self.map_tree(tree)
+
+        for uri in (self.HEADER_URI, self.FOOTER_URI):
+            for relKey, xml in list(self.build_headers_footers_xml(context, uri)):
+                self.map_headers_footers_xml(relKey, xml)
+
+
+def extract_parts(source: bytes) -> dict[str, tuple[str, str]]:
+    """ Get the patched jinja source and encoding of the body and of every header/footer part """
+    tpl = DocxTemplate(io.BytesIO(source))
+    tpl.init_docx()
+
+    parts = {BODY_PART: (tpl.patch_xml(tpl.get_xml()), "utf-8")}
+    for uri in (tpl.HEADER_URI, tpl.FOOTER_URI):
+        for _, part in tpl.get_headers_footers(uri):
+            xml = tpl.get_part_xml(part)
+            parts[str(part.partname)] = (tpl.patch_xml(xml), tpl.get_headers_footers_encoding(xml))
+
+    return parts
+
+
+class TemplateCache:
+    """ Cache of prepared templates
+
+    Templates are looked up by path and re-read only when the file's mtime or size changes,
+    prepared data is keyed by the content hash. Compiled code is optionally stored on disk
+    so that new processes can skip the preparation too. Templates are prepared under a lock,
+    since the sessions of the daemon and its template watcher share the cache.
+
+    Attributes:
+        disk_path: directory for the on-disk cache, None to keep the cache in memory only
+    """
+    def __init__(self, disk_path: Path | None = None):
+        self.disk_path = disk_path
+        self.env = Environment()
+        self._by_digest: dict[str, PreparedTemplate] = {}
+        self._by_path: dict[Path, tuple[tuple[int, int], PreparedTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def _disk_file(self, digest: str) -> Path:
+        return self.disk_path / (
+            f"{digest}.{sys.implementation.cache_tag}-jinja{jinja2.__version__}-{CACHE_FORMAT}.bin"
+        )
+
+    def _load_code(self, digest: str) -> dict[str, tuple[CodeType, str, list[RowSegments]]] | None:
+        if not self.disk_path:
+            return None
+
+        try:
+            with open(self._disk_file(digest), "rb") as fp:
+                return marshal.load(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            logger.warning(f"Broken template cache file for {digest}: {e}")
+            return None
+
+    def _store_code(self, digest: str, code: dict[str, tuple[CodeType, str, list[RowSegments]]]):
+        if not self.disk_path:
+            return
+
+        path = self._disk_file(digest)
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            self.disk_path.mkdir(exist_ok=True, parents=True)
+            with open(tmp_path, "wb") as fp:
+                marshal.dump(code, fp)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write template cache file {path}: {e}")
+
+    def _compile(self, source: bytes) -> dict[str, tuple[CodeType, str, list[RowSegments]]]:
+        code = {}
+        for key, (xml, encoding) in extract_parts(source).items():
+            xml, bodies = extract_row_loops(re.sub(r"<w:p([ >])", r"\n<w:p\1", xml))
+            code[key] = (self.env.compile(xml), encoding, bodies)
+
+        return code
+
+    def _prepare(self, source: bytes) -> PreparedTemplate:
+        digest = hashlib.sha256(source).hexdigest()
+        if prepared := self._by_digest.get(digest):
+            return prepared
+
+        code = self._load_code(digest)
+        if code is None:
+            code = self._compile(source)
+            self._store_code(digest, code)
+
+        parts = {}
+        for key, (part_code, encoding, bodies) in code.items():
+            globals_ = self.env.make_globals(dict(_docx_rows=partial(render_rows, self.env, bodies)))
+            parts[key] = (self.env.template_class.from_code(self.env, part_code, globals_), encoding)
+
+        prepared = PreparedTemplate(digest=digest, source=source, parts=parts)
+        self._by_digest[digest] = prepared
+
+        return prepared
+
+    def get_prepared(self, tmpl_path: Path) -> PreparedTemplate:
+        stat = os.stat(tmpl_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._by_path.get(tmpl_path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._by_path.get(tmpl_path)
+            if not cached or cached[0] != version:
+                replaced = cached[1] if cached else None
+                cached = (version, self._prepare(Path(tmpl_path).read_bytes()))
+                self._by_path[tmpl_path] = cached
+                # an edited template is not rendered in its old version again, unless another path has the same content
+                if replaced and replaced is not cached[1] and all(p is not replaced for _, p in self._by_path.values()):
+                    del self._by_digest[replaced.digest]
+
+        return cached[1]
+
+    def get(self, tmpl_path: Path) -> CachedDocxTemplate:
+        """ Get a fresh, ready to render document for the template .docx """
+        return CachedDocxTemplate(self.get_prepared(tmpl_path))
+
+    def clear(self):
+        with self._lock:
+            self._by_digest.clear()
+            self._by_path.clear()
+
+
+template_cache = TemplateCache(CACHE_PATH / "templates" if TEMPLATES_DISK_CACHE else None)
@@ -0,0 +1,132 @@
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from types import CodeType
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from core import common_bundles, features, common_fields
+from core.common_bundles.base import BaseBundle
+from core.config import TEMPLATES_PATH, BUNDLES_FILENAME, FROZEN
+from core.tracing import span
+from core.validation import precompile_validators
+
+
+def list_templates() -> list[str]:
+    """ Names of the template directories, test templates are hidden in the frozen build """
+    return [item for item in os.listdir(TEMPLATES_PATH) if not FROZEN or not item.startswith("_")]
+
+
+def get_template_path(template_dir_path) -> Path:
+    tmpl_path = TEMPLATES_PATH / template_dir_path
+    templates = [
+        filename
+        for filename in os.listdir(tmpl_path)
+        if filename.endswith(".docx") and not filename.startswith("~$")
+    ]
+
+    error_msg = None
+    if len(templates) > 1:
+        error_msg = "Multiple templates in one directory are not allowed"
+    elif len(templates) < 1:
+        error_msg = "No template was found in the chosen directory."
+
+    if error_msg:
+        logger.critical(error_msg)
+        raise ValueError(error_msg)
+
+    return tmpl_path / templates[0]
+
+
+def _exec_bundles(tmpl_path: Path, code: CodeType) -> list[type[BaseModel]]:
+    env = {
+        "features": features,
+        "common_bundles": common_bundles,
+        "common_fields": common_fields,
+        "BaseBundle": BaseBundle,
+        "Field": Field,
+        "tmpl_path": tmpl_path,
+    }
+
+    try:
+        exec(code, env)  # it will execute the code and put all the new variables in the env dict
+    except Exception as e:
+        logger.critical(f"Unprocessable bundles file for template {tmpl_path}")
+        raise ValueError(f"Something went wrong in the bundles.py for template in {tmpl_path}") from e
+
+    bundles: list[type[BaseModel]] | None = env.get("bundles", None)
+    if not bundles:
+        raise ValueError("Template does not have bundles list variable.")
+
+    return bundles
+
+
+@dataclass
+class _BundlesEntry:
+    version: tuple[int, int]
+    code: CodeType
+    bundles: list[type[BaseModel]]
+
+
+class BundleRegistry:
+    """ Compiled bundles.py code and the resulting bundle classes of every template
+
+    A template's bundles.py is compiled and executed once, and again only after
+    the file's mtime or size changes. Field validators of the bundles are built on load.
+    """
+    def __init__(self):
+        self._entries: dict[Path, _BundlesEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tmpl_path: Path) -> list[type[BaseModel]]:
+        """ Get bundles of the template in the tmpl_path directory """
+        bundles_path = tmpl_path / BUNDLES_FILENAME
+        stat = os.stat(bundles_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(tmpl_path)
+        if entry and entry.version == version:
+            return list(entry.bundles)
+
+        with self._lock:
+            entry = self._entries.get(tmpl_path)
+            if not entry or entry.version != version:
+                with open(bundles_path, "r", encoding="utf-8") as fp:
+                    source = fp.read()
+                try:
+                    code = compile(source, bundles_path, "exec")
+                except SyntaxError as e:
+                    logger.critical(f"Unprocessable bundles file for template {tmpl_path}")
+                    raise ValueError(f"Something went wrong in the bundles.py for template in {tmpl_path}") from e
+
+                bundles = _exec_bundles(tmpl_path, code)
+                for bundle in bundles:
+                    precompile_validators(bundle)
+
+                entry = _BundlesEntry(version, code, bundles)
+                self._entries[tmpl_path] = entry
+                logger.debug(f"Loaded bundles for template {tmpl_path}")
+
+        return list(entry.bundles)
+
+    def get_by_name(self, tmpl_name: str) -> list[type[BaseModel]]:
+        """ Get bundles of the template by its directory name """
+        return self.get(TEMPLATES_PATH / tmpl_name)
+
+    def invalidate(self, tmpl_path: Path | None = None):
+        """ Drop cached bundles of one template or of all of them """
+        with self._lock:
+            if tmpl_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(tmpl_path, None)
+
+
+bundle_registry = BundleRegistry()
+
+
+def get_tmpl_bundles(tmpl_path: Path) -> list[type[BaseModel]]:
+    with span("load_bundles", template=tmpl_path.name):
+        return bundle_registry.get(tmpl_path)
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import tracemalloc
+from contextlib import nullcontext
+from pathlib import Path
+from time import perf_counter, process_time, time
+from typing import Any, TextIO
+
+from loguru import logger
+
+from core.config import TRACE, TRACE_MEMORY, TRACE_ENV, TRACE_MEMORY_ENV
+
+# returned by span() while tracing is off, so a disabled span costs one call and one check
+_NULL_SPAN = nullcontext()
+
+
+class Span:
+    """ Measures wall time, CPU time and optionally the tracemalloc peak of a block
+
+    Attributes:
+        name: name of the stage
+        attrs: extra data of the record, like the template or the field name
+    """
+    __slots__ = ("tracer", "name", "attrs", "depth", "started", "wall", "cpu", "memory", "child_peak")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self) -> "Span":
+        stack = self.tracer.stack()
+        self.depth = len(stack)
+        stack.append(self)
+
+        if self.tracer.memory:
+            self.memory = tracemalloc.get_traced_memory()[0]
+            self.child_peak = 0
+            tracemalloc.reset_peak()
+
+        self.started = time()
+        self.wall, self.cpu = perf_counter(), process_time()
+        return self
+
+    def __exit__(self, *_):
+        wall = perf_counter() - self.wall
+        cpu = process_time() - self.cpu
+
+        stack = self.tracer.stack()
+        stack.pop()
+
+        peak = None
+        if self.tracer.memory:
+            # nested spans reset the peak, so their peaks are passed up the stack
+            traced_peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            peak = traced_peak - self.memory
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, traced_peak)
+
+        self.tracer.emit(self, wall, cpu, peak)
+
+
+class Tracer:
+    """ Collects spans of the current process
+
+    Records are written as JSON lines to the target file, or logged with loguru
+    with the record bound to the ``span`` extra when the target is "log".
+
+    Attributes:
+        target: "log" or path of the JSON lines trace file
+        memory: whether to measure memory peaks with tracemalloc
+    """
+    def __init__(self, target: str, memory: bool = False):
+        self.target = target
+        self.memory = memory
+        self._local = threading.local()
+        self._file: TextIO | None = None
+        self._lock = threading.Lock()
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stack(self) -> list[Span]:
+        if (stack := getattr(self._local, "stack", None)) is None:
+            stack = self._local.stack = []
+
+        return stack
+
+    def emit(self, span: Span, wall: float, cpu: float, peak: int | None):
+        record = dict(
+            name=span.name,
+            start=round(span.started, 6),
+            wall_ms=round(wall * 1000, 3),
+            cpu_ms=round(cpu * 1000, 3),
+            peak_kib=round(peak / 1024, 1) if peak is not None else None,
+            depth=span.depth,
+            pid=os.getpid(),
+            **span.attrs
+        )
+
+        if self.target == "log":
+            logger.bind(span=record).debug(
+                f"{'  ' * span.depth}{span.name}: {record['wall_ms']:.3f}ms wall, {record['cpu_ms']:.3f}ms cpu"
+                + (f", {record['peak_kib']:.1f}KiB peak" if peak is not None else "")
+            )
+            return
+
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                Path(self.target).parent.mkdir(exist_ok=True, parents=True)
+                # appended line by line, so worker processes can share the file
+                self._file = open(self.target, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
+
+
+_tracer: Tracer | None = None
+
+
+def span(name: str, **attrs) -> Span | nullcontext:
+    """ Measure the block as a stage of the document pipeline, if tracing is on
+
+    Usage:
+        with span("render", template=tmpl_path.name):
+            ...
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+
+    return Span(_tracer, name, attrs)
+
+
+def enable_tracing(target: str = "log", memory: bool = False):
+    """ Turn tracing on for this process and for the worker processes started after it
+
+    Args:
+        target: "log" to log the spans, or path of the JSON lines trace file
+        memory: whether to measure memory peaks with tracemalloc
+    """
+    global _tracer
+
+    # worker processes read the settings from the environment on import
+    os.environ[TRACE_ENV] = str(target)
+    os.environ[TRACE_MEMORY_ENV] = "1" if memory else ""
+    _tracer = Tracer(str(target), memory)
+
+
+if TRACE:
+    enable_tracing(TRACE, TRACE_MEMORY)
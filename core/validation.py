@@ -0,0 +1,142 @@
+from types import NoneType
+from typing import Any, get_args
+from weakref import WeakKeyDictionary
+
+from pydantic import BaseModel, ValidationError
+from pydantic_core import SchemaValidator, core_schema
+
+from core.common_bundles.base import BaseBundle
+from core.tracing import span
+
+_field_validators: WeakKeyDictionary[type[BaseModel], dict[str, SchemaValidator]] = WeakKeyDictionary()
+_column_validators: WeakKeyDictionary[type[BaseModel], dict[str, SchemaValidator]] = WeakKeyDictionary()
+# required fields that accept None and the nested bundles of every model
+_nullable_fields: WeakKeyDictionary[type[BaseModel], tuple[tuple[str, ...], dict[str, type[BaseModel]]]] = (
+    WeakKeyDictionary()
+)
+
+
+def _is_bundle(annotation) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseBundle)
+
+
+def _fields_schema(model: type[BaseModel]) -> dict[str, Any]:
+    schema = model.__pydantic_core_schema__
+    # model validators wrap the fields schema, like the ones of external bundles
+    while "fields" not in schema:
+        schema = schema["schema"]
+
+    return schema["fields"]
+
+
+def precompile_validators(model: type[BaseModel]) -> dict[str, SchemaValidator]:
+    """ Build validators of every field of the model and of its nested bundles
+
+    Returns:
+        dict: validator of each field of the model by field name
+    """
+    if (validators := _field_validators.get(model)) is not None:
+        return validators
+
+    fields_schema = _fields_schema(model)
+    validators = {}
+    for name, info in model.model_fields.items():
+        if _is_bundle(info.annotation):
+            precompile_validators(info.annotation)
+
+        # noinspection PyTypeChecker
+        validators[name] = SchemaValidator(fields_schema[name]["schema"])
+
+    _field_validators[model] = validators
+    return validators
+
+
+def precompile_column_validators(model: type[BaseModel]) -> dict[str, SchemaValidator]:
+    """ Build validators of every field of the model that take a list of values, a column of a dataset
+
+    A column is validated in one call, with the patterns of the field compiled once.
+
+    Returns:
+        dict: validator of each field of the model by field name
+    """
+    if (validators := _column_validators.get(model)) is not None:
+        return validators
+
+    fields_schema = _fields_schema(model)
+    validators = {
+        # noinspection PyTypeChecker
+        name: SchemaValidator(core_schema.list_schema(fields_schema[name]["schema"]))
+        for name in model.model_fields
+    }
+
+    _column_validators[model] = validators
+    return validators
+
+
+def get_nullable_fields(model: type[BaseModel]) -> tuple[tuple[str, ...], dict[str, type[BaseModel]]]:
+    """ Required fields of the model that accept None, and the nested bundles by field name """
+    if (entry := _nullable_fields.get(model)) is not None:
+        return entry
+
+    nullable = tuple(
+        name for name, info in model.model_fields.items()
+        if info.is_required() and NoneType in get_args(info.annotation)
+    )
+    nested = {name: info.annotation for name, info in model.model_fields.items() if _is_bundle(info.annotation)}
+    _nullable_fields[model] = entry = nullable, nested
+
+    return entry
+
+
+def fill_nullable(model: type[BaseModel], data: dict[str, Any]) -> dict[str, Any]:
+    """ Set the required fields that accept None to None when the data leaves them out, in nested bundles too
+
+    The interactive session does not require them and takes an empty answer as None,
+    so rows without them, like the ones with empty CSV cells, are valid as well.
+
+    Returns:
+        dict: the data with the fields of the model only
+    """
+    nullable, nested = get_nullable_fields(model)
+    data = {name: data[name] for name in model.model_fields if name in data}
+    for name in nullable:
+        data.setdefault(name, None)
+    for name, bundle in nested.items():
+        if isinstance(value := data.get(name), dict):
+            data[name] = fill_nullable(bundle, value)
+
+    return data
+
+
+def get_field_validator(model: type[BaseModel], field_name: str) -> SchemaValidator:
+    return precompile_validators(model)[field_name]
+
+
+def validate_field[T](
+    model: type[BaseModel],
+    field_name: str,
+    value: T
+) -> tuple[T | str, bool]:
+    try:
+        with span("validate_field", bundle=model.__name__, field=field_name):
+            value = get_field_validator(model, field_name).validate_python(value)
+    except ValidationError as e:
+        return e, False
+    else:
+        return value, True
+
+
+def validate_bundle[T: BaseModel](bundle: type[T], data: dict[str, Any]) -> T:
+    """ Validate all fields of a bundle from a complete dict in one call
+
+    Keys that are not fields of the bundle are ignored, missing fields that accept None are None, see fill_nullable.
+
+    Raises:
+        ValidationError: if the data does not fit the bundle
+        ValueError: if the data is not a dict
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"Data of {bundle.__name__} must be an object, got {type(data).__name__}")
+
+    with span("validate", bundle=bundle.__name__):
+        return bundle.model_validate(fill_nullable(bundle, data))
@@ -0,0 +1,87 @@
+import os
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+from loguru import logger
+
+type Snapshot = dict[Path, tuple[int, int]]
+
+
+class FileWatcher:
+    """ Polls the files of a directory tree and reports the ones that changed
+
+    Polling needs no extra dependencies and works the same on every platform,
+    a template directory has few files, so a scan takes well under a millisecond.
+
+    Attributes:
+        root: directory to watch
+        suffixes: suffixes of the watched files
+        interval: seconds between the scans
+        files: files watched besides the ones in the root
+    """
+    def __init__(
+        self,
+        root: Path,
+        suffixes: tuple[str, ...] = (".docx", ".py"),
+        interval: float = 1.0,
+        files: tuple[Path, ...] = ()
+    ):
+        self.root = root
+        self.suffixes = suffixes
+        self.interval = interval
+        self.files = files
+        self._snapshot = self.snapshot()
+
+    @staticmethod
+    def _stat(path: Path) -> tuple[int, int] | None:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def snapshot(self) -> Snapshot:
+        result = {path: version for path in self.files if (version := self._stat(path)) is not None}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if name != "__pycache__"]
+            for name in filenames:
+                # Word keeps its lock files like ~$name.docx next to an open document
+                if not name.endswith(self.suffixes) or name.startswith("~$"):
+                    continue
+
+                path = Path(dirpath) / name
+                if (version := self._stat(path)) is not None:
+                    result[path] = version
+
+        return result
+
+    def changes(self) -> set[Path]:
+        """ Files added, removed or modified since the previous call """
+        old, new = self._snapshot, self.snapshot()
+        self._snapshot = new
+
+        return {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
+    def watch(self, callback: Callable[[set[Path]], None], stop: threading.Event):
+        """ Call the callback with the changed files until the stop event is set """
+        while not stop.wait(self.interval):
+            if not (changed := self.changes()):
+                continue
+
+            try:
+                callback(changed)
+            except Exception as e:
+                logger.exception(f"Could not process changes of {', '.join(map(str, changed))}: {e}")
+
+    def start(self, callback: Callable[[set[Path]], None]) -> threading.Event:
+        """ Watch in a daemon thread
+
+        Returns:
+            threading.Event: set it to stop watching
+        """
+        stop = threading.Event()
+        threading.Thread(target=self.watch, args=(callback, stop), daemon=True, name="file-watcher").start()
+
+        return stop
@@ -1,23 +1,30 @@
+from __future__ import annotations
+
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
 import asyncio
-import os
-from datetime import datetime
+import json
+import multiprocessing
+import sys
+import threading
 from pathlib import Path
-from types import NoneType, new_class, UnionType
-from typing import get_args, get_origin
+from types import NoneType, UnionType
+from typing import get_args, get_origin, TYPE_CHECKING
 
-from aiohttp import ClientConnectionError
-from docx.document import Document
-from docxtpl import DocxTemplate
-from gh_auto_updater import update
 from loguru import logger
-from polyfactory.factories.pydantic_factory import ModelFactory
-from pydantic import BaseModel, ValidationError, Field
-from pydantic_core import PydanticUndefined, SchemaValidator
 
-from core import common_bundles, features, common_fields
-from core.common_bundles import BgResidentBundle
-from core.common_bundles.base import BaseBundle
-from core.config import TEMPLATES_PATH, OUTPUT_PATH, BUNDLES_FILENAME, FROZEN, AUTO_FILL
+from core.config import (
+    OUTPUT_PATH, FROZEN, AUTO_FILL, LAZY_CONTEXT, CLIENT_STORE, DAEMON_SOCKET, PREVALIDATE, SPOOL_PATH
+)
+
+# heavy packages are imported where they are needed, so the menu shows up without waiting for them
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+    from core.batch import RepeatableStream
 
 
 LAST_CHECK_DATE_PATH = ".ghlastupdate"
@@ -27,102 +34,59 @@ if FROZEN:
 __version__ = "2.0.1"
 
 
-def validate_field[T](
-    model: type[BaseModel],
-    field_name: str,
-    value: T
-) -> tuple[T | str, bool]:
-    try:
-        # noinspection PyTypeChecker
-        field_validator = SchemaValidator(model.__pydantic_core_schema__["schema"]["fields"][field_name]["schema"])
-        value = field_validator.validate_python(value)
-    except ValidationError as e:
-        return e, False
-    else:
-        return value, True
-
-
-def get_template_path(template_dir_path) -> Path:
-    tmpl_path = TEMPLATES_PATH / template_dir_path
-    templates = [
-        filename
-        for filename in os.listdir(tmpl_path)
-        if filename.endswith(".docx") and not filename.startswith("~$")
-    ]
-
-    error_msg = None
-    if len(templates) > 1:
-        error_msg = "Multiple templates in one directory are not allowed"
-    elif len(templates) < 1:
-        error_msg = "No template was found in the chosen directory."
-
-    if error_msg:
-        logger.critical(error_msg)
-        raise ValueError(error_msg)
-
-    return tmpl_path / templates[0]
-
-
-def user_select_tmpl() -> Path:
+def user_select_tmpls() -> list[Path]:
     """
 
     Returns:
-        str: A pathlib.Path to the template chosen by user
+        list: pathlib.Paths to the templates chosen by user
     """
-    template_dirs = [item for item in os.listdir(TEMPLATES_PATH) if not FROZEN or not item.startswith("_")]
-    error_msg = f"Введеное значение должно быть числом от 1 до {len(template_dirs)}"
+    from core.manifest import template_manifest
+
+    template_manifest.refresh()
+    template_dirs = template_manifest.names()
+    error_msg = f"Введите номера шаблонов от 1 до {len(template_dirs)} через запятую или пробел"
 
     for i, tmpl in enumerate(template_dirs):
         print(f"{i + 1}. {tmpl}")
 
-    tmpl_i = -1
-    while tmpl_i == -1:
-        user_in = input("-> Выберите шаблон: ")
-        if not user_in.isdigit():
+    selected = []
+    while not selected:
+        user_in = input("-> Выберите шаблон (или несколько, напр. 1,3): ").replace(",", " ").split()
+        if not user_in or not all(part.isdigit() for part in user_in):
             print(error_msg)
             continue
 
-        user_in = int(user_in) - 1
-
-        if user_in < 0 or user_in >= len(template_dirs):
+        indexes = list(dict.fromkeys(int(part) - 1 for part in user_in))
+        if any(i < 0 or i >= len(template_dirs) for i in indexes):
             print(error_msg)
             continue
 
-        tmpl_i = user_in
-
-    return get_template_path(template_dirs[tmpl_i])
-
-
-def get_tmpl_bundles(tmpl_path: Path) -> list[type[BaseModel]]:
-    env = {
-        "features": features,
-        "common_bundles": common_bundles,
-        "common_fields": common_fields,
-        "BaseBundle": BaseBundle,
-        "Field": Field,
-        **locals()
-    }
-
-    with open(tmpl_path / BUNDLES_FILENAME, "r", encoding="utf-8") as fp:
-        code = fp.read()
+        entries = [template_manifest.get(template_dirs[i]) for i in indexes]
+        if broken := [entry for entry in entries if entry.error]:
+            for entry in broken:
+                print(f"Шаблон {entry.name} не может быть использован: {entry.error}")
+            continue
 
-    try:
-        exec(code, env)  # it will execute the code and put all the new variables in the env dict
-    except Exception as e:
-        logger.critical(f"Unprocessable bundles file for template {tmpl_path}")
-        raise ValueError(f"Something went wrong in the bundles.py for template in {tmpl_path}") from e
+        selected = [entry.path for entry in entries]
 
-    bundles: list[type[BaseModel]] | None = env.get("bundles", None)
-    if not bundles:
-        raise ValueError("Template does not have bundles list variable.")
+    return selected
 
-    return bundles
 
+def user_select_repeat_count(desc: str) -> int | Path:
+    """
 
-def user_select_repeat_count(desc: str) -> int:
+    Returns:
+        int | Path: count of instances to fill in, or path to a .jsonl/.csv file with them
+    """
     count = -1
     while count == -1:
-        user_in = input(f"Сколько раз ввести {desc}?: ")
+        user_in = input(f"Сколько раз ввести {desc}? (или путь к .jsonl/.csv файлу): ")
+        if user_in.endswith((".jsonl", ".csv")):
+            if not Path(user_in).is_file():
+                print("Файл не найден.\n")
+                continue
+            return Path(user_in)
+
         if not user_in.isdigit():
             print("Введите число.\n")
             continue
@@ -144,31 +108,69 @@ def user_select_repeat_count(desc: str) -> int:
     return count
 
 
-def _clean_docx(docx: Document):
-    for p in docx.paragraphs:
-        tab_stops = p.paragraph_format.tab_stops
+def user_select_client(bundle: type[BaseModel]) -> dict:
+    from core.client_store import client_store
+
+    if not client_store.exists():
+        return {}
+
+    desc = getattr(bundle, "bundle_desc", None) or bundle.__name__
+    prompt = f"Поиск сохраненного клиента для {desc} (ФИО, № паспорта или ЕГН, пусто - заполнить вручную): "
+    while query := input(prompt):
+        clients = client_store.search(query)
+        if not clients:
+            print("Клиент не найден.\n")
+            continue
+
+        for i, client in enumerate(clients, start=1):
+            name = " ".join(str(client.get(f_name, "")) for f_name in ("s_name", "f_name", "patronymic")).strip()
+            keys = ", ".join(str(client[key]) for key in ("passport_no", "egn") if client.get(key))
+            print(f"{i}. {name or '-'}{f' ({keys})' if keys else ''}")
 
-        for i in range(len(tab_stops)):
-            del tab_stops[i]
+        choice = input("Номер клиента (пусто - искать снова): ")
+        if choice.isdigit() and 1 <= int(choice) <= len(clients):
+            return clients[int(choice) - 1]
+
+    return {}
 
 
 def _fill_bundle[T: BaseModel](bundle: type[T]) -> T:
+    from pydantic_core import PydanticUndefined
+
+    from core.client_store import client_store, is_storable
+    from core.common_bundles.base import BaseBundle
+    from core.features.external import ExternalBundle
+    from core.validation import validate_field
+
     result = {}
+    # values of a stored client or of the external source, looked up once the key field is filled
+    found = {}
 
     if AUTO_FILL:
-        factory = new_class(
-            bundle.__name__ + "Factory",
-            (ModelFactory[bundle],),
-            {}
-        )
-        # noinspection PyUnresolvedReferences
-        return factory.build()
+        from core.autofill import get_factory
+
+        return get_factory(bundle).build()
+
+    storable = CLIENT_STORE and is_storable(bundle)
+    if storable:
+        # fields of the stored client that are missing or no longer valid are asked for below
+        found = dict(user_select_client(bundle))
 
     fields = list(bundle.model_fields.items())
+    external = issubclass(bundle, ExternalBundle) and bundle.external_src is not None
+    if external:
+        fields.sort(key=lambda field: field[0] != bundle.external_key)
+
     while fields:
         f_name, info = fields.pop(0)
         annotation = info.annotation
 
+        if f_name in found:
+            value, success = validate_field(bundle, f_name, found.pop(f_name))
+            if success:
+                result.update({f_name: value})
+                continue
+
         if get_origin(annotation) != UnionType and issubclass(annotation, BaseBundle):
             result.update({f_name: _fill_bundle(info.annotation)})
             continue
@@ -191,52 +193,159 @@ def _fill_bundle[T: BaseModel](bundle: type[T]) -> T:
 
         result.update({f_name: value})
 
-    return bundle.model_construct(**result)
+        if external and f_name == bundle.external_key and value is not None:
+            try:
+                found = bundle.fetch_record(value) or {}
+            except Exception as e:
+                logger.warning(f"Could not look up {value} in {bundle.external_src!r}: {e}")
+                found = {}
+            if found:
+                print("Данные найдены во внешнем источнике, остальные поля заполнены из него.")
+
+    instance = bundle.model_construct(**result)
+    if storable:
+        client_store.save(instance)
+
+    return instance
+
+
+def fill_repeatable[T: BaseModel](bundle: type[T], repeat_count: int) -> list[T]:
+    return [_fill_bundle(bundle) for _ in range(repeat_count)]
 
 
-def fill_repeatable(bundle: type[BaseModel], repeat_count: int) -> dict[str, list[BaseModel]]:
-    result = []
-    for i in range(repeat_count):
-        result.append(_fill_bundle(bundle))
+def check_data_file(bundle: type[BaseModel], data_path: Path) -> str | None:
+    """ Check all the rows of a data file of a repeatable bundle before any of them is rendered
 
-    return {bundle.result_var_name: result}
+    Returns:
+        str | None: report of the invalid rows, None if all of them are valid
+    """
+    from core.batch import read_rows
+    from core.prevalidation import prevalidate_items, format_report
+
+    try:
+        errors = prevalidate_items(bundle, read_rows(data_path))
+    except ValueError as e:
+        return str(e)
+
+    return format_report(errors) if errors else None
 
 
-# noinspection PyTypeChecker
-def fill_bundle[T: BaseModel](bundle: type[T]) -> T | dict[str, T]:
-    result = None
+def fill_bundle[T: BaseModel](bundle: type[T]) -> T | list[T] | RepeatableStream:
+    from core.batch import RepeatableStream
+    from core.features.repeatable import RepeatableBundle
 
-    if issubclass(bundle, features.repeatable.RepeatableBundle):
+    if issubclass(bundle, RepeatableBundle):
         count = user_select_repeat_count(bundle.bundle_desc)
-        result = fill_repeatable(bundle, count)
+        while isinstance(count, Path) and (report := check_data_file(bundle, count)):
+            print(f"[!] Файл содержит ошибки, исправьте их и попробуйте снова:\n{report}\n")
+            count = user_select_repeat_count(bundle.bundle_desc)
 
-    return result or _fill_bundle(bundle).model_dump()
+        if isinstance(count, Path):
+            # large lists are validated while rendering, without keeping them in memory
+            return RepeatableStream.from_file(bundle, count)
+
+        return fill_repeatable(bundle, count)
+
+    return _fill_bundle(bundle)
 
 
 def process_template(tmpl_path: Path) -> Path:
-    result: dict[str, str | list[str]] = {}
+    from core.batch import output_stamp
+    from core.templates import get_tmpl_bundles
+    from core.features.n2w import n2w_batch
+
+    instances = []
     tmpl_path = tmpl_path.parent
     tmpl_name = tmpl_path.name.removeprefix("_")
-    result_path = OUTPUT_PATH / (tmpl_name + f"_{datetime.now().timestamp()}" + ".docx")
+    # sessions started at the same time, in other processes or on other hosts, save to other paths
+    result_path = OUTPUT_PATH / f"{tmpl_name}_{output_stamp()}.docx"
 
-    doc = DocxTemplate(tmpl_path / (tmpl_name + ".docx"))
     tmpl_bundles = get_tmpl_bundles(tmpl_path)
 
+    from core.manifest import template_manifest
+
+    entry = template_manifest.get(tmpl_path.name)
+    if entry.missing:
+        logger.warning(f"Template references values no bundle provides: {', '.join(entry.missing)}")
+
     print("[!] Поля, помеченные звездочкой, обязательны к заполнению.")
-    for bundle in tmpl_bundles:
-        result.update(fill_bundle(bundle))
+    # num2words fields are generated at once after filling, or only the printed ones with the lazy context
+    with n2w_batch(generate=not LAZY_CONTEXT):
+        for bundle in tmpl_bundles:
+            instances.append((bundle, fill_bundle(bundle)))
 
     OUTPUT_PATH.mkdir(exist_ok=True, parents=True)
 
-    doc.render(result)
-    # _clean_docx(doc.docx)
-    doc.save(result_path)
+    from core.batch import make_context
+    from core.render import render_document
+
+    context = make_context(instances, template_manifest.get_variables(entry.path))
+    if render_document(entry.path, context, result_path):
+        logger.info("The same document was rendered before, it is taken from the output cache")
 
     return result_path
 
 
-async def main():
-    logger.info(f"DocumentFormatter - {__version__}")
+def process_templates(tmpl_paths: list[Path]) -> list[Path]:
+    """ Fill the bundles of several templates in one session and render the documents concurrently
+
+    Bundles the templates share are filled and validated once, and their part of the context
+    is dumped once for all the templates.
+
+    Returns:
+        list: paths to the rendered documents
+    """
+    if len(tmpl_paths) == 1:
+        return [process_template(tmpl_paths[0])]
+
+    from core.templates import get_tmpl_bundles
+    from core.features.n2w import n2w_batch
+    from core.manifest import template_manifest
+
+    entries = [template_manifest.get(tmpl_path.parent.name) for tmpl_path in tmpl_paths]
+    tmpl_bundles = [get_tmpl_bundles(entry.path.parent) for entry in entries]
+    for entry in entries:
+        if entry.missing:
+            logger.warning(f"Template {entry.name} references values no bundle provides: {', '.join(entry.missing)}")
+
+    print("[!] Поля, помеченные звездочкой, обязательны к заполнению.")
+    # the contexts are sent to worker processes as plain data, so num2words fields are all generated
+    bundles = dict.fromkeys(bundle for bundles in tmpl_bundles for bundle in bundles)
+    with n2w_batch():
+        filled = {bundle: fill_bundle(bundle) for bundle in bundles}
+
+    from core.batch import dump_row, output_stamp, render_many
+
+    parts = {bundle: dump_row([(bundle, instance)]) for bundle, instance in filled.items()}
+    stamp = output_stamp()
+    jobs = []
+    for entry, bundles in zip(entries, tmpl_bundles):
+        context = {}
+        for bundle in bundles:
+            context.update(parts[bundle])
+
+        # values the template does not reference are not sent to the workers
+        if (variables := template_manifest.get_variables(entry.path)) is not None:
+            context = {name: value for name, value in context.items() if name in variables}
+
+        result_path = OUTPUT_PATH / f"{entry.name.removeprefix('_')}_{stamp}.docx"
+        jobs.append((entry.path, context, result_path))
+
+    result_paths = []
+    for res in render_many(jobs):
+        if res.ok:
+            logger.info(f"{entries[res.index - 1].name}: {res.path}{' (output cache)' if res.cached else ''}")
+            result_paths.append(res.path)
+        else:
+            logger.error(f"{entries[res.index - 1].name}: {res.error}")
+
+    return result_paths
+
+
+async def check_update():
+    from aiohttp import ClientConnectionError
+    from gh_auto_updater import update
+
     try:
         await update(
             repository_name="HexChap/DocumentFormatter",
@@ -248,11 +357,282 @@ async def main():
         )
     except ClientConnectionError:
         logger.info("No internet connection. Abort update")
+    except Exception as e:
+        logger.warning(f"Update check failed: {e}")
+
+
+def main(check_updates: bool = True, started: float = STARTED):
+    logger.info(f"DocumentFormatter - {__version__}")
+
+    # the update check runs while user selects the template and fills the fields
+    updater = threading.Thread(target=lambda: asyncio.run(check_update()), daemon=True)
+    if check_updates:
+        updater.start()
+
+    logger.info(f"Ready in {time.perf_counter() - started:.3f}s")
+    process_templates(user_select_tmpls())
+
+    if check_updates:
+        updater.join()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="DocumentFormatter")
+    parser.add_argument("--trace", action="store_true", help="Log the timing of every pipeline stage")
+    parser.add_argument("--trace-file", type=Path, default=None, help="Write the timing to this JSON lines file")
+    parser.add_argument("--trace-memory", action="store_true", help="Also trace memory peaks, it slows rendering down")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="Render a document for every row of a CSV/JSONL file")
+    batch.add_argument("template", help="Name of the template directory")
+    batch.add_argument("data", type=Path, help="Path to the .csv or .jsonl file with bundle data")
+    batch.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    batch.add_argument("--report", type=Path, default=None, help="Write per-row results to this .jsonl file")
+    output = batch.add_mutually_exclusive_group()
+    output.add_argument("--bundle", default=None, help="Stream the documents into this .zip file, '-' for stdout")
+    output.add_argument("--merge", type=Path, default=None, help="Render all the rows into this .docx file, a section per row")
+    batch.add_argument(
+        "--compression", type=int, choices=range(10), default=None, metavar="0-9",
+        help="Compression level of the documents, 0 stores them uncompressed"
+    )
+    batch.add_argument("--check", action="store_true", help="Only check all the rows, without rendering them")
+
+    generate = subparsers.add_parser("generate", help="Generate valid data for a template or load test rendering")
+    generate.add_argument("template", help="Name of the template directory")
+    generate.add_argument("-n", "--count", type=int, default=100, help="Number of rows/documents")
+    generate.add_argument("-o", "--output", type=Path, default=None, help="Write the rows to this .jsonl file")
+    generate.add_argument("--render", action="store_true", help="Render the generated rows instead of saving them")
+    generate.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    generate.add_argument("--seed", type=int, default=None, help="Seed for reproducible data")
+
+    serve = subparsers.add_parser("serve", help="Serve templates over a local HTTP API")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    serve.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    serve.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    serve.add_argument("--queue", type=int, default=32, help="Maximal number of requests waiting for a worker")
+
+    subparsers.add_parser("manifest", help="Index the templates and report the broken ones")
+
+    cache = subparsers.add_parser("cache", help="Show or clear the output cache")
+    cache.add_argument("--clear", action="store_true", help="Remove all the cached documents")
+
+    clients = subparsers.add_parser("clients", help="Search the saved clients")
+    clients.add_argument("query", nargs="?", default=None, help="Full name, passport number or EGN")
+
+    watch = subparsers.add_parser("watch", help="Render templates with sample data again on every change of them")
+    watch.add_argument("templates", nargs="*", help="Names of the template directories, all of them by default")
+    watch.add_argument("--sample", type=Path, default=None, help="JSON file with the sample data of the template")
+
+    queue = subparsers.add_parser("queue", help="Render jobs of a spool directory shared by the workers")
+    queue.add_argument("--spool", type=Path, default=SPOOL_PATH, help="Spool directory of the jobs")
+    actions = queue.add_subparsers(dest="action", required=True)
+    submit = actions.add_parser("submit", help="Queue a document for every row of a CSV/JSONL file")
+    submit.add_argument("template", help="Name of the template directory")
+    submit.add_argument("data", type=Path, help="Path to the .csv or .jsonl file with bundle data")
+    work = actions.add_parser("work", help="Render the queued jobs until interrupted")
+    work.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes")
+    work.add_argument("--drain", action="store_true", help="Stop once the queue is empty")
+    actions.add_parser("status", help="Count the jobs in each state")
+
+    daemon = subparsers.add_parser("daemon", help="Keep the templates warm for the thin client (client.py)")
+    daemon.add_argument("--socket", type=Path, default=DAEMON_SOCKET, help="Path to the Unix domain socket")
+
+    return parser.parse_args(argv)
+
+
+def batch_main(args: argparse.Namespace) -> int:
+    from core.batch import run_batch, run_merge
+    from core.templates import get_template_path
+
+    logger.info(f"DocumentFormatter - {__version__}")
+    if args.merge and not args.check:
+        results = run_merge(get_template_path(args.template), args.data, args.merge, args.report, args.compression)
+        return 0 if results and all(res.ok for res in results) else 1
+
+    results = run_batch(
+        get_template_path(args.template), args.data, args.workers, args.report, args.bundle, args.compression,
+        args.check
+    )
+
+    return 0 if all(res.ok for res in results) else 1
+
+
+def generate_main(args: argparse.Namespace) -> int:
+    from core.autofill import generate_rows, write_rows, run_load_test
+    from core.templates import get_template_path
+
+    tmpl_path = get_template_path(args.template)
+
+    if args.render:
+        return 0 if not run_load_test(tmpl_path, args.count, args.workers, args.seed) else 1
+
+    output = args.output or OUTPUT_PATH / f"{tmpl_path.parent.name}_data.jsonl"
+    OUTPUT_PATH.mkdir(exist_ok=True, parents=True)
+    count = write_rows(generate_rows(tmpl_path.parent, args.count, args.seed), output)
+    logger.info(f"Generated {count} rows into {output}")
+
+    return 0
+
+
+def serve_main(args: argparse.Namespace) -> int:
+    from core.service import serve
+
+    logger.info(f"DocumentFormatter - {__version__}")
+    serve(args.host, args.port, args.workers, args.queue)
+
+    return 0
+
+
+def manifest_main(_: argparse.Namespace) -> int:
+    from core.manifest import template_manifest
+
+    failed = 0
+    for name, entry in template_manifest.refresh().items():
+        if entry.error:
+            failed += 1
+            print(f"[ERROR] {name}: {entry.error}")
+            continue
+
+        if entry.missing:
+            failed += 1
+        print(f"[{'MISSING' if entry.missing else 'OK'}] {name}: {len(entry.variables)} variables, bundles: {', '.join(entry.bundles)}")
+        if entry.missing:
+            print(f"    missing: {', '.join(entry.missing)}")
+        if entry.unused:
+            print(f"    unused: {', '.join(entry.unused)}")
+
+    return 1 if failed else 0
+
+
+def cache_main(args: argparse.Namespace) -> int:
+    from core.output_cache import output_cache
+
+    if args.clear:
+        print(f"Removed {output_cache.clear()} documents from {output_cache.path}")
+        return 0
+
+    output_cache.evict()
+    count, size = output_cache.size()
+    print(f"{count} documents, {size / 1024 ** 2:.1f} MiB in {output_cache.path}")
+    print(f"Limits: {output_cache.max_size / 1024 ** 2:.0f} MiB, {output_cache.max_age / 3600:.0f} hours since last use")
+
+    return 0
+
 
-    tmpl_name = user_select_tmpl()
-    process_template(tmpl_name)
+def clients_main(args: argparse.Namespace) -> int:
+    from core.client_store import client_store
+
+    if not client_store.exists():
+        print(f"No clients are saved in {client_store.path}")
+        return 0
+
+    if args.query is None:
+        print(f"{client_store.count()} clients in {client_store.path}")
+        return 0
+
+    clients = client_store.search(args.query)
+    for client in clients:
+        print(json.dumps(client, ensure_ascii=False))
+
+    return 0 if clients else 1
+
+
+def queue_main(args: argparse.Namespace) -> int:
+    from core.spool import SpoolQueue, run_workers
+
+    if args.action == "work":
+        logger.info(f"DocumentFormatter - {__version__}")
+        run_workers(args.spool, args.workers, args.drain)
+        return 0
+
+    queue = SpoolQueue(args.spool)
+    if args.action == "submit":
+        from core.batch import check_rows, read_rows
+        from core.templates import get_template_path
+
+        if PREVALIDATE and check_rows(get_template_path(args.template), args.data):
+            return 1
+
+        job_ids = queue.submit(args.template, read_rows(args.data))
+        print(f"Queued {len(job_ids)} jobs in {args.spool}")
+        return 0
+
+    print(", ".join(f"{state}: {count}" for state, count in queue.counts().items()))
+    return 0
+
+
+def watch_main(args: argparse.Namespace) -> int:
+    from core.authoring import watch_templates
+
+    logger.info(f"DocumentFormatter - {__version__}")
+    watch_templates(args.templates, args.sample)
+
+    return 0
+
+
+# path arguments of the commands, relative ones are given from the client's working directory
+PATH_ARGS = ("data", "report", "bundle", "merge", "output", "spool")
+
+
+def daemon_session(argv: list[str], cwd: Path) -> int:
+    """ Run a session of the thin client in the daemon, tracing is set up when the daemon starts """
+    started = time.perf_counter()
+    args = parse_args(argv)
+    if args.command in ("serve", "watch", "daemon") or getattr(args, "action", None) == "work":
+        print(f"Command {args.command} can not run in the daemon", file=sys.stderr)
+        return 2
+    if getattr(args, "bundle", None) == "-":
+        print("Bundles can not be streamed to stdout through the daemon, give a file path", file=sys.stderr)
+        return 2
+
+    for name in PATH_ARGS:
+        if (value := getattr(args, name, None)) is not None:
+            setattr(args, name, type(value)(cwd / value))
+
+    return run_command(args, check_updates=False, started=started)
+
+
+def daemon_main(args: argparse.Namespace) -> int:
+    from core.daemon import serve_daemon
+
+    logger.info(f"DocumentFormatter - {__version__}")
+    # the daemon checks for updates once, not in every session
+    asyncio.run(check_update())
+    serve_daemon(args.socket, daemon_session)
+
+    return 0
+
+
+COMMANDS = {
+    "batch": batch_main,
+    "generate": generate_main,
+    "serve": serve_main,
+    "manifest": manifest_main,
+    "cache": cache_main,
+    "clients": clients_main,
+    "watch": watch_main,
+    "daemon": daemon_main,
+    "queue": queue_main,
+}
+
+
+def run_command(args: argparse.Namespace, check_updates: bool = True, started: float = STARTED) -> int:
+    """ Run the command of the parsed arguments, the interactive session without one """
+    if args.command is None:
+        main(check_updates, started)
+        return 0
+
+    return COMMANDS[args.command](args)
 
 
 if __name__ == '__main__':
     # print(get_tmpl_bundles(Path(r"D:\.Development\.Projects\HA.Estate\DocumentFormatter\templates\Доверенность")))
-    asyncio.run(main())
+    multiprocessing.freeze_support()
+    cli_args = parse_args()
+
+    if cli_args.trace or cli_args.trace_file:
+        from core.tracing import enable_tracing
+
+        enable_tracing(cli_args.trace_file or "log", cli_args.trace_memory)
+
+    sys.exit(run_command(cli_args))
@@ -0,0 +1,14 @@
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """ Run every test in an empty directory with the templates of the repository """
+    (tmp_path / "templates").symlink_to(ROOT / "templates", target_is_directory=True)
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+import docx
+import pytest
+
+from core.authoring import SampleRender, _changed_templates
+from core.config import TEMPLATES_PATH
+from core.watcher import FileWatcher
+
+
+def text(path: Path) -> str:
+    return "".join(docx.Document(path).element.body.itertext())
+
+
+def test_watcher_changes(tmp_path: Path):
+    root = tmp_path / "watched"
+    (root / "__pycache__").mkdir(parents=True)
+    (root / "a.docx").write_bytes(b"a")
+    watcher = FileWatcher(root)
+
+    (root / "a.docx").write_bytes(b"changed")
+    (root / "bundles.py").write_text("")
+    (root / "notes.txt").write_text("")
+    (root / "~$a.docx").write_bytes(b"lock")
+    (root / "__pycache__" / "bundles.py").write_text("")
+
+    assert watcher.changes() == {root / "a.docx", root / "bundles.py"}
+    assert watcher.changes() == set()
+
+    (root / "a.docx").unlink()
+    assert watcher.changes() == {root / "a.docx"}
+
+
+def test_watcher_thread(tmp_path: Path):
+    changed = []
+    called = threading.Event()
+    stop = FileWatcher(tmp_path, interval=0.01).start(lambda paths: changed.append(paths) or called.set())
+    try:
+        time.sleep(0.05)
+        (tmp_path / "bundles.py").write_text("")
+        assert called.wait(5)
+    finally:
+        stop.set()
+
+    assert changed == [{tmp_path / "bundles.py"}]
+
+
+def test_changed_templates():
+    changed = {TEMPLATES_PATH / "_TestRepeatable" / "bundles.py", TEMPLATES_PATH / "a.docx", Path("other.py")}
+
+    assert _changed_templates(changed) == {"_TestRepeatable", "a.docx"}
+
+
+def test_generated_sample_is_kept():
+    sample_render = SampleRender("_TestRepeatable")
+
+    sample_render.render()
+    sample = sample_render.sample_path.read_text(encoding="utf-8")
+    first = text(sample_render.output_path)
+    sample_render.render()
+
+    assert sample_render.sample_path.read_text(encoding="utf-8") == sample
+    assert text(sample_render.output_path) == first
+    assert json.loads(sample)["tests"][0]["testing"] in first
+
+
+def test_generated_sample_is_replaced():
+    sample_render = SampleRender("_TestRepeatable")
+    sample_render.sample_path.parent.mkdir(parents=True)
+    # a sample of the bundles before they changed
+    sample_render.sample_path.write_text(json.dumps({"tests": [{"testing": [1]}]}), encoding="utf-8")
+
+    sample_render.render()
+
+    assert json.loads(sample_render.sample_path.read_text(encoding="utf-8"))["tests"][0]["testing"] != [1]
+    assert sample_render.output_path.is_file()
+
+
+def test_given_sample(workdir: Path):
+    sample_path = workdir / "sample.json"
+    sample_path.write_text(json.dumps({"tests": [{"testing": "образец"}]}), encoding="utf-8")
+    sample_render = SampleRender("_TestRepeatable", sample_path)
+
+    sample_render.render()
+    assert "образец" in text(sample_render.output_path)
+
+    sample_path.write_text(json.dumps({"tests": [{"testing": [1]}]}), encoding="utf-8")
+    with pytest.raises(ValueError, match="does not fit the bundles"):
+        sample_render.render()
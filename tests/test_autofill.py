@@ -0,0 +1,30 @@
+import random
+import re
+
+import pytest
+
+from core.autofill import _random_object_id, generate_rows
+from core.batch import validate_row
+from core.common_bundles.object import OBJECT_ID_PATTERN
+from core.features.n2w import n2w_batch
+from core.templates import get_template_path, get_tmpl_bundles, list_templates
+
+
+def test_object_ids_match_the_pattern(monkeypatch: pytest.MonkeyPatch):
+    random.seed(0)
+    for _ in range(10000):
+        assert re.match(OBJECT_ID_PATTERN, _random_object_id())
+
+    # the shortest id there is
+    monkeypatch.setattr(random, "randint", lambda a, b: a)
+    assert re.match(OBJECT_ID_PATTERN, _random_object_id())
+
+
+@pytest.mark.parametrize("template", sorted(list_templates()))
+def test_generated_rows_are_valid(template: str):
+    tmpl_dir = get_template_path(template).parent
+    bundles = get_tmpl_bundles(tmpl_dir)
+
+    for row in generate_rows(tmpl_dir, 100, seed=0):
+        with n2w_batch():
+            validate_row(bundles, row, streams=False)
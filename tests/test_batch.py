@@ -0,0 +1,77 @@
+import csv
+import json
+from pathlib import Path
+from typing import Any
+
+from core.autofill import generate_rows
+from core.batch import build_context, check_rows, read_rows
+from core.common_bundles import ObjectInfoBundle
+from core.templates import get_template_path, get_tmpl_bundles
+from core.validation import validate_bundle
+
+
+def flatten(row: dict[str, Any], prefix: str = "") -> dict[str, Any]:
+    """ Columns of a CSV file with the row, the reverse of read_rows """
+    columns = {}
+    for key, value in row.items():
+        if isinstance(value, list):
+            value = dict(enumerate(value))
+        if isinstance(value, dict):
+            columns.update(flatten({str(k): v for k, v in value.items()}, f"{prefix}{key}."))
+        else:
+            columns[prefix + key] = "" if value is None else value
+
+    return columns
+
+
+def write_csv(data_path: Path, rows: list[dict[str, Any]]):
+    columns = [flatten(row) for row in rows]
+    with open(data_path, "w", encoding="utf-8", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(dict.fromkeys(name for row in columns for name in row)))
+        writer.writeheader()
+        writer.writerows(columns)
+
+
+def test_read_rows_nested_csv(tmp_path: Path):
+    data_path = tmp_path / "rows.csv"
+    data_path.write_text("a,rus.b,items.0.c,items.1.c\n1,2,3,\n", encoding="utf-8")
+
+    assert list(read_rows(data_path)) == [{"a": "1", "rus": {"b": "2"}, "items": [{"c": "3"}]}]
+
+
+def test_empty_cells_of_nullable_fields(tmp_path: Path):
+    data_path = tmp_path / "rows.csv"
+    data_path.write_text(
+        "apart_no,object_id,object_address,area,area_adjacent\n12,1.2.3,Бургас,50.5,\n", encoding="utf-8"
+    )
+
+    instance = validate_bundle(ObjectInfoBundle, next(read_rows(data_path)))
+
+    assert instance.area_adjacent is None
+    assert instance.area_total is None
+
+
+def test_empty_cells_of_template_rows(tmp_path: Path):
+    tmpl_path = get_template_path("Доверенность")
+    rows = list(generate_rows(tmpl_path.parent, 3, seed=2))
+    for row in rows:
+        row["area_adjacent"] = None
+    data_path = tmp_path / "rows.csv"
+    write_csv(data_path, rows)
+
+    assert check_rows(tmpl_path, data_path) == []
+    bundles = get_tmpl_bundles(tmpl_path.parent)
+    for row in read_rows(data_path):
+        assert build_context(bundles, row)["area_adjacent"] is None
+
+
+def test_missing_required_fields_are_reported(tmp_path: Path):
+    tmpl_path = get_template_path("Доверенность")
+    row = next(generate_rows(tmpl_path.parent, 1, seed=3))
+    del row["area"]
+    data_path = tmp_path / "rows.jsonl"
+    data_path.write_text(json.dumps(row, ensure_ascii=False), encoding="utf-8")
+
+    results = check_rows(tmpl_path, data_path)
+
+    assert len(results) == 1 and "area: Field required" in results[0].error
@@ -0,0 +1,37 @@
+import json
+from pathlib import Path
+
+from benchmarks.run import STAGES, benchmark, compare, main
+
+
+def test_benchmark():
+    results = benchmark(["_TestRepeatable"], [3], trace_memory=False, seed=0)
+
+    assert [res["stage"] for res in results] == STAGES
+    ops = {res["stage"]: res["ops"] for res in results}
+    assert ops["load"] == 1 and ops["validate"] == ops["render"] == ops["save"] == 3
+
+
+def test_compare():
+    baseline = [
+        dict(template="t", rows=10, stage="render", per_op_ms=1.0),
+        dict(template="t", rows=10, stage="save", per_op_ms=0.01),
+    ]
+    results = [
+        dict(template="t", rows=10, stage="render", per_op_ms=1.5),
+        # slower by far, but under the noise floor
+        dict(template="t", rows=10, stage="save", per_op_ms=0.05),
+        dict(template="t", rows=100, stage="render", per_op_ms=9.0),
+    ]
+
+    assert compare(results, baseline, threshold=0.2) == ["t 10 rows render: 1.000ms -> 1.500ms per op"]
+
+
+def test_main(workdir: Path):
+    args = ["--templates", "_TestNum2Words", "--rows", "2", "--no-memory", "--baseline", str(workdir / "baseline.json")]
+
+    assert main([*args, "--save-baseline"]) == 0
+    assert main([*args, "--output", str(workdir / "results.json"), "--threshold", "1000"]) == 0
+
+    report = json.loads((workdir / "results.json").read_text(encoding="utf-8"))
+    assert len(report["results"]) == len(STAGES) and "docxtpl" in report["meta"]["packages"]
@@ -0,0 +1,50 @@
+import json
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from client import run_client, split_socket
+from core.config import DAEMON_SOCKET
+
+
+@pytest.mark.parametrize("argv, expected", [
+    (["batch", "x"], (DAEMON_SOCKET, ["batch", "x"])),
+    (["--socket", "d.sock", "batch"], (Path("d.sock"), ["batch"])),
+    (["--socket=/run/d.sock", "manifest"], (Path("/run/d.sock"), ["manifest"])),
+    # options of the commands are passed on
+    (["daemon", "--socket", "d.sock"], (DAEMON_SOCKET, ["daemon", "--socket", "d.sock"])),
+])
+def test_split_socket(argv, expected):
+    assert split_socket(argv) == expected
+
+
+def test_default_socket_is_absolute():
+    assert DAEMON_SOCKET.is_absolute()
+
+
+def test_run_client(tmp_path: Path, capsys: pytest.CaptureFixture):
+    """ The client talks to a daemon on the given socket from any working directory """
+    path = tmp_path / "d.sock"
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(str(path))
+    server.listen()
+    received = {}
+
+    def serve():
+        conn, _ = server.accept()
+        with conn, conn.makefile("rb") as rfile, conn.makefile("wb") as wfile:
+            received.update(json.loads(rfile.readline()))
+            wfile.write(b'{"out": "rendered\\n"}\n{"exit": 3}\n')
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        assert run_client(["manifest"], path) == 3
+    finally:
+        thread.join()
+        server.close()
+
+    assert received["argv"] == ["manifest"]
+    assert capsys.readouterr().out == "rendered\n"
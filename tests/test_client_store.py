@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import core.batch
+from core.batch import check_rows
+from core.client_store import ClientStore
+from core.common_bundles import PassportBundle
+from core.templates import get_template_path
+
+PASSPORT = dict(
+    passport_no="75 1234567",
+    passport_issued_date="01.02.2015",
+    passport_issued_by_name="ГУ МВД",
+    passport_issued_by_code="500-127",
+)
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> ClientStore:
+    store = ClientStore(tmp_path / "clients.db")
+    store.save(PassportBundle(**PASSPORT))
+    yield store
+    store.close()
+
+
+def test_fill(store: ClientStore):
+    rows = [{"passport_no": "751234567"}, {"passport_no": "75 1234567", "passport_issued_by_name": "УФМС"}]
+
+    store.fill([PassportBundle], rows)
+
+    assert rows[0] == {**PASSPORT, "passport_no": "751234567"}
+    assert rows[1]["passport_issued_by_name"] == "УФМС"
+    assert rows[1]["passport_issued_by_code"] == "500-127"
+
+
+def test_fill_malformed_rows(store: ClientStore):
+    rows = [[1], "row", {"passport_no": "751234567"}]
+
+    store.fill([PassportBundle], rows)
+
+    assert rows[:2] == [[1], "row"]
+    assert rows[2]["passport_issued_date"] == "01.02.2015"
+
+
+def test_check_malformed_rows(store: ClientStore, workdir: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(core.batch, "CLIENT_STORE", True)
+    monkeypatch.setattr(core.batch, "client_store", store)
+    data_path = workdir / "rows.jsonl"
+    data_path.write_text(f"{json.dumps([1])}\n{json.dumps({'citizen_datas': [{'passport_no': '751234567'}]})}\n", encoding="utf-8")
+
+    results = check_rows(get_template_path("Доверенность"), data_path)
+
+    assert [res.index for res in results] == [1, 2]
+    assert "valid dictionary" in results[0].error
+    # the stored passport fills the item of the second row
+    assert "citizen_datas.0.f_name" in results[1].error
+    assert "citizen_datas.0.passport_issued_date" not in results[1].error
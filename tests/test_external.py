@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import ClassVar
+
+import pytest
+from aiohttp import web
+
+from core.features.external import ExternalBundle, ExternalSource, HTTPSource, SQLiteSource, prefetch_rows
+
+RECORDS = {"1": {"key": "1", "name": "Первый"}, "2": {"key": "2", "name": "Второй"}}
+
+
+@pytest.fixture
+def url() -> Iterator[str]:
+    """ Address of a records endpoint served from a background thread """
+    async def records(request: web.Request) -> web.Response:
+        keys = (await request.json())["keys"]
+        return web.json_response({key: RECORDS.get(key) for key in keys})
+
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.add_routes([web.post("/records", records)])
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{port}/records"
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def make_bundle(source: ExternalSource) -> type[ExternalBundle]:
+    class Bundle(ExternalBundle):
+        external_src: ClassVar[ExternalSource] = source
+        external_key: ClassVar[str] = "key"
+
+        key: str
+        name: str
+
+    return Bundle
+
+
+def test_sync_get_closes_its_session(url: str):
+    source = HTTPSource(url, "key", ttl=0)
+
+    assert [source.get(key) for key in ("1", "2", "3")] == [RECORDS["1"], RECORDS["2"], None]
+    assert source._sessions == {}
+
+
+def test_fill_from_source(url: str):
+    bundle = make_bundle(HTTPSource(url, "key"))
+
+    assert bundle.model_validate({"key": "2"}).name == "Второй"
+    assert bundle.external_src._sessions == {}
+
+
+def test_prefetch_rows_closes_own_connections_only(url: str, tmp_path: Path):
+    database = tmp_path / "records.db"
+    with sqlite3.connect(database) as connection:
+        connection.execute("CREATE TABLE records (key TEXT, name TEXT)")
+        connection.executemany("INSERT INTO records VALUES (:key, :name)", RECORDS.values())
+    connection.close()
+
+    other = SQLiteSource(database, "records", "key")
+    assert other.get("1") == RECORDS["1"]
+    assert other._pool.qsize() == 1
+
+    source = HTTPSource(url, "key")
+    rows = list(prefetch_rows([make_bundle(source)], [{"key": "1"}, {"key": "2", "name": "Свой"}]))
+
+    assert rows == [RECORDS["1"], {"key": "2", "name": "Свой"}]
+    assert source._sessions == {}
+    # a source of another job keeps its pooled connections
+    assert other._pool.qsize() == 1
+
+
+def test_source_needs_fetch():
+    class NoFetchSource(ExternalSource):
+        pass
+
+    with pytest.raises(TypeError):
+        NoFetchSource()
@@ -0,0 +1,59 @@
+import pytest
+from lxml import etree
+
+import core.batch
+from core.autofill import generate_rows
+from core.batch import build_context, validate_row
+from core.features.n2w import n2w_batch
+from core.lazy_context import LazyBundle
+from core.manifest import template_manifest
+from core.postprocess import document_roots
+from core.template_cache import template_cache
+from core.templates import get_template_path, get_tmpl_bundles, list_templates
+
+
+def render(template: str, row: dict, lazy: bool, monkeypatch: pytest.MonkeyPatch) -> list[bytes]:
+    monkeypatch.setattr(core.batch, "LAZY_CONTEXT", lazy)
+    tmpl_path = get_template_path(template)
+    variables = template_manifest.get_variables(tmpl_path) if lazy else None
+    context = build_context(get_tmpl_bundles(tmpl_path.parent), row, variables, streams=False)
+
+    document = template_cache.get(tmpl_path)
+    document.render(context)
+    return [etree.tostring(root, encoding="unicode") for root in document_roots(document.docx)]
+
+
+@pytest.mark.parametrize("template", sorted(list_templates()))
+def test_same_as_eager(template: str, monkeypatch: pytest.MonkeyPatch):
+    for row in generate_rows(get_template_path(template).parent, 5, seed=0):
+        assert render(template, row, True, monkeypatch) == render(template, row, False, monkeypatch)
+
+
+@pytest.mark.parametrize("template, row, text", [
+    # computed field
+    ("_TestComputed", {"gender": "Ж"}, "гражданка"),
+    # num2words fields, on the bundle and on the items of a repeatable bundle
+    ("_TestNum2Words", {"apart_no": 12}, "двенадцать"),
+    ("_TestNested", {"test_data": [{"test": 5}, {"test": 7}]}, "семь"),
+])
+def test_derived_values(template: str, row: dict, text: str, monkeypatch: pytest.MonkeyPatch):
+    lazy = render(template, row, True, monkeypatch)
+
+    assert lazy == render(template, row, False, monkeypatch)
+    assert text in "".join(lazy)
+
+
+def test_lazy_view(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(core.batch, "LAZY_CONTEXT", True)
+    bundles = get_tmpl_bundles(get_template_path("_TestNum2Words").parent)
+
+    # only the referenced values are put in the context
+    assert list(build_context(bundles, {}, {"area_words"})) == ["area_words"]
+
+    with n2w_batch(generate=False):
+        [(_, instance)] = validate_row(bundles, {})
+    view = LazyBundle(instance)
+    assert view.apart_no_words == "двенадцать"
+    assert "area" in view and "other" not in view
+    with pytest.raises(AttributeError):
+        view.other
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import main
+from tests.conftest import ROOT
+
+HEAVY_MODULES = ("docxtpl", "docx", "jinja2", "pydantic", "num2words", "polyfactory", "aiohttp", "gh_auto_updater")
+
+
+def test_heavy_imports_are_deferred():
+    code = f"import sys, main; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == ""
+
+
+def test_update_check_runs_in_background(monkeypatch: pytest.MonkeyPatch):
+    selected = threading.Event()
+    checked = threading.Event()
+
+    async def check_update():
+        # the check finishes only after the user has chosen the templates
+        assert selected.wait(5)
+        checked.set()
+
+    def user_select_tmpls():
+        selected.set()
+        return []
+
+    monkeypatch.setattr(main, "check_update", check_update)
+    monkeypatch.setattr(main, "user_select_tmpls", user_select_tmpls)
+    monkeypatch.setattr(main, "process_templates", lambda tmpl_paths: None)
+
+    main.main()
+
+    assert checked.is_set()
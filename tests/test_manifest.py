@@ -0,0 +1,99 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+import core.manifest
+import core.templates
+from core.manifest import TemplateManifest, _find_references
+from tests.conftest import ROOT
+
+
+@pytest.fixture
+def templates(workdir: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """ Copy of the templates, so they can be changed """
+    templates = workdir / "own_templates"
+    shutil.copytree(ROOT / "templates", templates, ignore=shutil.ignore_patterns("~$*"))
+    monkeypatch.setattr(core.manifest, "TEMPLATES_PATH", templates)
+    monkeypatch.setattr(core.templates, "TEMPLATES_PATH", templates)
+
+    return templates
+
+
+@pytest.fixture
+def manifest(workdir: Path, templates: Path) -> TemplateManifest:
+    return TemplateManifest(workdir / "manifest.json")
+
+
+def test_find_references():
+    variables, attributes = _find_references([
+        "{% for item in items %}{{ item.name }}{% endfor %}{{ person.age }}{{ title }}{% set local = 1 %}{{ local }}"
+    ])
+
+    assert variables == {"items", "person", "title"}
+    assert attributes == {"items": {"name"}, "person": {"age"}}
+
+
+def test_entries(manifest: TemplateManifest):
+    entries = manifest.refresh()
+
+    assert sorted(entries) == sorted(path.name for path in (ROOT / "templates").iterdir())
+    entry = entries["_TestNested"]
+    assert entry.variables == ["test_data"]
+    assert entry.attributes == {"test_data": ["test", "test_words"]}
+    assert entry.bundles == ["Bundle"] and not entry.missing and not entry.error
+    # the template prints the passport holders' names without the surname
+    assert entries["Доверенность"].unused == ["s_name"]
+
+
+def test_missing_values(manifest: TemplateManifest, templates: Path):
+    bundles_path = templates / "_TestNested" / "bundles.py"
+    source = bundles_path.read_text(encoding="utf-8")
+    bundles_path.write_text(source.replace('"test_words"', '"words"'), encoding="utf-8")
+
+    entry = manifest.get("_TestNested")
+
+    assert entry.missing == ["test_data.test_words"]
+    assert entry.unused == ["test_data.words"]
+
+
+def test_incremental_refresh(manifest: TemplateManifest, templates: Path, monkeypatch: pytest.MonkeyPatch):
+    manifest.refresh()
+    indexed = []
+    index_template = core.manifest._index_template
+    monkeypatch.setattr(
+        core.manifest, "_index_template", lambda path: indexed.append(path.name) or index_template(path)
+    )
+
+    manifest.refresh()
+    assert indexed == []
+
+    with open(templates / "_TestRepeatable" / "bundles.py", "a", encoding="utf-8") as fp:
+        fp.write("\n# changed\n")
+    shutil.rmtree(templates / "_TestComputed")
+    entries = manifest.refresh()
+
+    assert indexed == ["_TestRepeatable"]
+    assert "_TestComputed" not in entries
+
+
+def test_saved(manifest: TemplateManifest, workdir: Path):
+    entries = manifest.refresh()
+
+    assert TemplateManifest(workdir / "manifest.json").entries == entries
+
+
+def test_broken_template(manifest: TemplateManifest, templates: Path):
+    (templates / "_TestRepeatable" / "bundles.py").write_text("names = []", encoding="utf-8")
+
+    entry = manifest.get("_TestRepeatable")
+
+    assert entry.error == "ValueError: Template does not have bundles list variable."
+    assert manifest.get_variables(entry.path) is None
+
+
+def test_get_variables(manifest: TemplateManifest, templates: Path):
+    tmpl_path = templates / "_TestRepeatable" / "TestRepeatable.docx"
+
+    assert manifest.get_variables(tmpl_path) == {"tests"}
+    assert manifest.get_variables(templates / "_TestRepeatable" / "other.docx") is None
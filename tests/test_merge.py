@@ -0,0 +1,66 @@
+import json
+import zipfile
+from collections import Counter
+from pathlib import Path
+
+import docx
+import pytest
+
+import core.batch
+from core.autofill import generate_rows
+from core.batch import build_context, run_merge
+from core.merge import merge_documents
+from core.templates import get_template_path, get_tmpl_bundles
+
+
+def contexts(name: str, rows: list[dict]) -> list[dict]:
+    tmpl_path = get_template_path(name)
+    bundles = get_tmpl_bundles(tmpl_path.parent)
+
+    return [build_context(bundles, row) for row in rows]
+
+
+def test_merge_sections(tmp_path: Path):
+    """ _TestNested has no section properties of its own """
+    target = tmp_path / "merged.docx"
+    rows = [{"test_data": [{"test": number}]} for number in (5, 7, 9)]
+
+    assert merge_documents(get_template_path("_TestNested"), contexts("_TestNested", rows), target) == 3
+
+    document = docx.Document(target)
+    text = "".join(document.element.body.itertext())
+    assert len(document.sections) == 3
+    assert all(words in text for words in ("пять", "семь", "девять"))
+
+
+def test_merge_unique_parts_and_ids(tmp_path: Path):
+    target = tmp_path / "merged.docx"
+    tmpl_path = get_template_path("Доверенность")
+    rows = list(generate_rows(tmpl_path.parent, 4, seed=1))
+
+    assert merge_documents(tmpl_path, contexts("Доверенность", rows), target) == 4
+
+    with zipfile.ZipFile(target) as archive:
+        assert not [name for name, count in Counter(archive.namelist()).items() if count > 1]
+
+    body = docx.Document(target).element.body
+    assert len(body.xpath(".//w:sectPr")) == 4
+    for ids in (body.xpath(".//wp:docPr/@id"), body.xpath(".//w:bookmarkStart/@w:id")):
+        assert len(ids) == len(set(ids))
+
+
+def test_merge_nothing(tmp_path: Path):
+    with pytest.raises(ValueError):
+        merge_documents(get_template_path("_TestNested"), [], tmp_path / "merged.docx")
+
+
+def test_run_merge_without_valid_rows(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(core.batch, "PREVALIDATE", False)
+    data_path = tmp_path / "rows.jsonl"
+    data_path.write_text("\n".join(json.dumps({"test_data": [{"test": [number]}]}) for number in range(3)))
+    target = tmp_path / "merged.docx"
+
+    results = run_merge(get_template_path("_TestNested"), data_path, target)
+
+    assert [res.ok for res in results] == [False] * 3
+    assert not target.exists()
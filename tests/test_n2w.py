@@ -0,0 +1,79 @@
+import pytest
+from pydantic import Field
+from pydantic_core import PydanticCustomError
+
+from core.common_bundles import ObjectInfoBundle
+from core.features.n2w import (
+    Num2WordsBundle, Num2WordsField, get_n2w, get_n2w_many, n2w_batch, n2w_cache_clear, n2w_cache_info
+)
+
+OBJECT = dict(apart_no=12, object_id="3.25", object_address="Бургас", area=40, area_adjacent=None)
+
+
+@pytest.mark.parametrize("value, words", [
+    (12, "двенадцать"),
+    ("3.25", "три точка двадцать пять"),
+    (1.5, "одна целая пять десятых"),
+])
+def test_get_n2w(value, words: str):
+    assert get_n2w(value) == words
+
+
+def test_get_n2w_is_memoized():
+    n2w_cache_clear()
+
+    get_n2w(7)
+    get_n2w(7)
+
+    assert n2w_cache_info()["values"].hits == 1
+
+
+def test_get_n2w_many():
+    n2w_cache_clear()
+
+    words = get_n2w_many([5, 5, 5.0, "5", 5])
+
+    assert words == ["пять", "пять", "пять целых ноль десятых", "пять", "пять"]
+    # every distinct value of its own type is converted once
+    assert n2w_cache_info()["values"].misses == 3
+
+
+def test_batch_defers_generation():
+    with n2w_batch() as instances:
+        instance = ObjectInfoBundle(**OBJECT)
+        assert "apart_no_words" not in instance.__dict__
+
+    assert instances == [instance]
+    assert instance.apart_no_words == "двенадцать"
+    assert instance.object_id_words == "три точка двадцать пять"
+
+
+def test_batch_generates_on_access():
+    with n2w_batch(generate=False):
+        instance = ObjectInfoBundle(**OBJECT)
+
+    assert "apart_no_words" not in instance.__dict__
+    assert instance.get_n2w_field("apart_no_words") == "двенадцать"
+    assert "object_id_words" not in instance.__dict__
+
+
+def test_n2w_fields_on_class_creation():
+    class Bundle(ObjectInfoBundle):
+        floor: int = Num2WordsField("floor_words", Field(default=3))
+
+    assert ObjectInfoBundle.n2w_fields == (("apart_no", "apart_no_words"), ("object_id", "object_id_words"))
+    assert Bundle.n2w_fields[-1] == ("floor", "floor_words")
+    assert Bundle(**OBJECT).floor_words == "три"
+
+
+def test_not_num2wordable_field():
+    with pytest.raises(PydanticCustomError, match="unprocessable type"):
+        class Bundle(Num2WordsBundle):
+            values: list[int] = Num2WordsField("values_words", Field(default=[1]))
+
+
+def test_taken_result_name():
+    with pytest.raises(PydanticCustomError, match="already taken"):
+        class Bundle(Num2WordsBundle):
+            number: int = Num2WordsField("words", Field(default=1))
+            words: str = "один"
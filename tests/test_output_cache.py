@@ -0,0 +1,104 @@
+import shutil
+from pathlib import Path
+
+import docx
+import pytest
+
+import core.output_cache
+import core.render
+from core.output_cache import OutputCache, output_cache
+from core.render import render_document
+from core.templates import get_template_path
+
+CONTEXT = {"tests": [{"testing": "первая"}, {"testing": "вторая"}]}
+
+
+def text(path: Path) -> str:
+    return "\n".join(paragraph.text for paragraph in docx.Document(path).paragraphs)
+
+
+@pytest.fixture
+def tmpl_path(workdir: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """ Copy of a test template, so it can be changed """
+    monkeypatch.setattr(core.render, "OUTPUT_CACHE", True)
+    tmpl_dir = workdir / "_TestRepeatable"
+    shutil.copytree(get_template_path("_TestRepeatable").parent, tmpl_dir)
+
+    return tmpl_dir / get_template_path("_TestRepeatable").name
+
+
+def cached_entries() -> list[Path]:
+    return sorted(output_cache.path.glob("*.docx"))
+
+
+def test_hit(tmpl_path: Path, workdir: Path):
+    assert not render_document(tmpl_path, CONTEXT, workdir / "first.docx")
+    assert render_document(tmpl_path, CONTEXT, workdir / "second.docx")
+
+    [entry] = cached_entries()
+    assert (workdir / "second.docx").read_bytes() == (workdir / "first.docx").read_bytes()
+    # hits are hard-linked to the cached document
+    assert (workdir / "second.docx").stat().st_ino == entry.stat().st_ino
+
+
+def test_hit_copied(tmpl_path: Path, workdir: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(output_cache, "link", False)
+    render_document(tmpl_path, CONTEXT, workdir / "first.docx")
+
+    assert render_document(tmpl_path, CONTEXT, workdir / "second.docx")
+    assert (workdir / "second.docx").stat().st_nlink == 1
+
+
+def test_changed_context(tmpl_path: Path, workdir: Path):
+    render_document(tmpl_path, CONTEXT, workdir / "first.docx")
+
+    assert not render_document(tmpl_path, {"tests": [{"testing": "другая"}]}, workdir / "second.docx")
+    assert "другая" in text(workdir / "second.docx")
+    assert len(cached_entries()) == 2
+
+
+def test_changed_template(tmpl_path: Path, workdir: Path):
+    render_document(tmpl_path, CONTEXT, workdir / "first.docx")
+    document = docx.Document(tmpl_path)
+    document.add_paragraph("Новый абзац")
+    document.save(tmpl_path)
+
+    assert not render_document(tmpl_path, CONTEXT, workdir / "second.docx")
+    assert "Новый абзац" in text(workdir / "second.docx")
+
+
+def test_changed_bundles(tmpl_path: Path, workdir: Path):
+    render_document(tmpl_path, CONTEXT, workdir / "first.docx")
+    with open(tmpl_path.parent / "bundles.py", "a", encoding="utf-8") as fp:
+        fp.write("\n# changed\n")
+
+    assert not render_document(tmpl_path, CONTEXT, workdir / "second.docx")
+
+
+def test_changed_code(tmpl_path: Path, workdir: Path, monkeypatch: pytest.MonkeyPatch):
+    render_document(tmpl_path, CONTEXT, workdir / "first.docx")
+    monkeypatch.setattr(output_cache, "_code_digest", "another version")
+
+    assert not render_document(tmpl_path, CONTEXT, workdir / "second.docx")
+
+
+def test_code_digest(workdir: Path, monkeypatch: pytest.MonkeyPatch):
+    sources = workdir / "sources"
+    (sources / "features").mkdir(parents=True)
+    (sources / "features" / "n2w.py").write_text("WORDS = 1\n", encoding="utf-8")
+    monkeypatch.setattr(core.output_cache, "APP_SOURCES", sources)
+    before = OutputCache(workdir / "cache", 1024, 60).code_digest()
+
+    (sources / "features" / "n2w.py").write_text("WORDS = 2\n", encoding="utf-8")
+
+    assert OutputCache(workdir / "cache", 1024, 60).code_digest() != before
+
+
+def test_missing_cached_file(tmpl_path: Path, workdir: Path):
+    render_document(tmpl_path, CONTEXT, workdir / "first.docx")
+    [entry] = cached_entries()
+    entry.unlink()
+
+    assert not render_document(tmpl_path, CONTEXT, workdir / "second.docx")
+    assert "вторая" in text(workdir / "second.docx")
+    assert cached_entries() == [entry]
@@ -0,0 +1,45 @@
+import docx
+import pytest
+from docx.document import Document
+from docx.shared import Cm
+
+from core.postprocess import PostPass, PostProcessor, W_R
+
+
+def make_document() -> Document:
+    document = docx.Document()
+    paragraph = document.add_paragraph()
+    paragraph.paragraph_format.tab_stops.add_tab_stop(Cm(2))
+    for text in ("Раз", " два", " три"):
+        paragraph.add_run(text)
+    document.add_paragraph()
+    document.add_table(rows=1, cols=1)
+
+    return document
+
+
+def test_passes():
+    document = make_document()
+
+    PostProcessor.from_names(["tab_stops", "empty_paragraphs", "normalize_styles"]).process(document)
+
+    [paragraph] = document.paragraphs
+    assert paragraph.text == "Раз два три"
+    assert len(paragraph._p.findall(W_R)) == 1
+    assert not paragraph.paragraph_format.tab_stops
+    # a cell keeps its only paragraph
+    assert len(document.tables[0].cell(0, 0).paragraphs) == 1
+
+
+def test_unknown_pass():
+    with pytest.raises(ValueError, match="Unknown post-processing pass"):
+        PostProcessor.from_names(["no_such_pass"])
+
+
+def test_pass_needs_visit():
+    class NoVisitPass(PostPass):
+        name = "no_visit"
+        tags = ()
+
+    with pytest.raises(TypeError):
+        NoVisitPass()
@@ -0,0 +1,27 @@
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import core.render
+from core.render import render_document
+from core.templates import get_template_path
+
+CONTEXT = {"tests": [{"testing": "Проверка " * 200}]}
+
+
+def compress_types(path: Path) -> set[int]:
+    with zipfile.ZipFile(path) as archive:
+        return {info.compress_type for info in archive.infolist()}
+
+
+def test_output_cache_keeps_compression_levels(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(core.render, "OUTPUT_CACHE", True)
+    tmpl_path = get_template_path("_TestRepeatable")
+
+    assert not render_document(tmpl_path, CONTEXT, tmp_path / "deflated.docx", 9)
+    assert not render_document(tmpl_path, CONTEXT, tmp_path / "stored.docx", 0)
+    assert render_document(tmpl_path, CONTEXT, tmp_path / "cached.docx", 0)
+
+    assert compress_types(tmp_path / "deflated.docx") == {zipfile.ZIP_DEFLATED}
+    assert compress_types(tmp_path / "stored.docx") == compress_types(tmp_path / "cached.docx") == {zipfile.ZIP_STORED}
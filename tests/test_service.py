@@ -0,0 +1,66 @@
+import asyncio
+import io
+import threading
+
+import docx
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import core.service
+from core.service import RenderService
+
+
+def post(name: str, payload) -> tuple[int, bytes]:
+    async def run():
+        async with TestClient(TestServer(RenderService(workers=1).make_app())) as client:
+            response = await client.post(f"/templates/{name}/render", json=payload)
+            return response.status, await response.read()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("name, payload, text", [
+    ("_TestRepeatable", {"tests": [{"testing": "первый"}, {"testing": "второй"}]}, "второй"),
+    ("_TestNested", {"test_data": [{"test": 5}]}, "пять"),
+])
+def test_render_repeatable(name, payload, text):
+    status, body = post(name, payload)
+
+    assert status == 200, body
+    document = docx.Document(io.BytesIO(body))
+    assert text in "".join(document.element.body.itertext())
+
+
+def test_render_invalid_row():
+    status, _ = post("_TestNested", {"test_data": [{"test": [1, 2]}]})
+
+    assert status == 422
+
+
+def test_render_unknown_template():
+    status, _ = post("NoSuchTemplate", {})
+
+    assert status == 404
+
+
+@pytest.mark.parametrize("payload", [{"test_data": [1]}, {"test_data": {"a": 1}}, {"test_data": "items.jsonl"}])
+def test_render_invalid_shape(payload):
+    status, body = post("_TestNested", payload)
+
+    assert status == 422, body
+
+
+def test_validation_off_the_loop(monkeypatch: pytest.MonkeyPatch):
+    threads = []
+    original = core.service.validate_row
+
+    def validate_row(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(core.service, "validate_row", validate_row)
+
+    status, _ = post("_TestRepeatable", {"tests": [{"testing": "первый"}]})
+
+    assert status == 200
+    assert threads and threading.main_thread() not in threads
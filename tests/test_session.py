@@ -0,0 +1,64 @@
+import shutil
+from pathlib import Path
+
+import docx
+import pytest
+
+import core.manifest
+import core.templates
+import main
+from core.batch import RepeatableStream, render_many
+from core.common_bundles import GenderDependantBundle
+from core.templates import get_template_path, get_tmpl_bundles
+from tests.conftest import ROOT
+
+
+def text(path: Path) -> str:
+    return "".join(docx.Document(path).element.body.itertext())
+
+
+@pytest.fixture
+def templates(workdir: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """ Two templates made of the same common bundle """
+    templates = workdir / "own_templates"
+    for name in ("_TestComputed", "_TestComputedCopy"):
+        shutil.copytree(ROOT / "templates" / "_TestComputed", templates / name)
+    monkeypatch.setattr(core.manifest, "TEMPLATES_PATH", templates)
+    monkeypatch.setattr(core.templates, "TEMPLATES_PATH", templates)
+
+    return templates
+
+
+def test_shared_bundles_are_filled_once(templates: Path, monkeypatch: pytest.MonkeyPatch):
+    filled = []
+
+    def fill_bundle(bundle):
+        filled.append(bundle)
+        return bundle(gender="Ж")
+
+    monkeypatch.setattr(main, "fill_bundle", fill_bundle)
+
+    tmpl_paths = [templates / name / "TestComputed.docx" for name in ("_TestComputed", "_TestComputedCopy")]
+
+    paths = main.process_templates(tmpl_paths)
+
+    assert filled == [GenderDependantBundle]
+    assert len(paths) == 2 and all("гражданка" in text(path) for path in paths)
+
+
+def test_render_many(workdir: Path, tmp_path: Path):
+    tmpl_path = get_template_path("_TestRepeatable")
+    [bundle] = get_tmpl_bundles(tmpl_path.parent)
+    data_path = tmp_path / "tests.jsonl"
+    data_path.write_text('{"testing": "из потока"}\n', encoding="utf-8")
+    jobs = [
+        (tmpl_path, {"tests": [{"testing": "первый"}]}, workdir / "first.docx"),
+        # streams can not be sent to the workers, they are rendered in this process
+        (tmpl_path, {"tests": RepeatableStream.from_file(bundle, data_path)}, workdir / "stream.docx"),
+        (tmpl_path, {"tests": [{"testing": "третий"}]}, workdir / "third.docx"),
+    ]
+
+    results = render_many(jobs, workers=2)
+
+    assert [(res.index, res.ok) for res in results] == [(1, True), (2, True), (3, True)]
+    assert "из потока" in text(workdir / "stream.docx") and "третий" in text(workdir / "third.docx")
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from core.spool import SpoolQueue
+
+ROWS = [{"tests": [{"testing": f"строка {number}"}]} for number in range(3)]
+
+
+@pytest.fixture
+def queue(tmp_path: Path) -> SpoolQueue:
+    return SpoolQueue(tmp_path / "spool", lease_timeout=60, max_attempts=2)
+
+
+def job_path(queue: SpoolQueue, state: str, job_id: str) -> Path:
+    return queue.path / state / f"{job_id}.json"
+
+
+def test_work_off(queue: SpoolQueue, workdir: Path):
+    job_ids = queue.submit("_TestRepeatable", ROWS)
+
+    assert queue.work(drain=True) == 3
+    assert queue.counts() == dict(incoming=0, claimed=0, done=3, failed=0)
+    assert sorted(path.name for path in (workdir / "output").iterdir()) == [
+        f"TestRepeatable_{job_id}.docx" for job_id in job_ids
+    ]
+
+
+def test_lease_starts_with_the_claim(queue: SpoolQueue):
+    [job_id] = queue.submit("_TestRepeatable", ROWS[:1])
+    path = job_path(queue, "incoming", job_id)
+    # the job waited longer than a lease before it was claimed
+    written = time.time() - 600
+    os.utime(path, (written, written))
+
+    claim, job = queue._claim(path)
+
+    assert claim.stat().st_mtime > written + 500
+    assert queue.recover() == 0
+    assert job["attempts"] == 1
+
+
+def test_claim_taken_job(queue: SpoolQueue):
+    assert queue._claim(job_path(queue, "incoming", "taken")) is None
+    assert not queue.process(job_path(queue, "incoming", "taken"))
+
+
+def test_expired_lease(queue: SpoolQueue):
+    [job_id] = queue.submit("_TestRepeatable", ROWS[:1])
+    claim, _ = queue._claim(job_path(queue, "incoming", job_id))
+    expired = time.time() - 120
+    os.utime(claim, (expired, expired))
+
+    assert queue.recover() == 1
+    assert queue.work(drain=True) == 1
+    assert json.loads(job_path(queue, "done", job_id).read_text(encoding="utf-8"))["attempts"] == 2
+
+
+def test_attempts_are_capped(queue: SpoolQueue):
+    [job_id] = queue.submit("_TestRepeatable", ROWS[:1])
+    for _ in range(2):
+        claim, _ = queue._claim(job_path(queue, "incoming", job_id))
+        expired = time.time() - 120
+        os.utime(claim, (expired, expired))
+        queue.recover()
+
+    queue.work(drain=True)
+
+    job = json.loads(job_path(queue, "failed", job_id).read_text(encoding="utf-8"))
+    assert job["error"].startswith("Gave up after 2 attempts")
+
+
+@pytest.mark.parametrize("template", ["NoSuchTemplate", "../templates/_TestRepeatable", ["_TestRepeatable"]])
+def test_unknown_template(queue: SpoolQueue, template):
+    job_path(queue, "incoming", "job").write_text(json.dumps(dict(template=template, row={})), encoding="utf-8")
+
+    queue.work(drain=True)
+
+    job = json.loads(job_path(queue, "failed", "job").read_text(encoding="utf-8"))
+    assert job["error"].startswith("ValueError: Template") and job["attempts"] == 1
+
+
+def test_invalid_row_is_not_retried(queue: SpoolQueue):
+    [job_id] = queue.submit("_TestRepeatable", [{"tests": [1]}])
+
+    queue.work(drain=True)
+
+    assert json.loads(job_path(queue, "failed", job_id).read_text(encoding="utf-8"))["attempts"] == 1
+
+
+def test_finish_recovered_claim(queue: SpoolQueue):
+    [job_id] = queue.submit("_TestRepeatable", ROWS[:1])
+    claim, job = queue._claim(job_path(queue, "incoming", job_id))
+    expired = time.time() - 120
+    os.utime(claim, (expired, expired))
+    queue.recover()
+
+    queue._finish(claim, job, "done")
+
+    assert queue.counts() == dict(incoming=1, claimed=0, done=0, failed=0)
+    assert not any((queue.path / "tmp").iterdir())
+
+
+def test_rows_do_not_read_files(queue: SpoolQueue, workdir: Path):
+    data_path = workdir / "tests.jsonl"
+    data_path.write_text(json.dumps({"testing": "из файла"}), encoding="utf-8")
+    [job_id] = queue.submit("_TestRepeatable", [{"tests": str(data_path)}])
+
+    queue.work(drain=True)
+
+    job = json.loads(job_path(queue, "failed", job_id).read_text(encoding="utf-8"))
+    assert job["error"] == "ValueError: tests must be a list"
@@ -0,0 +1,103 @@
+import shutil
+from pathlib import Path
+from typing import Any
+
+import docx
+import pytest
+from docxtpl import DocxTemplate
+from lxml import etree
+
+from core.autofill import bundle_data, generate_rows, get_factory
+from core.batch import build_context
+from core.features.repeatable import RepeatableBundle
+from core.postprocess import document_roots
+from core.template_cache import BODY_PART, TemplateCache, extract_parts, extract_row_loops
+from core.templates import get_template_path, get_tmpl_bundles, list_templates
+
+
+@pytest.fixture
+def tmpl_path(workdir: Path) -> Path:
+    """ Copy of a test template, so it can be changed """
+    source = get_template_path("_TestRepeatable")
+    shutil.copytree(source.parent, workdir / source.parent.name)
+
+    return workdir / source.parent.name / source.name
+
+
+def edit(tmpl_path: Path, text: str):
+    document = docx.Document(tmpl_path)
+    document.add_paragraph(text)
+    document.save(tmpl_path)
+
+
+def test_prepared_once(tmpl_path: Path):
+    cache = TemplateCache()
+
+    assert cache.get_prepared(tmpl_path) is cache.get_prepared(tmpl_path)
+
+
+def test_edited_template_is_evicted(tmpl_path: Path):
+    cache = TemplateCache()
+    first = cache.get_prepared(tmpl_path)
+
+    for number in range(3):
+        edit(tmpl_path, f"Правка {number}")
+        cache.get_prepared(tmpl_path)
+
+    assert list(cache._by_digest) == [cache.get_prepared(tmpl_path).digest] != [first.digest]
+
+
+def test_shared_content_is_kept(tmpl_path: Path, workdir: Path):
+    cache = TemplateCache()
+    copy_path = workdir / "copy.docx"
+    shutil.copyfile(tmpl_path, copy_path)
+    shared = cache.get_prepared(tmpl_path)
+    assert cache.get_prepared(copy_path) is shared
+
+    edit(tmpl_path, "Правка")
+    cache.get_prepared(tmpl_path)
+
+    assert cache.get_prepared(copy_path) is shared
+    assert len(cache._by_digest) == 2
+
+
+def render_parts(document: DocxTemplate) -> list[bytes]:
+    return [etree.tostring(root) for root in document_roots(document.docx)]
+
+
+def make_row(tmpl_dir: Path, items: int) -> dict[str, Any]:
+    """ Generated row of the template with the given number of items in every repeatable bundle """
+    bundles = get_tmpl_bundles(tmpl_dir)
+    row = next(generate_rows(tmpl_dir, 1, seed=items))
+    for bundle in bundles:
+        if issubclass(bundle, RepeatableBundle):
+            row[bundle.result_var_name] = [
+                bundle_data(get_factory(bundle).build()) for _ in range(items)
+            ]
+
+    return row
+
+
+@pytest.mark.parametrize("items", [0, 1, 5])
+@pytest.mark.parametrize("template", sorted(list_templates()))
+def test_same_as_docxtpl(template: str, items: int):
+    """ The precompiled template with cloned loop bodies renders what docxtpl renders """
+    tmpl_path = get_template_path(template)
+    row = make_row(tmpl_path.parent, items)
+    bundles = get_tmpl_bundles(tmpl_path.parent)
+
+    cached = TemplateCache().get(tmpl_path)
+    cached.render(build_context(bundles, row, streams=False))
+    plain = DocxTemplate(tmpl_path)
+    plain.render(build_context(bundles, row, streams=False))
+
+    assert render_parts(cached) == render_parts(plain)
+
+
+def test_row_loops_are_cloned():
+    source = get_template_path("_TestRepeatable").read_bytes()
+    xml, _ = extract_parts(source)[BODY_PART]
+
+    _, bodies = extract_row_loops(xml)
+
+    assert bodies
@@ -0,0 +1,64 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from core.templates import BundleRegistry, get_template_path
+
+BUNDLES = '''
+class Bundle(BaseBundle):
+    name: str = Field(description="Имя")
+
+
+bundles = [Bundle]
+'''
+
+
+@pytest.fixture
+def tmpl_dir(workdir: Path) -> Path:
+    """ Copy of a test template, so its bundles can be changed """
+    source = get_template_path("_TestRepeatable").parent
+    tmpl_dir = workdir / source.name
+    shutil.copytree(source, tmpl_dir)
+
+    return tmpl_dir
+
+
+def test_loaded_once(tmpl_dir: Path):
+    registry = BundleRegistry()
+
+    [bundle] = registry.get(tmpl_dir)
+
+    assert registry.get(tmpl_dir) == [bundle]
+    assert bundle.result_var_name == "tests"
+
+
+def test_reloaded_on_change(tmpl_dir: Path):
+    registry = BundleRegistry()
+    [before] = registry.get(tmpl_dir)
+
+    (tmpl_dir / "bundles.py").write_text(BUNDLES, encoding="utf-8")
+
+    [after] = registry.get(tmpl_dir)
+    assert after is not before
+    assert list(after.model_fields) == ["name"]
+
+
+def test_invalidate(tmpl_dir: Path):
+    registry = BundleRegistry()
+    [before] = registry.get(tmpl_dir)
+
+    registry.invalidate(tmpl_dir)
+
+    assert registry.get(tmpl_dir) != [before]
+
+
+@pytest.mark.parametrize("source, message", [
+    ("bundles = [", "Something went wrong in the bundles.py"),
+    ("names = []", "Template does not have bundles list variable"),
+])
+def test_broken_bundles(tmpl_dir: Path, source: str, message: str):
+    (tmpl_dir / "bundles.py").write_text(source, encoding="utf-8")
+
+    with pytest.raises(ValueError, match=message):
+        BundleRegistry().get(tmpl_dir)
@@ -0,0 +1,70 @@
+import json
+import os
+import tracemalloc
+from contextlib import nullcontext
+from pathlib import Path
+
+import pytest
+
+import core.tracing
+from core.config import TRACE_ENV, TRACE_MEMORY_ENV
+from core.render import render_document
+from core.templates import get_template_path
+from core.tracing import enable_tracing, span
+
+
+@pytest.fixture
+def trace_path(workdir: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """ Trace file of the test, tracing is turned off again after it """
+    monkeypatch.setattr(core.tracing, "_tracer", None)
+    monkeypatch.setenv(TRACE_ENV, "")
+    monkeypatch.setenv(TRACE_MEMORY_ENV, "")
+
+    return workdir / "trace" / "trace.jsonl"
+
+
+def read_records(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_disabled(trace_path: Path):
+    assert isinstance(span("render"), nullcontext)
+
+
+def test_nested_spans(trace_path: Path):
+    enable_tracing(str(trace_path))
+
+    with span("row", index=1):
+        with span("render", template="t"):
+            pass
+
+    inner, outer = read_records(trace_path)
+    assert (inner["name"], inner["depth"], inner["template"]) == ("render", 1, "t")
+    assert (outer["name"], outer["depth"], outer["index"]) == ("row", 0, 1)
+    assert outer["wall_ms"] >= inner["wall_ms"] and inner["peak_kib"] is None
+    # worker processes started later trace to the same file
+    assert os.environ[TRACE_ENV] == str(trace_path)
+
+
+def test_memory_peaks(trace_path: Path):
+    enable_tracing(str(trace_path), memory=True)
+    try:
+        with span("outer"):
+            with span("inner"):
+                data = bytearray(1024 * 1024)
+            del data
+    finally:
+        tracemalloc.stop()
+
+    inner, outer = read_records(trace_path)
+    assert inner["peak_kib"] >= 1024
+    # peaks of nested spans count for the outer ones
+    assert outer["peak_kib"] >= inner["peak_kib"]
+
+
+def test_render_stages(trace_path: Path, workdir: Path):
+    enable_tracing(str(trace_path))
+
+    render_document(get_template_path("_TestRepeatable"), {"tests": []}, workdir / "result.docx")
+
+    assert [record["name"] for record in read_records(trace_path)] == ["load_template", "render", "save"]
@@ -0,0 +1,95 @@
+import pytest
+from pydantic import ValidationError
+
+from core.batch import validate_row
+from core.common_bundles import ObjectInfoBundle
+from core.prevalidation import prevalidate
+from core.templates import get_template_path, get_tmpl_bundles
+from core.validation import (
+    get_field_validator, precompile_column_validators, precompile_validators, validate_bundle, validate_field
+)
+
+
+@pytest.fixture
+def nested_bundles():
+    return get_tmpl_bundles(get_template_path("_TestNested").parent)
+
+
+@pytest.mark.parametrize("row, message", [
+    ({"test_data": [1]}, "Item 0 of test_data must be an object"),
+    ({"test_data": [{"test": 1}, "x"]}, "Item 1 of test_data must be an object"),
+    ({"test_data": {"a": 1}}, "test_data must be a list"),
+    ({"test_data": 5}, "test_data must be a list"),
+    ([{"test": 1}], "A row must be an object"),
+])
+def test_validate_row_shape(nested_bundles, row, message):
+    with pytest.raises(ValueError, match=message):
+        validate_row(nested_bundles, row, streams=False)
+
+
+def test_validate_row_stream_path_without_streams(nested_bundles):
+    with pytest.raises(ValueError, match="test_data must be a list"):
+        validate_row(nested_bundles, {"test_data": "items.jsonl"}, streams=False)
+
+
+def test_validate_row(nested_bundles):
+    [(_, items)] = validate_row(nested_bundles, {"test_data": [{"test": 5}, {}]}, streams=False)
+
+    assert [item.test for item in items] == [5, 45.78]
+
+
+def test_validate_bundle_shape():
+    with pytest.raises(ValueError, match="must be an object, got str"):
+        validate_bundle(ObjectInfoBundle, "apart_no")
+
+
+def test_validate_bundle_errors():
+    with pytest.raises(ValidationError):
+        validate_bundle(ObjectInfoBundle, {"apart_no": "x", "object_id": "1.2", "object_address": "a", "area": 1})
+
+
+def test_prevalidate_shape(nested_bundles):
+    errors = prevalidate(nested_bundles, [{"test_data": [{"test": 1}]}, [1], {"test_data": [1]}, {"test_data": 1}])
+
+    assert [(error.index, error.field) for error in errors] == [(2, "row"), (3, "test_data.0"), (4, "test_data")]
+
+
+def test_field_validators_are_built_once():
+    validators = precompile_validators(ObjectInfoBundle)
+
+    assert precompile_validators(ObjectInfoBundle) is validators
+    assert get_field_validator(ObjectInfoBundle, "object_id") is validators["object_id"]
+
+
+@pytest.mark.parametrize("field, value, expected, valid", [
+    ("apart_no", "12", 12, True),
+    ("apart_no", "двенадцать", None, False),
+    ("object_id", "11232.12313", "11232.12313", True),
+    ("object_id", "1.", None, False),
+    ("area_adjacent", None, None, True),
+])
+def test_validate_field(field: str, value, expected, valid: bool):
+    result, success = validate_field(ObjectInfoBundle, field, value)
+
+    assert success == valid
+    if valid:
+        assert result == expected
+    else:
+        assert isinstance(result, ValidationError)
+
+
+def test_column_validators():
+    validators = precompile_column_validators(ObjectInfoBundle)
+
+    assert validators["apart_no"].validate_python(["1", 2]) == [1, 2]
+    with pytest.raises(ValidationError) as info:
+        validators["object_id"].validate_python(["11.2", "x", "3.4"])
+    assert [error["loc"] for error in info.value.errors()] == [(1,)]
+
+
+def test_validate_bundle():
+    instance = validate_bundle(
+        ObjectInfoBundle, {"apart_no": "3", "object_id": "12.5", "object_address": "a", "area": 40, "extra": 1}
+    )
+
+    assert instance.apart_no == 3 and instance.area_adjacent is None